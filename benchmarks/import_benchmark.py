@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Import paths measured, each in a fresh interpreter.
+TARGETS = {
+    'reader': 'import src.reader',
+    'recorder': 'from src import DatasetRecorder',
+}
+# Modules the reader path must not load.
+CAPTURE_MODULES = ('cv2', 'pynput', 'sounddevice', 'mss', 'pyscreenshot', 'yaml', 'src.recorder',
+                   'src.screenshot_recorder', 'src.mouse_keyboard_recorder', 'src.audio_recorder',
+                   'src.frame_sources', 'src.shared_capture', 'src.encoder')
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': sorted(sys.modules)}}))
+"""
+
+def _environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+def measure(statement, runs=5):
+    # Wall time of the import statement alone (interpreter startup is not
+    # counted), in `runs` fresh processes after one warm-up run that
+    # compiles the bytecode.
+    samples, modules = [], []
+    for run in range(runs + 1):
+        output = subprocess.run([sys.executable, '-c', _PROBE.format(statement=statement)], cwd=ROOT,
+                                env=_environment(), capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if run:
+            samples.append(result['seconds'])
+        modules = result['modules']
+    return samples, modules
+
+def slowest_imports(statement, count=10):
+    # Modules with the largest cumulative import time, from -X importtime.
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=ROOT, env=_environment(),
+                            capture_output=True, text=True, check=True).stderr
+    times = []
+    for line in stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indented module name>"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+    return [{'module': name, 'cumulative_ms': micros / 1000} for micros, name in sorted(times, reverse=True)[:count]]
+
+def run_benchmark(runs=5, targets=None):
+    results = {}
+    for name, statement in (targets or TARGETS).items():
+        samples, modules = measure(statement, runs)
+        results[name] = {
+            'statement': statement,
+            'import_ms': {'median': 1000 * statistics.median(samples), 'min': 1000 * min(samples),
+                          'max': 1000 * max(samples)},
+            'modules_loaded': len(modules),
+            'capture_modules': [module for module in CAPTURE_MODULES if module in modules],
+            'slowest': slowest_imports(statement),
+        }
+    return {
+        'benchmark': 'imports',
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'parameters': {'runs': runs},
+        'results': results,
+    }
+
+def compare_results(current, baseline, tolerance=0.1):
+    # Import paths whose median time grew by more than tolerance (relative).
+    regressions = []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        new_ms, old_ms = result['import_ms']['median'], old['import_ms']['median']
+        if new_ms > old_ms * (1 + tolerance):
+            regressions.append({'metric': f'{name}.import_ms.median', 'baseline': old_ms, 'current': new_ms})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the import cost of the reader and recorder paths")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters per import path")
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.runs)
+    failed = bool(report['results']['reader']['capture_modules'])
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare_results(report, json.load(f), args.tolerance)
+        failed = failed or bool(report['regressions'])
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+import numpy as np
+import yaml
+
+# Add the project root directory to the Python path
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from src.recorder import DatasetRecorder
+from src.scheduler import DeadlineScheduler
+from src.mouse_keyboard_recorder import MouseKeyboardRecorder
+from src.audio_recorder import AudioRecorder
+
+# Metrics compared against a baseline: dotted path into the results and
+# whether a larger value is better.
+REGRESSION_METRICS = [
+    ('throughput.frames_per_s', True),
+    ('throughput.events_per_s', True),
+    ('latency_ms.all.p95', False),
+    ('drops.total', False),
+    ('memory.peak_rss_mb', False),
+    ('storage.bytes_per_minute', False),
+]
+
+class SyntheticInputRecorder(MouseKeyboardRecorder):
+    # Drives the real MouseKeyboardRecorder handlers (trajectory simplifier,
+    # key masking) from a scripted loop instead of pynput listeners: the
+    # pointer circles the screen, with a click and a key stroke every
+    # click_every events.
+    def __init__(self, output_queue, config, rate, click_every=20, activity=None):
+        super().__init__(output_queue, config, activity)
+        self.scheduler = DeadlineScheduler(rate)
+        self.click_every = click_every
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if self.simplifier:
+            self._expire_thread = threading.Thread(target=self._expire_moves, daemon=True)
+            self._expire_thread.start()
+
+    def stop(self):
+        self.scheduler.stop()
+        if self._thread:
+            self._thread.join(timeout=5)
+        super().stop()
+
+    def _run(self):
+        self.scheduler.start()
+        while self.running:
+            tick = self.scheduler.wait()
+            if tick is None:
+                break
+            angle = tick / 50
+            x, y = int(960 + 400 * math.cos(angle)), int(540 + 300 * math.sin(angle))
+            step = tick % self.click_every
+            if step == 0:
+                self._on_click(x, y, 'Button.left', True)
+            elif step == 1:
+                self._on_click(x, y, 'Button.left', False)
+            elif step == 2:
+                self._on_press('a')
+            elif step == 3:
+                self._on_release('a')
+            else:
+                self._on_move(x, y)
+
+class SyntheticAudioRecorder(AudioRecorder):
+    # Feeds a sine tone through the real callback and ring buffer at the
+    # configured sample rate, without PortAudio.
+    def __init__(self, audio_writer, config, block_frames=1024):
+        super().__init__(audio_writer, config)
+        self.block_frames = block_frames
+        self.scheduler = DeadlineScheduler(self.samplerate / block_frames)
+
+    def stop(self):
+        self.scheduler.stop()
+        super().stop()
+
+    def _record(self):
+        t = np.arange(self.block_frames) / self.samplerate
+        block = np.repeat((0.25 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)[:, None], self.channels, axis=1)
+        self.scheduler.start()
+        while self.running:
+            if self.scheduler.wait() is None:
+                break
+            self._callback(block, self.block_frames, None, None)
+
+class BenchmarkRecorder(DatasetRecorder):
+    # The real recording pipeline with synthetic sources, instrumented to
+    # measure how long each event takes to reach the event log and how far
+    # the writer falls behind.
+    def __init__(self, config_path, input_rate, sample_interval=0.1, **overrides):
+        super().__init__(config_path, **overrides)
+        self.input_rate = input_rate
+        self.sample_interval = sample_interval
+        self.latencies = defaultdict(list)
+        self.backlog_samples = []
+        self._sampler = None
+
+    def _create_input_recorder(self):
+        return SyntheticInputRecorder(self.data_queue, self.config, self.input_rate, activity=self.activity)
+
+    def _create_audio_recorder(self):
+        return SyntheticAudioRecorder(self.audio_writer, self.config)
+
+    def _start_recorders(self):
+        super()._start_recorders()
+        self._sampler = threading.Thread(target=self._sample_backlog, daemon=True)
+        self._sampler.start()
+
+    def _stop_recorders(self):
+        super()._stop_recorders()
+        if self._sampler:
+            self._sampler.join()
+
+    def _write_event(self, timestamp, event_type, data):
+        super()._write_event(timestamp, event_type, data)
+        self.latencies[event_type].append(time.time() - timestamp)
+
+    def _sample_backlog(self):
+        while self.running:
+            encoder = self.encoder.backlog() if self.encoder else 0
+            self.backlog_samples.append((self.data_queue.qsize(), encoder, len(self.pending_rows)))
+            time.sleep(self.sample_interval)
+
+def _percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = 1000 * np.asarray(values)
+    return {'count': len(values), 'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+            'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+def _directory_bytes(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    return total
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except Exception:
+        return None
+
+def collect_results(recorder, duration):
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    counts = {event_type: len(values) for event_type, values in recorder.latencies.items()}
+    frames = sum(count for event_type, count in counts.items() if event_type.startswith('screenshot'))
+    buffer_stats = recorder.data_queue.stats()
+    screenshot_stats = recorder.screenshot_recorder.stats()
+    audio_stats = recorder.audio_recorder.stats()
+    drops = {
+        'stream_buffers': {name: stats['dropped'] for name, stats in buffer_stats.items()},
+        'spilled': {name: stats['spilled'] for name, stats in buffer_stats.items()},
+        'screenshot_skipped_ticks': screenshot_stats.get('skipped', 0) + screenshot_stats.get('dropped', 0),
+        'input_skipped_ticks': recorder.mouse_keyboard_recorder.scheduler.skipped,
+        'audio_overflow_frames': audio_stats['overflow_frames'],
+    }
+    drops['total'] = (sum(drops['stream_buffers'].values()) + drops['screenshot_skipped_ticks']
+                      + drops['input_skipped_ticks'] + drops['audio_overflow_frames'])
+    queue_sizes, encoder_backlog, pending_rows = zip(*recorder.backlog_samples) if recorder.backlog_samples \
+        else ((0,), (0,), (0,))
+    storage = {name: _directory_bytes(os.path.join(recorder.session_dir, name))
+               for name in ('screenshots', 'audio', 'index')}
+    storage['total'] = _directory_bytes(recorder.session_dir)
+    storage['events'] = storage['total'] - sum(storage[name] for name in ('screenshots', 'audio', 'index'))
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {
+        'duration_s': duration,
+        'throughput': {
+            'events_per_s': len(all_latencies) / duration,
+            'frames_per_s': frames / duration,
+            'by_type_per_s': {event_type: count / duration for event_type, count in counts.items()},
+            'audio_frames_per_s': audio_stats['frames_written'] / duration,
+        },
+        'latency_ms': {'all': _percentiles(all_latencies),
+                       **{event_type: _percentiles(values) for event_type, values in recorder.latencies.items()}},
+        'drops': drops,
+        'backlog': {
+            'queue_max': max(queue_sizes), 'queue_mean': float(np.mean(queue_sizes)),
+            'encoder_max': max(encoder_backlog), 'pending_rows_max': max(pending_rows),
+            'buffer_high_water': {name: stats['high_water'] for name, stats in buffer_stats.items()},
+        },
+        'memory': {'peak_rss_mb': self_rss, 'peak_rss_children_mb': children_rss},
+        'storage': {'bytes': storage, 'bytes_per_minute': storage['total'] / duration * 60},
+        'screenshot': screenshot_stats,
+        'audio': audio_stats,
+    }
+
+def run_benchmark(duration=10, fps=10, width=1920, height=1080, input_rate=200, static=False,
+                  config_path=None, keep_output=False, overrides=None):
+    output_dir = tempfile.mkdtemp(prefix='recorder_benchmark_')
+    settings = {
+        'base_output_dir': output_dir,
+        'screenshot_freq': fps,
+        'screenshot_backend': 'synthetic',
+        'screenshot_backend_options': {'width': width, 'height': height, 'static': static},
+    }
+    settings.update(overrides or {})
+    recorder = BenchmarkRecorder(config_path or os.path.join(ROOT, 'config.yaml'), input_rate, **settings)
+    try:
+        started = time.monotonic()
+        recorder.start_recording(duration)
+        elapsed = time.monotonic() - started
+        results = collect_results(recorder, duration)
+        results['shutdown_s'] = elapsed - duration
+    finally:
+        if not keep_output:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    return {
+        'benchmark': 'recorder',
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'parameters': {'duration': duration, 'fps': fps, 'width': width, 'height': height,
+                       'input_rate': input_rate, 'static': static, 'overrides': overrides or {}},
+        'output_dir': output_dir if keep_output else None,
+        'results': results,
+    }
+
+def _lookup(results, path):
+    for key in path.split('.'):
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+def compare_results(current, baseline, tolerance=0.1):
+    # Returns the metrics that got worse than baseline by more than
+    # tolerance (relative).
+    regressions = []
+    for path, higher_is_better in REGRESSION_METRICS:
+        new, old = _lookup(current['results'], path), _lookup(baseline['results'], path)
+        if new is None or old is None:
+            continue
+        if higher_is_better:
+            worse = new < old * (1 - tolerance)
+        else:
+            worse = new > old * (1 + tolerance) and new - old > 1e-9
+        if worse:
+            regressions.append({'metric': path, 'baseline': old, 'current': new})
+    return regressions
+
+def _parse_override(text):
+    key, _, value = text.partition('=')
+    return key, yaml.safe_load(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recording pipeline with synthetic sources")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to record")
+    parser.add_argument('--fps', type=float, default=10, help="screenshot frequency")
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--input-rate', type=float, default=200, help="synthetic input events per second")
+    parser.add_argument('--static', action='store_true', help="capture identical frames")
+    parser.add_argument('--config', default=None, help="config file, defaults to the repository config.yaml")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="override a config key, e.g. --set encoder_workers=4")
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change counted as a regression")
+    parser.add_argument('--keep-output', action='store_true', help="keep the recorded session")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.duration, args.fps, args.width, args.height, args.input_rate, args.static,
+                           args.config, args.keep_output, dict(_parse_override(text) for text in args.set))
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare_results(report, json.load(f), args.tolerance)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if report.get('regressions') else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,12 @@
 import sys
 import os
-import csv
-from collections import defaultdict
+from collections import Counter
 
 # Add the project root directory to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from src.recorder import DatasetRecorder
+from src.event_log import EventLog
 import logging
 import time
 
@@ -51,30 +51,23 @@ def main():
     if session_dir:
         logging.info(f"\nRecorded data saved in: {session_dir}")
         logging.info("Recorded data includes:")
-        logging.info(f"- Screenshots: {len([f for f in os.listdir(session_dir) if f.startswith('screenshot')])}")
+        logging.info(f"- Screenshots: {len(os.listdir(os.path.join(session_dir, 'screenshots')))}")
         logging.info(f"- Audio file: audio.wav")
 
-        # Count and display events from the CSV file
-        csv_path = os.path.join(session_dir, 'events.csv')
-        event_counts = defaultdict(int)
-        with open(csv_path, 'r') as csvfile:
-            csv_reader = csv.reader(csvfile)
-            next(csv_reader)  # Skip header
-            for row in csv_reader:
-                event_type = row[1]
-                event_counts[event_type] += 1
+        # Count and display events from the binary event log
+        event_log = EventLog(session_dir)
+        event_counts = Counter(event_type for _, event_type, _ in event_log.rows())
 
         logging.info("\nEvent counts:")
         for event_type, count in event_counts.items():
             logging.info(f"- {event_type}: {count}")
 
-        # Display the first few lines of the CSV file
-        logging.info("\nFirst few lines of the events.csv file:")
-        with open(csv_path, 'r') as csvfile:
-            for i, line in enumerate(csvfile):
-                if i > 10:  # Display only the first 10 lines after the header
-                    break
-                logging.info(line.strip())
+        # Display the first few events
+        logging.info("\nFirst few events:")
+        for i, row in enumerate(event_log.rows()):
+            if i >= 10:  # Display only the first 10 events
+                break
+            logging.info(row)
 
 if __name__ == "__main__":
     main()
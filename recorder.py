@@ -11,6 +11,10 @@ import sounddevice as sd
 from pynput import mouse, keyboard
 import cv2
 
+from src.buffers import StreamBuffers
+from src.audio_storage import AudioSegmentWriter
+from src.audio_recorder import float_to_pcm16
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -100,8 +104,8 @@ class AudioRecorder:
             if status:
                 logging.warning(f"Audio callback status: {status}")
             if self.running:
-                current_time = time.time()
-                self.output_queue.put(('audio', current_time, indata.copy()))
+                first_sample_time = time.time() - frames / self.samplerate
+                self.output_queue.put(('audio', first_sample_time, indata.copy()))
 
         try:
             with sd.InputStream(callback=callback, channels=self.channels, samplerate=self.samplerate):
@@ -117,12 +121,13 @@ class DatasetRecorder:
     def __init__(self, base_output_dir="dataset", screenshot_freq=10):
         self.base_output_dir = base_output_dir
         self.screenshot_freq = screenshot_freq
-        self.data_queue = queue.Queue()
+        self.data_queue = StreamBuffers({'audio': {'maxsize': 512, 'policy': 'spill'}})
         self.running = False
         self.session_dir = None
         self.save_thread = None
         self.csv_file = None
         self.csv_writer = None
+        self.audio_writer = None
 
     def start_recording(self, duration):
         self.session_dir = self._create_session_dir()
@@ -134,6 +139,8 @@ class DatasetRecorder:
         self.screenshot_recorder = ScreenshotRecorder(self.data_queue, self.screenshot_freq)
         self.mouse_keyboard_recorder = MouseKeyboardRecorder(self.data_queue)
         self.audio_recorder = AudioRecorder(self.data_queue)
+        self.audio_writer = AudioSegmentWriter(os.path.join(self.session_dir, 'audio'),
+                                               self.audio_recorder.samplerate, self.audio_recorder.channels)
 
         self.screenshot_recorder.start()
         self.mouse_keyboard_recorder.start()
@@ -158,6 +165,9 @@ class DatasetRecorder:
             self.save_thread.join()
         if self.csv_file:
             self.csv_file.close()
+        if self.audio_writer:
+            self.audio_writer.close()
+        self.data_queue.close()
         logging.info("Recording stopped and data saved.")
 
     def flush_data(self):
@@ -177,34 +187,15 @@ class DatasetRecorder:
         return session_dir
 
     def _save_data(self):
-        screenshot_count = 0
-        audio_data = []
-        last_save_time = time.time()
-
         while self.running or not self.data_queue.empty():
             try:
                 event_type, timestamp, data = self.data_queue.get(timeout=1)
                 self._process_event(event_type, timestamp, data)
-
-                if event_type == 'screenshot':
-                    screenshot_count += 1
-                elif event_type == 'audio':
-                    audio_data.append(data)
-
-                # Periodic saving
-                if time.time() - last_save_time > 5:  # Save every 5 seconds
-                    self._save_audio_data(audio_data)
-                    audio_data = []
-                    last_save_time = time.time()
-
             except queue.Empty:
                 continue
             except Exception as e:
                 logging.error(f"Error saving data: {e}")
 
-        # Final save
-        self._save_audio_data(audio_data)
-
     def _process_event(self, event_type, timestamp, data):
         if event_type == 'screenshot':
             filename = f"screenshot_{int(timestamp)}.png"
@@ -213,19 +204,13 @@ class DatasetRecorder:
             self.csv_writer.writerow([timestamp, event_type, filename])
             logging.debug(f"Saved screenshot: {filename}")
         elif event_type == 'audio':
-            logging.debug(f"Recorded audio chunk at {timestamp}")
+            # Audio goes to rolling segments; the first chunk's timestamp
+            # anchors the segment index.
+            self.audio_writer.write(float_to_pcm16(data), timestamp)
         else:
             self.csv_writer.writerow([timestamp, event_type, data])
             logging.debug(f"Recorded event: {event_type} at {timestamp}")
 
-    def _save_audio_data(self, audio_data):
-        if audio_data:
-            try:
-                audio_path = os.path.join(self.session_dir, f"audio_{int(time.time())}.npy")
-                np.save(audio_path, np.concatenate(audio_data))
-                logging.info(f"Saved audio data to {audio_path}")
-            except Exception as e:
-                logging.error(f"Error saving audio data: {e}")
 
 
 
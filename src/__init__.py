@@ -1,6 +1,24 @@
-from .recorder import DatasetRecorder
-from .screenshot_recorder import ScreenshotRecorder
-from .mouse_keyboard_recorder import MouseKeyboardRecorder
-from .audio_recorder import AudioRecorder
+import importlib
+
+# The recorder classes are imported on first use, so reading sessions
+# (src.reader, src.event_log, ...) never loads the capture side: OpenCV,
+# the input hooks, PortAudio or the screenshot backends.
+_LAZY_EXPORTS = {
+    'DatasetRecorder': 'recorder',
+    'ScreenshotRecorder': 'screenshot_recorder',
+    'MouseKeyboardRecorder': 'mouse_keyboard_recorder',
+    'AudioRecorder': 'audio_recorder',
+}
 
 __all__ = ['DatasetRecorder', 'ScreenshotRecorder', 'MouseKeyboardRecorder', 'AudioRecorder']
+
+def __getattr__(name):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
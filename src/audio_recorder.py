@@ -1,34 +1,130 @@
 import threading
+import time
 import logging
-import sounddevice as sd
 import numpy as np
 
+from .ring_buffer import AudioRingBuffer
+
+def float_to_pcm16(block):
+    return (np.clip(block, -1.0, 1.0) * 32767).astype('<i2')
+
 class AudioRecorder:
-    def __init__(self, audio_file, config):
-        self.audio_file = audio_file
+    def __init__(self, audio_writer, config):
+        self.audio_writer = audio_writer
         self.channels = config['audio_channels']
         self.samplerate = config['audio_samplerate']
+        self.write_interval = config.get('audio_write_interval', 0.25)
+        self.ring = AudioRingBuffer(int(self.samplerate * config.get('audio_buffer_seconds', 10)), self.channels)
+        self.first_sample_time = None
+        self.callback_status_count = 0
+        self.frames_written = 0
+        self.silence_frames = 0
+        self._overflow_seen = 0
         self.running = False
+        self._threads = []
+        # (writer, cut time, switched event) while a session rollover is
+        # waiting for the audio to reach the cut.
+        self._next_writer = None
+        self._lock = threading.Lock()
 
     def start(self):
         self.running = True
-        threading.Thread(target=self._record, daemon=True).start()
+        self._threads = [threading.Thread(target=self._record, daemon=True),
+                         threading.Thread(target=self._write, daemon=True)]
+        for thread in self._threads:
+            thread.start()
         logging.info("Audio recorder started")
 
     def stop(self):
         self.running = False
-        logging.info("Audio recorder stopped")
+        for thread in self._threads:
+            thread.join(timeout=5)
+        logging.info(f"Audio recorder stopped: {self.stats()}")
 
-    def _record(self):
-        def callback(indata, frames, time, status):
-            if status:
-                logging.warning(f"Audio callback status: {status}")
-            if self.running:
-                self.audio_file.writeframes(indata.tobytes())
+    def switch_writer(self, writer, cut_time):
+        # Samples from cut_time on go to writer; the block that crosses the
+        # cut is split, so consecutive sessions share no sample and miss
+        # none. The returned event is set once the old writer is no longer
+        # used.
+        switched = threading.Event()
+        with self._lock:
+            self._next_writer = (writer, cut_time, switched)
+        return switched
 
+    def stats(self):
+        return {**self.ring.stats(), 'frames_written': self.frames_written, 'silence_frames': self.silence_frames,
+                'callback_status': self.callback_status_count}
+
+    def _callback(self, indata, frames, time_info, status):
+        # Runs on the PortAudio thread: no logging, no I/O, no allocation.
+        if status:
+            self.callback_status_count += 1
+        if self.running:
+            if self.first_sample_time is None:
+                self.first_sample_time = time.time() - frames / self.samplerate
+            self.ring.write(indata)
+
+    def _record(self):
         try:
-            with sd.InputStream(callback=callback, channels=self.channels, samplerate=self.samplerate):
+            # sounddevice needs PortAudio; imported here so the module loads
+            # on machines without an audio stack.
+            import sounddevice as sd
+            with sd.InputStream(callback=self._callback, channels=self.channels, samplerate=self.samplerate,
+                                dtype='float32'):
                 while self.running:
                     sd.sleep(100)
         except Exception as e:
             logging.error(f"Audio recording error: {e}")
+
+    def _write(self):
+        reported_status = 0
+        while self.running:
+            time.sleep(self.write_interval)
+            self._drain()
+            if self.callback_status_count != reported_status:
+                reported_status = self.callback_status_count
+                logging.warning(f"Audio callback reported {reported_status} status flags so far: {self.ring.stats()}")
+        self._drain()
+        with self._lock:
+            if self._next_writer is not None:
+                self._switch()
+
+    def _drain(self):
+        try:
+            with self._lock:
+                block = self.ring.read()
+                # The ring only drops frames while it is full, so whatever
+                # it dropped since the last drain came right after this
+                # block. Silence stands in for it, keeping every later
+                # sample (and the segment index) at its real time.
+                dropped = self.ring.overflow_frames - self._overflow_seen
+                if dropped:
+                    self._overflow_seen += dropped
+                    self.silence_frames += dropped
+                    block = np.concatenate((block, np.zeros((dropped, self.channels), dtype=block.dtype)))
+                if not len(block):
+                    return
+                # Derived from the sample count rather than the wall clock,
+                # so a writer that starts mid-recording gets the exact time
+                # of its first sample.
+                start_time = self.first_sample_time + self.frames_written / self.samplerate
+                if self._next_writer is not None:
+                    cut = int(round((self._next_writer[1] - start_time) * self.samplerate))
+                    if cut < len(block):
+                        cut = max(cut, 0)
+                        if cut:
+                            self.audio_writer.write(float_to_pcm16(block[:cut]), start_time)
+                        self.frames_written += cut
+                        start_time += cut / self.samplerate
+                        block = block[cut:]
+                        self._switch()
+                self.audio_writer.write(float_to_pcm16(block), start_time)
+                self.frames_written += len(block)
+        except Exception as e:
+            logging.error(f"Audio write error: {e}")
+
+    def _switch(self):
+        writer, _, switched = self._next_writer
+        self.audio_writer = writer
+        self._next_writer = None
+        switched.set()
@@ -0,0 +1,305 @@
+import os
+import time
+import struct
+import logging
+import threading
+
+import numpy as np
+
+AUDIO_DIR = 'audio'
+SEGMENT_INDEX_FILE = 'segments.idx'
+# One record per segment, appended when the segment is opened: wall-clock
+# time of its first sample and that sample's offset in the whole recording.
+SEGMENT_RECORD = struct.Struct('<dQ')
+SEGMENT_DTYPE = np.dtype([('start_time', '<f8'), ('sample_offset', '<u8')])
+AUDIO_EXTENSIONS = {'wav': '.wav', 'flac': '.flac'}
+# Canonical 44-byte PCM header; the RIFF and data sizes sit at fixed
+# offsets so they can be patched in place.
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+RIFF_SIZE_OFFSET = 4
+
+def audio_segment_name(segment, audio_format):
+    return f"segment_{segment:05d}{AUDIO_EXTENSIONS[audio_format]}"
+
+def sync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _wav_data_offset(path):
+    # (data offset, channels, sample width) from a WAV file's chunks.
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        channels = sample_width = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                _, channels, _, _, _, bits = struct.unpack('<HHIIHH', f.read(16))
+                sample_width = bits // 8
+                f.seek(size - 16, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                return f.tell(), channels, sample_width
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+def _patch_wav_sizes(fd, data_offset, data_bytes):
+    os.pwrite(fd, struct.pack('<I', data_offset - 8 + data_bytes), RIFF_SIZE_OFFSET)
+    os.pwrite(fd, struct.pack('<I', data_bytes), data_offset - 4)
+
+def wav_memmap(path):
+    # Memory-maps the PCM data of a WAV file as (samples, channels) without
+    # reading it, so windows can be sliced straight from the page cache.
+    offset, channels, sample_width = _wav_data_offset(path)
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[sample_width]
+    # A recorder that was killed leaves size 0 in the header; trust the file.
+    samples = (os.path.getsize(path) - offset) // (sample_width * channels)
+    if not samples:
+        return np.zeros((0, channels), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(samples, channels))
+
+class _WavSegment:
+    # 16-bit PCM WAV whose header sizes are patched when the segment is
+    # synced and when it is closed, rather than seeking back on every write
+    # as the wave module does. A killed recorder leaves a header that is at
+    # most one sync behind, and recover_audio() fixes that.
+    def __init__(self, path, samplerate, channels):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(WAV_HEADER.pack(b'RIFF', 36, b'WAVE', b'fmt ', 16, 1, channels, samplerate,
+                                        samplerate * channels * 2, channels * 2, 16, b'data', 0))
+        self.data_bytes = 0
+
+    def write(self, block):
+        data = block.astype('<i2', copy=False).tobytes()
+        self.file.write(data)
+        self.data_bytes += len(data)
+
+    def sync(self):
+        self.file.flush()
+        _patch_wav_sizes(self.file.fileno(), WAV_HEADER.size, self.data_bytes)
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.flush()
+        _patch_wav_sizes(self.file.fileno(), WAV_HEADER.size, self.data_bytes)
+        self.file.close()
+
+class _FlacSegment:
+    def __init__(self, path, samplerate, channels):
+        import soundfile
+        self.path = path
+        self.file = soundfile.SoundFile(path, 'w', samplerate=samplerate, channels=channels,
+                                        format='FLAC', subtype='PCM_16')
+
+    def write(self, block):
+        self.file.write(block)
+
+    def sync(self):
+        self.file.flush()
+        sync_path(self.path)
+
+    def close(self):
+        self.file.close()
+
+class AudioSegmentWriter:
+    # Writes int16 PCM into rolling segments of segment_seconds each (raw
+    # WAV, or lossless FLAC when soundfile is installed) and records every
+    # segment's start in segments.idx. Segments stay far below WAV's 4 GB
+    # limit however long the session runs. sync() may be called from
+    # another thread; it makes every sample written so far durable,
+    # including those in segments closed since the last sync.
+    def __init__(self, directory, samplerate, channels, segment_seconds=300, audio_format='wav'):
+        if audio_format not in AUDIO_EXTENSIONS:
+            raise ValueError(f"Unknown audio format: {audio_format}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.samplerate = samplerate
+        self.channels = channels
+        self.segment_samples = int(segment_seconds * samplerate)
+        self.audio_format = audio_format
+        self.start_time = None
+        self.samples_written = 0
+        self.segments = 0
+        self._segment = None
+        self._samples_in_segment = 0
+        self._closed_segments = []
+        self._synced_samples = 0
+        self._lock = threading.Lock()
+        self._index_file = open(os.path.join(directory, SEGMENT_INDEX_FILE), 'ab')
+
+    def write(self, block, first_sample_time=None):
+        with self._lock:
+            if self.start_time is None:
+                self.start_time = first_sample_time if first_sample_time is not None else time.time()
+            while len(block):
+                if self._segment is None or self._samples_in_segment >= self.segment_samples:
+                    self._open_segment()
+                take = min(len(block), self.segment_samples - self._samples_in_segment)
+                self._segment.write(block[:take])
+                self._samples_in_segment += take
+                self.samples_written += take
+                block = block[take:]
+
+    def sync(self):
+        with self._lock:
+            if self.samples_written == self._synced_samples:
+                return
+            self._synced_samples = self.samples_written
+            for path in self._closed_segments:
+                sync_path(path)
+            self._closed_segments = []
+            if self._segment is not None:
+                self._segment.sync()
+            if not self._index_file.closed:
+                os.fsync(self._index_file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self._index_file.close()
+        logging.info(f"Audio storage: {self.samples_written} samples in {self.segments} segments")
+
+    def _open_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._closed_segments.append(self._segment.path)
+        path = os.path.join(self.directory, audio_segment_name(self.segments, self.audio_format))
+        segment_class = _FlacSegment if self.audio_format == 'flac' else _WavSegment
+        self._segment = segment_class(path, self.samplerate, self.channels)
+        start_time = self.start_time + self.samples_written / self.samplerate
+        self._index_file.write(SEGMENT_RECORD.pack(start_time, self.samples_written))
+        self._index_file.flush()
+        self.segments += 1
+        self._samples_in_segment = 0
+
+def recover_audio(directory):
+    # Makes segments left by a killed recorder readable by other tools:
+    # WAV headers get the sizes of the samples actually on disk (dropping a
+    # partial sample frame) and a partial segments.idx record is cut off.
+    # Returns the number of samples found.
+    index_path = os.path.join(directory, SEGMENT_INDEX_FILE)
+    if os.path.exists(index_path):
+        size = os.path.getsize(index_path)
+        if size % SEGMENT_RECORD.size:
+            with open(index_path, 'r+b') as f:
+                f.truncate(size - size % SEGMENT_RECORD.size)
+    samples = 0
+    segment = 0
+    while os.path.exists(os.path.join(directory, audio_segment_name(segment, 'wav'))):
+        path = os.path.join(directory, audio_segment_name(segment, 'wav'))
+        try:
+            offset, channels, sample_width = _wav_data_offset(path)
+        except (ValueError, struct.error):
+            # Killed before its header was written: the segment holds no
+            # samples, so it and its index record are dropped.
+            logging.warning(f"Removing unreadable audio segment {path}")
+            os.remove(path)
+            if os.path.exists(index_path):
+                with open(index_path, 'r+b') as f:
+                    f.truncate(min(os.path.getsize(index_path), segment * SEGMENT_RECORD.size))
+            break
+        frame_bytes = channels * sample_width
+        data_bytes = (os.path.getsize(path) - offset) // frame_bytes * frame_bytes
+        with open(path, 'r+b') as f:
+            f.truncate(offset + data_bytes)
+            _patch_wav_sizes(f.fileno(), offset, data_bytes)
+        samples += data_bytes // frame_bytes
+        segment += 1
+    return samples
+
+class AudioSegmentReader:
+    # Reads any sample range of a segmented recording, opening only the
+    # segments that overlap it. Sample offsets count from the first sample
+    # of the recording.
+    def __init__(self, directory, samplerate):
+        self.directory = directory
+        self.samplerate = samplerate
+        path = os.path.join(directory, SEGMENT_INDEX_FILE)
+        self.segments = np.fromfile(path, dtype=SEGMENT_DTYPE) if os.path.exists(path) else \
+            np.empty(0, dtype=SEGMENT_DTYPE)
+        self.files = []
+        for segment in range(len(self.segments)):
+            for audio_format in AUDIO_EXTENSIONS:
+                name = audio_segment_name(segment, audio_format)
+                if os.path.exists(os.path.join(directory, name)):
+                    self.files.append(name)
+                    break
+        self._cache = {}
+
+    @property
+    def start_time(self):
+        return float(self.segments['start_time'][0]) if len(self.segments) else None
+
+    @property
+    def total_samples(self):
+        if not len(self.files):
+            return 0
+        last = len(self.files) - 1
+        return int(self.segments['sample_offset'][last]) + self._segment_length(last)
+
+    def sample_range(self, t0, t1):
+        # Sample range [start, end) covering wall-clock [t0, t1), using the
+        # start time of the segment each bound falls into.
+        return self._sample_at(t0), self._sample_at(t1)
+
+    def read_time(self, t0, t1):
+        return self.read(*self.sample_range(t0, t1))
+
+    def read(self, start, end):
+        end = min(end, self.total_samples)
+        offsets = self.segments['sample_offset'][:len(self.files)].astype(np.int64)
+        blocks = []
+        segment = max(int(np.searchsorted(offsets, start, side='right')) - 1, 0)
+        while start < end and segment < len(self.files):
+            local = start - int(offsets[segment])
+            take = min(end - start, self._segment_length(segment) - local)
+            if take > 0:
+                blocks.append(self._read_segment(segment, local, take))
+                start += take
+            segment += 1
+        if not blocks:
+            return np.zeros((0, self._channels()), dtype=np.int16)
+        return np.concatenate(blocks)
+
+    def _sample_at(self, t):
+        if not len(self.segments):
+            return 0
+        segment = max(int(np.searchsorted(self.segments['start_time'], t, side='right')) - 1, 0)
+        entry = self.segments[segment]
+        sample = int(entry['sample_offset']) + int(round((t - entry['start_time']) * self.samplerate))
+        return min(max(sample, 0), self.total_samples)
+
+    def _open(self, segment):
+        if segment not in self._cache:
+            path = os.path.join(self.directory, self.files[segment])
+            if path.endswith('.wav'):
+                self._cache[segment] = wav_memmap(path)
+            else:
+                import soundfile
+                self._cache[segment] = soundfile.SoundFile(path)
+        return self._cache[segment]
+
+    def _segment_length(self, segment):
+        return len(self._open(segment))
+
+    def _channels(self):
+        if not self.files:
+            return 1
+        data = self._open(0)
+        return data.shape[1] if isinstance(data, np.ndarray) else data.channels
+
+    def _read_segment(self, segment, start, frames):
+        data = self._open(segment)
+        if isinstance(data, np.ndarray):
+            return np.array(data[start:start + frames])
+        data.seek(start)
+        return data.read(frames, dtype='int16', always_2d=True)
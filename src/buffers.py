@@ -0,0 +1,201 @@
+import time
+import queue
+import pickle
+import logging
+import tempfile
+import threading
+from collections import deque
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+SPILL = 'spill'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, SPILL)
+
+STREAM_OF_EVENT = {
+    'screenshot': 'screenshot',
+    # Rows for frames already written by the shared memory encoder must
+    # never be dropped, so they travel with the input events.
+    'screenshot_stored': 'input',
+    'mouse_move': 'input',
+    'mouse_click': 'input',
+    'mouse_scroll': 'input',
+    'key_press': 'input',
+    'key_release': 'input',
+    # Only the legacy root recorder.py queues audio chunks, and it sets up
+    # its own 'audio' buffer; the recorder in src/ writes audio through the
+    # ring buffer instead.
+    'audio': 'audio',
+}
+
+DEFAULT_STREAM_BUFFERS = {
+    'screenshot': {'maxsize': 32, 'policy': DROP_OLDEST},
+    'input': {'maxsize': 100000, 'policy': BLOCK},
+}
+
+class SpillFile:
+    # FIFO of pickled items in a temporary file. Writes append at the end,
+    # reads advance from the front, and the file is truncated whenever the
+    # reader catches up.
+    def __init__(self, directory=None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.read_offset = 0
+        self.write_offset = 0
+        self.count = 0
+
+    def append(self, item):
+        self.file.seek(self.write_offset)
+        pickle.dump(item, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.write_offset = self.file.tell()
+        self.count += 1
+
+    def pop(self):
+        self.file.seek(self.read_offset)
+        item = pickle.load(self.file)
+        self.read_offset = self.file.tell()
+        self.count -= 1
+        if self.count == 0:
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_offset = self.write_offset = 0
+        return item
+
+    def close(self):
+        self.file.close()
+
+class BoundedBuffer:
+    # Holds at most maxsize items in memory. What happens to a put into a
+    # full buffer depends on policy: drop the oldest item, drop the new one,
+    # block the producer until there is room, or spill it to disk.
+    def __init__(self, name, maxsize, policy, condition, spill_dir=None, on_discard=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown buffer policy for {name}: {policy}")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.spill = None
+        self.spill_dir = spill_dir
+        self.condition = condition
+        # Called with every item that leaves memory without being returned
+        # by pop(): dropped, or replaced by its pickled copy on disk.
+        self.on_discard = on_discard
+        self.put_count = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked_seconds = 0.0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.items) + (self.spill.count if self.spill else 0)
+
+    def put(self, item, timeout=None):
+        # Called with the condition held.
+        self.put_count += 1
+        if self.spill and self.spill.count:
+            # Keep FIFO order: once items are on disk, newer items follow them.
+            self._spill(item)
+            return
+        if len(self.items) >= self.maxsize:
+            if self.policy == DROP_OLDEST:
+                self._discard(self.items.popleft())
+                self.dropped += 1
+            elif self.policy == DROP_NEWEST:
+                self._discard(item)
+                self.dropped += 1
+                return
+            elif self.policy == SPILL:
+                self._spill(item)
+                return
+            else:
+                start = time.monotonic()
+                full = not self.condition.wait_for(lambda: len(self.items) < self.maxsize, timeout)
+                self.blocked_seconds += time.monotonic() - start
+                if full:
+                    self.put_count -= 1
+                    raise queue.Full
+        self.items.append(item)
+        self.high_water = max(self.high_water, len(self.items))
+
+    def peek(self):
+        return self.items[0] if self.items else None
+
+    def pop(self):
+        item = self.items.popleft()
+        if self.spill and self.spill.count:
+            self.items.append(self.spill.pop())
+        return item
+
+    def stats(self):
+        return {'policy': self.policy, 'maxsize': self.maxsize, 'size': len(self), 'put': self.put_count,
+                'dropped': self.dropped, 'spilled': self.spilled, 'high_water': self.high_water,
+                'blocked_seconds': self.blocked_seconds}
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
+            self.spill = None
+
+    def _spill(self, item):
+        if self.spill is None:
+            self.spill = SpillFile(self.spill_dir)
+        self.spill.append(item)
+        self.spilled += 1
+        self._discard(item)
+
+    def _discard(self, item):
+        if self.on_discard is not None:
+            self.on_discard(item)
+
+class StreamBuffers:
+    # Drop-in replacement for the recorder's data queue: one bounded buffer
+    # per stream, and get() returns the oldest head across all streams so
+    # the writer still sees events in roughly timestamp order.
+    def __init__(self, config=None, spill_dir=None, on_discard=None):
+        self.condition = threading.Condition()
+        self.buffers = {}
+        settings = {name: dict(options) for name, options in DEFAULT_STREAM_BUFFERS.items()}
+        for name, options in (config or {}).items():
+            settings.setdefault(name, {}).update(options)
+        for name, options in settings.items():
+            self.buffers[name] = BoundedBuffer(name, options['maxsize'], options['policy'],
+                                               self.condition, spill_dir, on_discard)
+
+    def put(self, item, block=True, timeout=None):
+        stream = STREAM_OF_EVENT.get(item[0], 'input')
+        if stream not in self.buffers:
+            stream = 'input'
+        with self.condition:
+            self.buffers[stream].put(item, timeout if block else 0)
+            self.condition.notify_all()
+
+    def get(self, block=True, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(self._has_items, timeout if block else 0):
+                raise queue.Empty
+            oldest = min((buffer for buffer in self.buffers.values() if buffer.items),
+                         key=lambda buffer: buffer.peek()[1])
+            item = oldest.pop()
+            self.condition.notify_all()
+            return item
+
+    def empty(self):
+        with self.condition:
+            return not self._has_items()
+
+    def qsize(self):
+        with self.condition:
+            return sum(len(buffer) for buffer in self.buffers.values())
+
+    def stats(self):
+        with self.condition:
+            return {name: buffer.stats() for name, buffer in self.buffers.items()}
+
+    def close(self):
+        with self.condition:
+            for buffer in self.buffers.values():
+                buffer.close()
+        logging.info(f"Stream buffer stats: {self.stats()}")
+
+    def _has_items(self):
+        return any(buffer.items for buffer in self.buffers.values())
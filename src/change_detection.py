@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+
+from .video_storage import VideoFrameReader
+
+def changed_tiles(frame, reference, tile_size):
+    # One boolean per tile_size x tile_size tile, True where any pixel differs.
+    height, width = frame.shape[:2]
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    diff = (frame != reference).reshape(height, width, -1)
+    if rows * tile_size != height or cols * tile_size != width:
+        diff = np.pad(diff, ((0, rows * tile_size - height), (0, cols * tile_size - width), (0, 0)))
+    # Channels stay folded into the tile's last axis: reducing over a short
+    # trailing channel axis first is several times slower.
+    return diff.reshape(rows, tile_size, cols, -1).any(axis=(1, 3))
+
+def extract_tiles(frame, mask, tile_size):
+    rows, cols = mask.shape
+    height, width = frame.shape[:2]
+    pad = [(0, rows * tile_size - height), (0, cols * tile_size - width)] + [(0, 0)] * (frame.ndim - 2)
+    padded = np.pad(frame, pad)
+    tiles = padded.reshape(rows, tile_size, cols, tile_size, *frame.shape[2:]).swapaxes(1, 2)
+    positions = np.argwhere(mask).astype(np.int32)
+    return positions, tiles[mask]
+
+def apply_tiles(frame, positions, pixels, tile_size):
+    height, width = frame.shape[:2]
+    for (row, col), tile in zip(positions, pixels):
+        top, left = row * tile_size, col * tile_size
+        bottom, right = min(top + tile_size, height), min(left + tile_size, width)
+        frame[top:bottom, left:right] = tile[:bottom - top, :right - left]
+    return frame
+
+class FrameChangeDetector:
+    # Decides how each frame is stored: 'keyframe' (full image), 'unchanged'
+    # (identical to the previous frame, nothing stored) or 'delta' (only the
+    # tiles that differ from the current keyframe).
+    def __init__(self, tile_size=32, keyframe_interval=100, max_delta_ratio=0.5, pool=None):
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.max_delta_ratio = max_delta_ratio
+        self.counts = {'keyframe': 0, 'delta': 0, 'unchanged': 0}
+        # The keyframe and previous frame are kept by reference; with a
+        # FramePool they are retained so their buffers are not reused.
+        self.pool = pool
+        self.keyframe = None
+        self.previous = None
+        self.reset()
+
+    def reset(self):
+        self._hold('keyframe', None)
+        self._hold('previous', None)
+        self.deltas_since_keyframe = 0
+
+    def classify(self, frame):
+        if (self.keyframe is None or frame.shape != self.keyframe.shape
+                or self.deltas_since_keyframe >= self.keyframe_interval):
+            return self._store('keyframe', frame, None)
+        if np.array_equal(frame, self.previous):
+            self.counts['unchanged'] += 1
+            return 'unchanged', None
+        mask = changed_tiles(frame, self.keyframe, self.tile_size)
+        if mask.mean() > self.max_delta_ratio:
+            return self._store('keyframe', frame, None)
+        return self._store('delta', frame, mask)
+
+    def stats(self):
+        return dict(self.counts)
+
+    def _store(self, kind, frame, mask):
+        if kind == 'keyframe':
+            self._hold('keyframe', frame)
+            self.deltas_since_keyframe = 0
+        else:
+            self.deltas_since_keyframe += 1
+        self._hold('previous', frame)
+        self.counts[kind] += 1
+        return kind, mask
+
+    def _hold(self, name, frame):
+        if self.pool is not None:
+            if frame is not None:
+                self.pool.retain(frame)
+            self.pool.release(getattr(self, name))
+        setattr(self, name, frame)
+
+def save_delta(path, keyframe_name, frame, mask, tile_size):
+    positions, pixels = extract_tiles(frame, mask, tile_size)
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, keyframe=np.array(keyframe_name), tile_size=np.array(tile_size),
+                            positions=positions, pixels=pixels)
+
+def read_image(path):
+    # RGB (or grayscale) image file as stored by write_image. OpenCV is
+    # imported here so code that only reads events and audio never loads it.
+    import cv2
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(path)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if image.ndim == 3 else image
+
+def load_frame(screenshots_dir, filename, readers=None):
+    # Returns the RGB frame stored under filename, rebuilding deltas from
+    # their keyframe. Video references look like segment_00000.mkv#12;
+    # callers loading many of them pass a VideoReaderCache as readers so
+    # each segment is not opened and indexed again for every frame.
+    if '#' in filename:
+        if readers is not None:
+            return readers.get(screenshots_dir).read_reference(filename)
+        reader = VideoFrameReader(screenshots_dir)
+        try:
+            return reader.read_reference(filename)
+        finally:
+            reader.close()
+    path = os.path.join(screenshots_dir, filename)
+    if not filename.endswith('.npz'):
+        return read_image(path)
+    with np.load(path) as delta:
+        frame = load_frame(screenshots_dir, str(delta['keyframe']), readers)
+        return apply_tiles(frame, delta['positions'], delta['pixels'], int(delta['tile_size']))
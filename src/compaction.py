@@ -0,0 +1,451 @@
+import os
+import re
+import csv
+import sys
+import json
+import time
+import wave
+import zlib
+import shutil
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import yaml
+
+from .audio_recorder import float_to_pcm16
+from .audio_storage import AudioSegmentWriter, AudioSegmentReader, AUDIO_DIR, wav_memmap
+from .change_detection import load_frame, apply_tiles
+from .encoder import FrameEncoderPool
+from .event_log import (EventLogWriter, EventLog, EVENT_CODES, EVENT_TYPES, SCREENSHOT_EVENTS,
+                        parse_event_data)
+from .screenshot_storage import ScreenshotStorage
+from .session_index import build_session_index
+from .video_storage import VideoFrameReader, VideoReaderCache
+
+COMPACTION_FILE = 'compaction.json'
+ORIGINALS_DIR = 'original'
+STAGING_SUFFIX = '.compacting'
+LEGACY_EVENTS_FILE = 'events.csv'
+LEGACY_AUDIO_FILE = 'audio.wav'
+LEGACY_FRAME_PATTERN = re.compile(r'^screenshot_\d+\.png$')
+LEGACY_AUDIO_CHUNK_PATTERN = re.compile(r'^audio_(\d+)\.npy$')
+AUDIO_BLOCK_SECONDS = 10
+
+def _is_candidate(path):
+    # A legacy session (events.csv but no binary log), one whose in-place
+    # compaction was interrupted, or one that is already done.
+    return (os.path.exists(os.path.join(path, COMPACTION_FILE))
+            or os.path.isfile(os.path.join(path, ORIGINALS_DIR, LEGACY_EVENTS_FILE))
+            or (os.path.isfile(os.path.join(path, LEGACY_EVENTS_FILE))
+                and not os.path.exists(os.path.join(path, 'events.bin'))))
+
+def find_sessions(root):
+    if _is_candidate(root):
+        return [root]
+    sessions = []
+    for directory, subdirs, _ in os.walk(root):
+        subdirs[:] = sorted(name for name in subdirs if not name.endswith(STAGING_SUFFIX))
+        if _is_candidate(directory):
+            sessions.append(directory)
+            subdirs[:] = []
+    return sessions
+
+def legacy_inputs(session_dir):
+    # Names of the legacy files in session_dir, events.csv last: in-place
+    # compaction moves them in this order, so once events.csv is under
+    # original/ everything else is too.
+    names = []
+    for name in sorted(os.listdir(session_dir)):
+        path = os.path.join(session_dir, name)
+        if name == 'screenshots' and os.path.isdir(path):
+            names.append(name)
+        elif LEGACY_FRAME_PATTERN.match(name) or LEGACY_AUDIO_CHUNK_PATTERN.match(name) or name == LEGACY_AUDIO_FILE:
+            names.append(name)
+    if os.path.isfile(os.path.join(session_dir, LEGACY_EVENTS_FILE)):
+        names.append(LEGACY_EVENTS_FILE)
+    return names
+
+def _source_dir(session_dir):
+    originals = os.path.join(session_dir, ORIGINALS_DIR)
+    if os.path.isfile(os.path.join(originals, LEGACY_EVENTS_FILE)):
+        return originals
+    return session_dir
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, files in os.walk(path) for name in files)
+
+def _frames_dir(source, filename):
+    # Frames were written to screenshots/ by the first DatasetRecorder and
+    # next to events.csv by the standalone recorder.
+    screenshots = os.path.join(source, 'screenshots')
+    if os.path.exists(os.path.join(screenshots, filename)):
+        return screenshots
+    return source
+
+def _read_rows(source):
+    # (timestamp, event type, data) rows, skipping the header and a last
+    # line cut short by a killed recorder.
+    with open(os.path.join(source, LEGACY_EVENTS_FILE), newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 3:
+                continue
+            try:
+                yield float(row[0]), row[1], row[2]
+            except ValueError:
+                continue
+
+def _frame_rate(source, default):
+    # Median capture rate of the session, used as the video frame rate.
+    times = [timestamp for timestamp, event_type, _ in _read_rows(source) if event_type in SCREENSHOT_EVENTS]
+    intervals = np.diff(times)
+    intervals = intervals[intervals > 0]
+    return float(1 / np.median(intervals)) if len(intervals) else default
+
+def _checksum(array):
+    return zlib.crc32(np.ascontiguousarray(array))
+
+class _FrameReader:
+    # Decodes stored frames in log order for verification, keeping the
+    # last keyframe so consecutive deltas do not decode it again.
+    def __init__(self, directory):
+        self.directory = directory
+        self.video = None
+        self._cached = (None, None)
+
+    def read(self, reference):
+        if '#' in reference:
+            if self.video is None:
+                self.video = VideoFrameReader(self.directory)
+            return self.video.read_reference(reference)
+        if not reference.endswith('.npz'):
+            return self._image(reference)
+        with np.load(os.path.join(self.directory, reference)) as delta:
+            frame = self._image(str(delta['keyframe'])).copy()
+            return apply_tiles(frame, delta['positions'], delta['pixels'], int(delta['tile_size']))
+
+    def _image(self, name):
+        if self._cached[0] != name:
+            self._cached = (name, load_frame(self.directory, name))
+        return self._cached[1]
+
+    def close(self):
+        if self.video is not None:
+            self.video.close()
+
+def _convert_events(source, staging, config, result):
+    # One pass over events.csv: input events go straight to the binary log,
+    # frames are re-stored through ScreenshotStorage (change detection,
+    # image format or video segments as configured) and the log gets the
+    # new references. Returns a checksum per frame for verification.
+    encoder = FrameEncoderPool(workers=0)
+    storage = ScreenshotStorage(os.path.join(staging, 'screenshots'), config, encoder,
+                                _frame_rate(source, config.get('screenshot_freq', 10)))
+    log = EventLogWriter(staging)
+    readers = VideoReaderCache()
+    checksums = []
+    first_timestamp = None
+    try:
+        for timestamp, event_type, text in _read_rows(source):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            result['events'] += 1
+            if event_type not in SCREENSHOT_EVENTS:
+                log.append(timestamp, event_type, parse_event_data(event_type, text))
+                continue
+            try:
+                frame = load_frame(_frames_dir(source, text), text, readers)
+            except FileNotFoundError:
+                # The row keeps its old reference rather than losing the event.
+                logging.warning(f"Missing frame {text} in {source}")
+                result['missing_frames'] += 1
+                checksums.append(None)
+                log.append(timestamp, event_type, text)
+                continue
+            row, job = storage.save(timestamp, frame)
+            if job is not None:
+                job.result()
+            log.append(*row)
+            checksums.append(_checksum(frame))
+            result['frames'] += 1
+    finally:
+        storage.close()
+        encoder.shutdown()
+        log.close()
+        readers.close()
+    return checksums, first_timestamp
+
+def _legacy_audio(source, samplerate, start_time):
+    # Yields (first sample time, int16 block) from audio.wav, or from the
+    # audio_<time>.npy chunks of the standalone recorder, each saved at
+    # <time> right after its last sample.
+    wav_path = os.path.join(source, LEGACY_AUDIO_FILE)
+    if os.path.exists(wav_path):
+        # audio.wav has no start time; the first event is the best anchor.
+        samples = wav_memmap(wav_path)
+        block = samplerate * AUDIO_BLOCK_SECONDS
+        for start in range(0, len(samples), block):
+            yield start_time, np.ascontiguousarray(samples[start:start + block], dtype='<i2')
+        return
+    chunks = sorted((int(match.group(1)), name) for name in os.listdir(source)
+                    for match in [LEGACY_AUDIO_CHUNK_PATTERN.match(name)] if match)
+    for saved_at, name in chunks:
+        data = np.load(os.path.join(source, name))
+        if data.ndim == 1:
+            data = data[:, None]
+        data = float_to_pcm16(data) if data.dtype.kind == 'f' else data.astype('<i2')
+        yield saved_at - len(data) / samplerate, data
+
+def _convert_audio(source, staging, config, start_time, result):
+    # Merges the legacy audio into rolling segments. Returns the audio
+    # description for the session index and a checksum of the samples.
+    samplerate = config['audio_samplerate']
+    wav_path = os.path.join(source, LEGACY_AUDIO_FILE)
+    if os.path.exists(wav_path):
+        with wave.open(wav_path, 'rb') as wav:
+            samplerate = wav.getframerate()
+    writer = None
+    checksum = 0
+    for first_sample_time, block in _legacy_audio(source, samplerate, start_time or 0.0):
+        if writer is None:
+            writer = AudioSegmentWriter(os.path.join(staging, AUDIO_DIR), samplerate, block.shape[1],
+                                        segment_seconds=config.get('audio_segment_seconds', 300),
+                                        audio_format=config.get('audio_format', 'wav'))
+        writer.write(block, first_sample_time)
+        checksum = zlib.crc32(block, checksum)
+    if writer is None:
+        return None, None
+    writer.close()
+    result['audio_samples'] = writer.samples_written
+    return {'dir': AUDIO_DIR, 'samplerate': samplerate, 'channels': writer.channels}, checksum
+
+def _verify(source, staging, checksums, audio, audio_checksum, max_error):
+    # Reads the compacted session back: every event must match its CSV row
+    # and every frame and audio sample the original. Frames are compared
+    # by checksum and, when max_error allows lossy formats, by the largest
+    # per-pixel difference.
+    log = EventLog(staging)
+    rows = list(_read_rows(source))
+    if len(rows) != len(log):
+        raise ValueError(f"Compacted log has {len(log)} events, events.csv has {len(rows)}")
+    reader = _FrameReader(os.path.join(staging, 'screenshots'))
+    readers = VideoReaderCache()
+    frame = 0
+    try:
+        for (timestamp, event_type, text), record in zip(rows, log.records):
+            # A screenshot row may come back as a repeat or delta.
+            stored_type = EVENT_TYPES[record['type']]
+            expected_type = event_type if event_type in EVENT_CODES else 'unknown'
+            if record['timestamp'] != timestamp or (stored_type != expected_type and not (
+                    event_type in SCREENSHOT_EVENTS and stored_type in SCREENSHOT_EVENTS)):
+                raise ValueError(f"Event at {timestamp} ({event_type}) does not match the compacted log")
+            data = log.event_data(record)
+            if event_type in SCREENSHOT_EVENTS:
+                checksum = checksums[frame]
+                frame += 1
+                if checksum is None:
+                    continue
+                stored = reader.read(data)
+                if _checksum(stored) == checksum:
+                    continue
+                original = load_frame(_frames_dir(source, text), text, readers)
+                if not max_error or stored.shape != original.shape or \
+                        np.abs(stored.astype(np.int16) - original).max() > max_error:
+                    raise ValueError(f"Frame {data} does not match {text}")
+            else:
+                expected = parse_event_data(event_type, text) if event_type in EVENT_CODES else \
+                    f"{event_type}:{text}"
+                if data != expected:
+                    raise ValueError(f"Event at {timestamp} has {data!r}, expected {expected!r}")
+    finally:
+        reader.close()
+        readers.close()
+    if audio is not None:
+        audio_reader = AudioSegmentReader(os.path.join(staging, audio['dir']), audio['samplerate'])
+        block = audio['samplerate'] * AUDIO_BLOCK_SECONDS
+        checksum = 0
+        for start in range(0, audio_reader.total_samples, block):
+            checksum = zlib.crc32(np.ascontiguousarray(audio_reader.read(start, start + block)), checksum)
+        if checksum != audio_checksum:
+            raise ValueError("Compacted audio does not match the original")
+
+def _write_marker(directory, result):
+    with open(os.path.join(directory, COMPACTION_FILE), 'w') as f:
+        json.dump(result, f, indent=2)
+
+def _commit(session_dir, staging, output_dir, result):
+    # Moves the verified staging directory into place. Every step can be
+    # repeated after an interruption, and the marker is written last.
+    if output_dir != session_dir:
+        if os.path.exists(output_dir):
+            raise FileExistsError(f"{output_dir} already exists")
+        _write_marker(staging, result)
+        os.makedirs(os.path.dirname(os.path.abspath(output_dir)), exist_ok=True)
+        os.replace(staging, output_dir)
+        return
+    originals = os.path.join(session_dir, ORIGINALS_DIR)
+    if _source_dir(session_dir) == session_dir:
+        for name in legacy_inputs(session_dir):
+            os.makedirs(originals, exist_ok=True)
+            os.replace(os.path.join(session_dir, name), os.path.join(originals, name))
+    for name in os.listdir(staging):
+        target = os.path.join(session_dir, name)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.remove(target)
+        os.replace(os.path.join(staging, name), target)
+    _write_marker(session_dir, result)
+    os.rmdir(staging)
+
+def _delete_originals(session_dir, output_dir):
+    if output_dir != session_dir:
+        if os.path.exists(session_dir):
+            shutil.rmtree(session_dir)
+    elif os.path.exists(os.path.join(session_dir, ORIGINALS_DIR)):
+        shutil.rmtree(os.path.join(session_dir, ORIGINALS_DIR))
+
+def compact_session(session_dir, config, output_dir=None, delete_originals=False, verify=True, max_error=0):
+    # Converts one legacy session (PNG frames, events.csv, audio.wav or
+    # .npy chunks) into the current layout: binary event log, frames stored
+    # as configured, segmented audio and a session index. The work happens
+    # in a staging directory next to the output and is verified before it
+    # replaces anything, so an interrupted run is simply redone. In place,
+    # the legacy files are moved to original/ (or deleted with
+    # delete_originals); with output_dir the source is left alone unless
+    # delete_originals is set.
+    start = time.perf_counter()
+    output_dir = output_dir or session_dir
+    result = {'session': session_dir, 'output': output_dir, 'status': 'compacted', 'events': 0, 'frames': 0,
+              'missing_frames': 0, 'audio_samples': 0, 'input_bytes': 0, 'output_bytes': 0, 'seconds': 0.0}
+    if os.path.exists(os.path.join(output_dir, COMPACTION_FILE)):
+        if delete_originals:
+            _delete_originals(session_dir, output_dir)
+        result['status'] = 'skipped'
+        return result
+    staging = os.path.abspath(output_dir).rstrip(os.sep) + STAGING_SUFFIX
+    try:
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        source = _source_dir(session_dir)
+        result['input_bytes'] = sum(_tree_size(os.path.join(source, name)) for name in legacy_inputs(source))
+        checksums, first_timestamp = _convert_events(source, staging, config, result)
+        audio, audio_checksum = _convert_audio(source, staging, config, first_timestamp, result)
+        build_session_index(staging, audio)
+        if verify:
+            _verify(source, staging, checksums, audio, audio_checksum, max_error)
+        result['output_bytes'] = _tree_size(staging)
+        result['seconds'] = time.perf_counter() - start
+        _commit(session_dir, staging, output_dir, result)
+        if delete_originals:
+            _delete_originals(session_dir, output_dir)
+    except Exception as e:
+        logging.error(f"Could not compact {session_dir}: {e}")
+        result['status'] = 'failed'
+        result['error'] = str(e)
+        shutil.rmtree(staging, ignore_errors=True)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def summarize(results, elapsed):
+    summary = {'sessions': len(results), 'seconds': elapsed}
+    for status in ('compacted', 'skipped', 'failed'):
+        summary[status] = sum(1 for result in results if result['status'] == status)
+    for key in ('events', 'frames', 'missing_frames', 'audio_samples', 'input_bytes', 'output_bytes'):
+        summary[key] = sum(result[key] for result in results)
+    rate = 1 / elapsed if elapsed > 0 else 0.0
+    summary['frames_per_s'] = summary['frames'] * rate
+    summary['events_per_s'] = summary['events'] * rate
+    summary['input_mb_per_s'] = summary['input_bytes'] / 1e6 * rate
+    summary['compression_ratio'] = summary['input_bytes'] / summary['output_bytes'] if summary['output_bytes'] else None
+    return summary
+
+def compact_dataset(root, config, output_root=None, workers=None, delete_originals=False, verify=True,
+                    max_error=0, progress=None):
+    # Compacts every session under root, one session per worker process.
+    # progress(result) is called as each session finishes.
+    workers = workers or os.cpu_count() or 1
+    jobs = []
+    for session_dir in find_sessions(root):
+        output_dir = None
+        if output_root:
+            output_dir = os.path.normpath(os.path.join(output_root, os.path.relpath(session_dir, root)))
+        jobs.append((session_dir, config, output_dir, delete_originals, verify, max_error))
+    start = time.perf_counter()
+    results = []
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            results.append(compact_session(*job))
+            if progress:
+                progress(results[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            for future in as_completed([executor.submit(compact_session, *job) for job in jobs]):
+                results.append(future.result())
+                if progress:
+                    progress(results[-1])
+    return results, summarize(results, time.perf_counter() - start)
+
+def _parse_override(text):
+    key, _, value = text.partition('=')
+    return key, yaml.safe_load(value)
+
+def _print_result(result):
+    line = f"{result['status']:9} {result['session']}"
+    if result['status'] == 'compacted':
+        line += (f": {result['events']} events, {result['frames']} frames, "
+                 f"{result['input_bytes'] / 1e6:.1f} MB -> {result['output_bytes'] / 1e6:.1f} MB "
+                 f"in {result['seconds']:.1f} s")
+    elif result['status'] == 'failed':
+        line += f": {result['error']}"
+    print(line, flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact legacy recording sessions into the current layout")
+    parser.add_argument('paths', nargs='+', help="session directories or dataset trees to search for sessions")
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                         'config.yaml'),
+                        help="storage settings, defaults to the repository config.yaml")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="override a config key, e.g. --set screenshot_storage=video")
+    parser.add_argument('--output', help="write compacted sessions under this directory instead of in place")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="sessions compacted in parallel")
+    parser.add_argument('--delete-originals', action='store_true',
+                        help="remove the legacy files once the compacted session is verified")
+    parser.add_argument('--no-verify', action='store_true', help="skip reading the compacted session back")
+    parser.add_argument('--max-error', type=int, default=0,
+                        help="largest per-pixel difference accepted, for lossy frame formats")
+    parser.add_argument('--report', help="write the per-session results and summary as JSON here")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    config.update(dict(_parse_override(text) for text in args.set))
+    logging.basicConfig(level=config.get('log_level', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+    results, elapsed = [], 0.0
+    for path in args.paths:
+        output_root = os.path.join(args.output, os.path.basename(os.path.normpath(path))) if args.output else None
+        path_results, summary = compact_dataset(path, config, output_root, args.workers, args.delete_originals,
+                                                not args.no_verify, args.max_error, _print_result)
+        results += path_results
+        elapsed += summary['seconds']
+    summary = summarize(results, elapsed)
+    print(f"{summary['compacted']} compacted, {summary['skipped']} skipped, {summary['failed']} failed in "
+          f"{summary['seconds']:.1f} s: {summary['frames_per_s']:.1f} frames/s, "
+          f"{summary['input_mb_per_s']:.1f} MB/s read, compression {summary['compression_ratio'] or 0:.2f}x")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'summary': summary, 'sessions': results}, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import os
+import random
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from .audio_storage import AudioSegmentReader, wav_memmap
+from .change_detection import apply_tiles, read_image
+from .session_index import SessionIndex, build_session_index, INDEX_DIR
+from .video_storage import VideoFrameReader
+
+class FrameCache:
+    # Bounded LRU of decoded frames shared by all loader threads.
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+        frame = load()
+        frame.setflags(write=False)
+        with self._lock:
+            self._frames[key] = frame
+            while len(self._frames) > self.maxsize:
+                self._frames.popitem(last=False)
+        return frame
+
+class _OpenSession:
+    def __init__(self, session_dir):
+        if not os.path.exists(os.path.join(session_dir, INDEX_DIR)):
+            build_session_index(session_dir)
+        self.index = SessionIndex(session_dir)
+        self.screenshots_dir = os.path.join(session_dir, 'screenshots')
+        audio = self.index.meta.get('audio')
+        self.audio = None
+        if audio and 'dir' in audio:
+            self.audio = AudioSegmentReader(os.path.join(session_dir, audio['dir']), audio['samplerate'])
+        elif audio and os.path.exists(os.path.join(session_dir, audio['file'])):
+            self.audio = wav_memmap(os.path.join(session_dir, audio['file']))
+        self.video = None
+        self.video_lock = threading.Lock()
+
+    def read_audio(self, start, end):
+        if isinstance(self.audio, AudioSegmentReader):
+            return self.audio.read(start, end)
+        return np.array(self.audio[start:end])
+
+class SessionDataset:
+    # Training samples aligned on recorded frames: sample i is the frame at
+    # time t plus the input events in [t - event_window, t) and the audio in
+    # [t - audio_window, t). Only the sample table lives in memory; events
+    # and audio are memory mapped and frames are decoded on access.
+    def __init__(self, session_dirs, event_window=1.0, audio_window=1.0, frame_stride=1,
+                 frame_cache_size=64):
+        if isinstance(session_dirs, str):
+            session_dirs = [session_dirs]
+        self.session_dirs = list(session_dirs)
+        self.event_window = event_window
+        self.audio_window = audio_window
+        self.frame_cache_size = frame_cache_size
+        sessions, positions = [], []
+        for session_id, session_dir in enumerate(self.session_dirs):
+            count = len(self._session(session_id).index.frames_time)
+            frames = np.arange(0, count, frame_stride, dtype=np.int64)
+            sessions.append(np.full(len(frames), session_id, dtype=np.int32))
+            positions.append(frames)
+        self.sample_session = np.concatenate(sessions) if sessions else np.zeros(0, np.int32)
+        self.sample_frame = np.concatenate(positions) if positions else np.zeros(0, np.int64)
+
+    def __len__(self):
+        return len(self.sample_session)
+
+    def __getitem__(self, i):
+        session_id = int(self.sample_session[i])
+        session = self._session(session_id)
+        position = int(self.sample_frame[i])
+        timestamp, _, reference = session.index.frame(position)
+        sample = {'session': self.session_dirs[session_id], 'timestamp': timestamp, 'reference': reference,
+                  'frame': self._frame(session_id, reference),
+                  'events': session.index.events(timestamp - self.event_window, timestamp),
+                  'audio': None}
+        if session.audio is not None and self.audio_window:
+            start, end = session.index.audio_range(timestamp - self.audio_window, timestamp)
+            sample['audio'] = session.read_audio(start, end)
+        return sample
+
+    def __getstate__(self):
+        # Worker processes reopen sessions themselves instead of receiving
+        # copies of memory-mapped arrays.
+        state = dict(self.__dict__)
+        state.pop('_open', None)
+        state.pop('_cache', None)
+        return state
+
+    def cache_stats(self):
+        cache = self._frame_cache()
+        return {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache._frames)}
+
+    def _session(self, session_id):
+        if '_open' not in self.__dict__:
+            self._open = {}
+        if session_id not in self._open:
+            self._open[session_id] = _OpenSession(self.session_dirs[session_id])
+        return self._open[session_id]
+
+    def _frame_cache(self):
+        if '_cache' not in self.__dict__:
+            self._cache = FrameCache(self.frame_cache_size)
+        return self._cache
+
+    def _frame(self, session_id, reference):
+        return self._frame_cache().get((session_id, reference), lambda: self._decode(session_id, reference))
+
+    def _decode(self, session_id, reference):
+        session = self._session(session_id)
+        if '#' in reference:
+            with session.video_lock:
+                if session.video is None:
+                    session.video = VideoFrameReader(session.screenshots_dir)
+                return session.video.read_reference(reference)
+        path = os.path.join(session.screenshots_dir, reference)
+        if reference.endswith('.npz'):
+            with np.load(path) as delta:
+                frame = self._frame(session_id, str(delta['keyframe'])).copy()
+                return apply_tiles(frame, delta['positions'], delta['pixels'], int(delta['tile_size']))
+        return read_image(path)
+
+_worker_dataset = None
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+def _load_in_worker(i):
+    return _worker_dataset[i]
+
+class PrefetchLoader:
+    # Iterates over a SessionDataset while up to `prefetch` samples are
+    # being loaded in the background. Threads are usually enough because
+    # frame decoding releases the GIL; use_processes=True moves loading into
+    # worker processes for CPU-heavy pipelines.
+    def __init__(self, dataset, batch_size=None, workers=4, prefetch=16, shuffle=False, seed=0,
+                 use_processes=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = max(prefetch, 1)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.use_processes = use_processes
+        self.epoch = 0
+
+    def __len__(self):
+        if self.batch_size:
+            return -(-len(self.dataset) // self.batch_size)
+        return len(self.dataset)
+
+    def __iter__(self):
+        order = list(range(len(self.dataset)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        self.epoch += 1
+        if self.use_processes:
+            executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.dataset,))
+            load = _load_in_worker
+        else:
+            executor = ThreadPoolExecutor(self.workers)
+            load = self.dataset.__getitem__
+        batch = []
+        try:
+            pending = deque()
+            indices = iter(order)
+            for i in indices:
+                pending.append(executor.submit(load, i))
+                if len(pending) >= self.prefetch:
+                    break
+            while pending:
+                sample = pending.popleft().result()
+                for i in indices:
+                    pending.append(executor.submit(load, i))
+                    break
+                if not self.batch_size:
+                    yield sample
+                    continue
+                batch.append(sample)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
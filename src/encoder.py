@@ -0,0 +1,125 @@
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+
+import numpy as np
+import cv2
+
+IMAGE_FORMATS = {
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION),
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+
+_scratch = threading.local()
+MAX_SCRATCH_SHAPES = 4
+
+def image_extension(image_format):
+    return IMAGE_FORMATS[image_format][0]
+
+def to_bgr(frame):
+    # OpenCV encoders want BGR. The reorder goes into a per-thread scratch
+    # buffer, one per frame shape, instead of allocating a converted copy
+    # of every frame; thumbnails and full frames written by the same
+    # thread keep their own buffers. The caller's frame is never modified,
+    # since it may still be pooled or referenced.
+    code = cv2.COLOR_GRAY2BGR if frame.ndim == 2 else cv2.COLOR_RGB2BGR
+    key = frame.shape[:2] + (3, frame.dtype.str)
+    buffers = getattr(_scratch, 'bgr', None)
+    if buffers is None:
+        buffers = _scratch.bgr = {}
+    buffer = buffers.get(key)
+    if buffer is None:
+        if len(buffers) >= MAX_SCRATCH_SHAPES:
+            # Shapes that come and go (a focused window region) do not pile
+            # up: the oldest buffer is dropped.
+            del buffers[next(iter(buffers))]
+        buffer = buffers[key] = np.empty(key[:3], dtype=frame.dtype)
+    return cv2.cvtColor(frame, code, dst=buffer)
+
+def write_image(path, frame, image_format='png', quality=None):
+    extension, quality_flag = IMAGE_FORMATS[image_format]
+    params = [quality_flag, quality] if quality is not None else []
+    if frame.ndim == 3:
+        frame = to_bgr(frame)
+    ok, encoded = cv2.imencode(extension, frame, params)
+    if not ok:
+        raise IOError(f"Could not encode {path} as {image_format}")
+    with open(path, 'wb') as f:
+        f.write(encoded)
+    return len(encoded)
+
+def _timed(fn, args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+class FrameEncoderPool:
+    # Runs frame encoders in worker processes so the writer thread only
+    # queues work. With workers=0 jobs run inline, which keeps single-core
+    # machines and tests free of process start-up costs.
+    def __init__(self, workers=2, max_backlog=32):
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self.executor = None
+        if workers > 0:
+            # Forking a process that hosts pynput and PortAudio threads is
+            # unsafe, so workers are always spawned fresh.
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.peak_backlog = 0
+        self.encode_seconds = 0.0
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(_timed(fn, args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            while self.backlog() >= self.max_backlog:
+                self._wait_any()
+            future = self.executor.submit(_timed, fn, args)
+        with self._lock:
+            self.submitted += 1
+            self._pending.add(future)
+            self.peak_backlog = max(self.peak_backlog, len(self._pending))
+        future.add_done_callback(self._on_done)
+        return future
+
+    def backlog(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        with self._lock:
+            done = self.completed + self.failed
+            return {'workers': self.workers, 'submitted': self.submitted, 'completed': self.completed,
+                    'failed': self.failed, 'backlog': len(self._pending), 'peak_backlog': self.peak_backlog,
+                    'encode_ms_mean': 1000 * self.encode_seconds / done if done else 0.0}
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        logging.info(f"Frame encoder stats: {self.stats()}")
+
+    def _wait_any(self):
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, return_when=FIRST_COMPLETED)
+
+    def _on_done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self.encode_seconds += future.result()[1]
@@ -0,0 +1,312 @@
+import os
+import ast
+import csv
+import json
+import zlib
+import struct
+import logging
+
+import numpy as np
+
+EVENT_LOG_FILE = 'events.bin'
+STRING_TABLE_FILE = 'events.strings'
+BATCH_FILE = 'events.batches'
+CSV_FILE = 'events.csv'
+MAGIC = b'AIEL'
+VERSION = 1
+
+# Code 0 is reserved for unknown events.
+EVENT_TYPES = ['unknown', 'mouse_move', 'mouse_click', 'mouse_scroll', 'key_press', 'key_release',
+               'screenshot', 'screenshot_repeat', 'screenshot_delta']
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+SCREENSHOT_EVENTS = ('screenshot', 'screenshot_repeat', 'screenshot_delta')
+
+# Fixed-size little-endian record. button, key and ref are ids in the
+# string table, with 0 meaning "no string".
+RECORD = struct.Struct('<dBBHiiiiII')
+EVENT_DTYPE = np.dtype([('timestamp', '<f8'), ('type', 'u1'), ('pressed', 'u1'), ('button', '<u2'),
+                        ('x', '<i4'), ('y', '<i4'), ('dx', '<i4'), ('dy', '<i4'),
+                        ('key', '<u4'), ('ref', '<u4')])
+HEADER = struct.Struct('<4sHH')
+# One frame per flushed batch of records, in events.batches: index of its
+# first record, record count, CRC-32 of the records and the size of the
+# string table they need. events.bin itself stays a plain record array so
+# it can be memory mapped; recovery uses the frames to find the last
+# intact batch.
+BATCH = struct.Struct('<QIII')
+CSV_HEADER = ["Timestamp", "EventType", "Data"]
+
+def sync_file(f):
+    # fdatasync where available: the file's size and data, without forcing
+    # a separate metadata write.
+    getattr(os, 'fdatasync', os.fsync)(f.fileno())
+
+def format_event_data(event_type, data):
+    if event_type == 'mouse_move':
+        return f"x={data[0]}, y={data[1]}"
+    elif event_type == 'mouse_click':
+        return f"x={data[0]}, y={data[1]}, button={data[2]}, pressed={data[3]}"
+    elif event_type == 'mouse_scroll':
+        return f"x={data[0]}, y={data[1]}, dx={data[2]}, dy={data[3]}"
+    elif event_type in ['key_press', 'key_release']:
+        return f"key={data}"
+    else:
+        return str(data)
+
+def parse_event_data(event_type, text):
+    # Inverse of format_event_data for rows read back from an events.csv.
+    # The first recorder versions wrote input events as tuple reprs, which
+    # are accepted too.
+    if event_type in ('key_press', 'key_release'):
+        return text[4:] if text.startswith('key=') else text
+    if event_type not in ('mouse_move', 'mouse_click', 'mouse_scroll'):
+        return text
+    if text.startswith('('):
+        values = ast.literal_eval(text)
+        return (int(values[0]), int(values[1])) + tuple(values[2:])
+    values = dict(part.split('=', 1) for part in text.split(', '))
+    x, y = int(float(values['x'])), int(float(values['y']))
+    if event_type == 'mouse_click':
+        return (x, y, values['button'], values['pressed'] == 'True')
+    if event_type == 'mouse_scroll':
+        return (x, y, int(float(values['dx'])), int(float(values['dy'])))
+    return (x, y)
+
+class EventLogWriter:
+    # Appends fixed-size event records to events.bin. Strings (keys, mouse
+    # buttons, frame references) are interned once in events.strings, one
+    # JSON string per line, and records carry their line number. Every
+    # flush writes one checksummed batch; sync() makes everything flushed
+    # so far durable.
+    def __init__(self, session_dir, batch_size=256):
+        self.session_dir = session_dir
+        self.batch_size = batch_size
+        self.strings = {'': 0}
+        self.records_written = 0
+        self._batch = bytearray(RECORD.size * batch_size)
+        self._batch_count = 0
+        self._file = open(os.path.join(session_dir, EVENT_LOG_FILE), 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self._strings_file = open(os.path.join(session_dir, STRING_TABLE_FILE), 'w', encoding='utf-8')
+        self._strings_file.write(json.dumps('') + '\n')
+        self._batch_file = open(os.path.join(session_dir, BATCH_FILE), 'wb')
+        self._synced_records = 0
+
+    def intern(self, value):
+        string_id = self.strings.get(value)
+        if string_id is None:
+            string_id = self.strings[value] = len(self.strings)
+            self._strings_file.write(json.dumps(value) + '\n')
+        return string_id
+
+    def append(self, timestamp, event_type, data):
+        code = EVENT_CODES.get(event_type, 0)
+        pressed = button = x = y = dx = dy = key = ref = 0
+        if event_type in SCREENSHOT_EVENTS:
+            ref = self.intern(str(data))
+        elif event_type in ('key_press', 'key_release'):
+            key = self.intern(str(data))
+        elif code:
+            x, y = int(data[0]), int(data[1])
+            if event_type == 'mouse_click':
+                button = self.intern(str(data[2]))
+                pressed = int(bool(data[3]))
+            elif event_type == 'mouse_scroll':
+                dx, dy = int(data[2]), int(data[3])
+        else:
+            ref = self.intern(f"{event_type}:{data}")
+        RECORD.pack_into(self._batch, self._batch_count * RECORD.size, timestamp, code, pressed, button,
+                         x, y, dx, dy, key, ref)
+        self._batch_count += 1
+        if self._batch_count == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Strings first, so a batch never reaches the disk before the
+        # strings it refers to. The new count is published last: a sync()
+        # that sees it finds the records already handed to the OS.
+        self._strings_file.flush()
+        written = self.records_written
+        if self._batch_count:
+            records = memoryview(self._batch)[:self._batch_count * RECORD.size]
+            self._file.write(records)
+            self._batch_file.write(BATCH.pack(written, self._batch_count, zlib.crc32(records), len(self.strings)))
+            written += self._batch_count
+            self._batch_count = 0
+        self._file.flush()
+        self._batch_file.flush()
+        self.records_written = written
+
+    def sync(self):
+        # Called from the sync thread; only touches what flush() has
+        # already handed to the OS.
+        records = self.records_written
+        if records == self._synced_records:
+            return
+        for f in (self._strings_file, self._file, self._batch_file):
+            sync_file(f)
+        self._synced_records = records
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._strings_file.close()
+        self._batch_file.close()
+
+class CsvEventWriter:
+    # The events.csv format behind the same interface as EventLogWriter.
+    def __init__(self, session_dir):
+        self.records_written = 0
+        self._file = open(os.path.join(session_dir, CSV_FILE), 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(CSV_HEADER)
+        self._flushed_records = 0
+        self._synced_records = 0
+
+    def append(self, timestamp, event_type, data):
+        self._writer.writerow([timestamp, event_type, format_event_data(event_type, data)])
+        self.records_written += 1
+
+    def flush(self):
+        records = self.records_written
+        self._file.flush()
+        self._flushed_records = records
+
+    def sync(self):
+        # Rows still in the writer's buffer are left for the sync after
+        # the next flush.
+        records = self._flushed_records
+        if records != self._synced_records:
+            sync_file(self._file)
+            self._synced_records = records
+
+    def close(self):
+        self._file.close()
+
+def _truncate(path, size):
+    if os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+        return True
+    return False
+
+def _recover_strings(path):
+    # Keeps the complete JSON lines; a line cut short by a crash is dropped.
+    size = count = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError
+                json.loads(line)
+            except ValueError:
+                break
+            size += len(line)
+            count += 1
+    _truncate(path, size)
+    return count
+
+def recover_event_log(session_dir):
+    # Cuts a binary log left by a killed recorder back to its last intact
+    # batch: every batch frame must be complete, match the CRC of its
+    # records and refer only to strings that made it to events.strings.
+    # Without events.batches (older logs) only a partial trailing record is
+    # dropped. Returns (records kept, records dropped).
+    path = os.path.join(session_dir, EVENT_LOG_FILE)
+    with open(path, 'rb') as f:
+        magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError(f"{path} is not a version {VERSION} event log")
+    records_on_disk = (os.path.getsize(path) - HEADER.size) // RECORD.size
+    strings = _recover_strings(os.path.join(session_dir, STRING_TABLE_FILE))
+    batch_path = os.path.join(session_dir, BATCH_FILE)
+    kept = records_on_disk
+    if os.path.exists(batch_path):
+        kept = batches = 0
+        with open(path, 'rb') as records, open(batch_path, 'rb') as frames:
+            while True:
+                frame = frames.read(BATCH.size)
+                if len(frame) < BATCH.size:
+                    break
+                first, count, crc, needed_strings = BATCH.unpack(frame)
+                records.seek(HEADER.size + first * RECORD.size)
+                data = records.read(count * RECORD.size)
+                if first != kept or len(data) < count * RECORD.size or zlib.crc32(data) != crc \
+                        or needed_strings > strings:
+                    break
+                kept += count
+                batches += 1
+        _truncate(batch_path, batches * BATCH.size)
+    _truncate(path, HEADER.size + kept * RECORD.size)
+    if kept < records_on_disk:
+        logging.warning(f"Dropped {records_on_disk - kept} unverified events from {path}")
+    return kept, records_on_disk - kept
+
+def recover_csv(session_dir):
+    # Drops a last events.csv row cut short by a crash.
+    path = os.path.join(session_dir, CSV_FILE)
+    end = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while end > 0:
+            start = max(end - 65536, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return _truncate(path, start + newline + 1)
+            end = start
+    return _truncate(path, 0)
+
+class EventLog:
+    # Reads a whole events.bin as one NumPy structured array, either into
+    # memory or as a read-only memory map. A trailing partial record (from
+    # a killed recorder) is ignored.
+    def __init__(self, session_dir, mmap=False):
+        self.session_dir = session_dir
+        path = os.path.join(session_dir, EVENT_LOG_FILE)
+        with open(path, 'rb') as f:
+            magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != EVENT_DTYPE.itemsize:
+            raise ValueError(f"{path} is not a version {VERSION} event log")
+        count = (os.path.getsize(path) - HEADER.size) // record_size
+        if mmap and count:
+            self.records = np.memmap(path, dtype=EVENT_DTYPE, mode='r', offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.fromfile(path, dtype=EVENT_DTYPE, count=count, offset=HEADER.size)
+        with open(os.path.join(session_dir, STRING_TABLE_FILE), encoding='utf-8') as f:
+            self.strings = [json.loads(line) for line in f]
+
+    def __len__(self):
+        return len(self.records)
+
+    def of_type(self, event_type):
+        return self.records[self.records['type'] == EVENT_CODES[event_type]]
+
+    def event_data(self, record):
+        event_type = EVENT_TYPES[record['type']]
+        if event_type in SCREENSHOT_EVENTS or event_type == 'unknown':
+            return self.strings[record['ref']]
+        if event_type in ('key_press', 'key_release'):
+            return self.strings[record['key']]
+        x, y = int(record['x']), int(record['y'])
+        if event_type == 'mouse_click':
+            return (x, y, self.strings[record['button']], bool(record['pressed']))
+        if event_type == 'mouse_scroll':
+            return (x, y, int(record['dx']), int(record['dy']))
+        return (x, y)
+
+    def rows(self):
+        # The legacy events.csv rows: (timestamp, event type, data string).
+        for record in self.records:
+            event_type = EVENT_TYPES[record['type']]
+            data = self.event_data(record)
+            if event_type not in SCREENSHOT_EVENTS:
+                data = format_event_data(event_type, data)
+            yield float(record['timestamp']), event_type, data
+
+    def to_csv(self, path=None):
+        path = path or os.path.join(self.session_dir, 'events.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(self.rows())
+        return path
@@ -0,0 +1,396 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .session_index import SessionIndex, build_session_index, INDEX_DIR
+
+# Per-session hashes of every stored frame, in the screenshots directory.
+HASH_FILE = 'frame_hashes.bin'
+HASH_DTYPE = np.dtype([('timestamp', '<f8'), ('hash', '<u8')])
+# Entries of a cross-session index: which frame of which session.
+ENTRY_DTYPE = np.dtype([('hash', '<u8'), ('session', '<u4'), ('frame', '<u4')])
+HASH_INDEX_META = 'hash_index.json'
+HASH_SIZE = 32   # frames are reduced to 32x32 before the DCT
+HASH_BITS = 8    # the lowest 8x8 frequencies give a 64-bit hash
+TABLE_BITS = 16  # multi-index hashing: four tables of 16-bit substrings
+DEDUP_CHUNK_PAIRS = 1 << 22  # candidate pairs compared per vectorised pass in deduplicate
+DEDUP_ROUNDS = 64  # vectorised rounds before deduplicate finishes chains in order
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+DCT = _dct_matrix(HASH_SIZE)[:HASH_BITS]
+BIT_WEIGHTS = (np.uint64(1) << np.arange(64, dtype=np.uint64))
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(values):
+    values = np.asarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):  # NumPy 2
+        return np.bitwise_count(values).astype(np.int64)
+    flat = np.ascontiguousarray(values).reshape(-1)
+    return _BYTE_POPCOUNT[flat.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64).reshape(values.shape)
+
+def hamming(a, b):
+    return popcount(np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64)))
+
+def reduce_frame(frame, size=HASH_SIZE):
+    # Grayscale area average down to size x size in plain NumPy, so hashing
+    # needs neither OpenCV nor a copy of the full frame.
+    if frame.ndim == 3:
+        frame = frame[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    height, width = frame.shape
+    rows = np.linspace(0, height, size + 1).astype(np.int64)[:-1]
+    cols = np.linspace(0, width, size + 1).astype(np.int64)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(frame.astype(np.float32, copy=False), rows, axis=0), cols, axis=1)
+    counts = np.diff(np.append(rows, height))[:, None] * np.diff(np.append(cols, width))[None, :]
+    return sums / counts
+
+def phash_reduced(reduced):
+    # DCT perceptual hash of (n, 32, 32) reduced frames: the 8x8 lowest
+    # frequencies, each bit set when above the median of the 64.
+    coefficients = DCT @ np.asarray(reduced, dtype=np.float64) @ DCT.T
+    coefficients = coefficients.reshape(len(coefficients), -1)
+    bits = coefficients > np.median(coefficients, axis=1, keepdims=True)
+    return (bits * BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)
+
+def phash(frame):
+    return int(phash_reduced(reduce_frame(frame)[None])[0])
+
+class FrameHashLog:
+    # Appends (timestamp, hash) records for a session's stored frames as
+    # their hash jobs finish. Jobs finish in any order, so records are
+    # sorted when read; close() waits for the jobs still running.
+    def __init__(self, screenshots_dir):
+        self._file = open(os.path.join(screenshots_dir, HASH_FILE), 'ab')
+        self._done = threading.Condition()
+        self._pending = 0
+        self.records_written = 0
+
+    def track(self, timestamp, job):
+        # job is an encoder future whose result is (hash, seconds).
+        with self._done:
+            self._pending += 1
+
+        def append(done):
+            try:
+                if done.exception() is None:
+                    self.append(timestamp, done.result()[0])
+                else:
+                    logging.error(f"Error hashing frame at {timestamp}: {done.exception()}")
+            finally:
+                with self._done:
+                    self._pending -= 1
+                    self._done.notify_all()
+        job.add_done_callback(append)
+
+    def append(self, timestamp, frame_hash):
+        with self._done:
+            if self._file.closed:
+                return  # a job that outlived close()
+            self._file.write(np.array([(timestamp, frame_hash)], dtype=HASH_DTYPE).tobytes())
+            self.records_written += 1
+
+    def close(self, timeout=30):
+        with self._done:
+            if not self._done.wait_for(lambda: self._pending == 0, timeout):
+                logging.warning(f"Closing frame hashes with {self._pending} hash jobs still running")
+            self._file.close()
+
+def load_frame_hashes(screenshots_dir):
+    path = os.path.join(screenshots_dir, HASH_FILE)
+    if not os.path.exists(path):
+        return None
+    records = np.fromfile(path, dtype=HASH_DTYPE, count=os.path.getsize(path) // HASH_DTYPE.itemsize)
+    return records[np.argsort(records['timestamp'], kind='stable')]
+
+def session_frame_hashes(session_dir):
+    # The hash of every frame in the session index, in index order. Repeat
+    # rows take the hash of the stored frame they repeat; sessions recorded
+    # without screenshot_hash are hashed from their stored frames first.
+    from .change_detection import load_frame
+    from .video_storage import VideoReaderCache
+    if not os.path.exists(os.path.join(session_dir, INDEX_DIR)):
+        build_session_index(session_dir)
+    index = SessionIndex(session_dir)
+    screenshots_dir = os.path.join(session_dir, 'screenshots')
+    records = load_frame_hashes(screenshots_dir)
+    frames = [index.frame(position) for position in range(len(index.frames_time))]
+    if records is None:
+        log = FrameHashLog(screenshots_dir)
+        readers = VideoReaderCache()
+        try:
+            for timestamp, event_type, reference in frames:
+                if event_type != 'screenshot_repeat':
+                    log.append(timestamp, phash(load_frame(screenshots_dir, reference, readers)))
+        finally:
+            log.close()
+            readers.close()
+        records = load_frame_hashes(screenshots_dir)
+    positions = np.searchsorted(records['timestamp'], np.asarray(index.frames_time), side='right') - 1
+    return records['hash'][np.maximum(positions, 0)] if len(records) else np.zeros(len(frames), np.uint64)
+
+class MultiIndexHash:
+    # Hamming-radius search over 64-bit hashes by multi-index hashing: each
+    # hash is split into four 16-bit substrings, and each table holds the
+    # positions sorted by one substring. A hash within radius r of the
+    # query has some substring within r // 4 of the query's, so only the
+    # buckets of those nearby substrings are looked up (binary search in
+    # the sorted tables) and the candidates verified on the full hash.
+    # All arrays can be memory mapped.
+    def __init__(self, hashes, keys=None, orders=None):
+        self.hashes = hashes
+        if keys is None:
+            keys, orders = [], []
+            for table in range(64 // TABLE_BITS):
+                substrings = ((np.asarray(hashes, dtype=np.uint64) >> np.uint64(table * TABLE_BITS))
+                              & np.uint64(0xFFFF)).astype(np.uint16)
+                order = np.argsort(substrings, kind='stable').astype(np.uint32)
+                keys.append(substrings[order])
+                orders.append(order)
+        self.keys = keys
+        self.orders = orders
+        self._masks = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def save(self, directory):
+        np.save(os.path.join(directory, 'hashes.npy'), np.asarray(self.hashes))
+        for table, (keys, order) in enumerate(zip(self.keys, self.orders)):
+            np.save(os.path.join(directory, f'table_{table}_keys.npy'), keys)
+            np.save(os.path.join(directory, f'table_{table}_order.npy'), order)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mode = 'r' if mmap else None
+        hashes = np.load(os.path.join(directory, 'hashes.npy'), mmap_mode=mode)
+        tables = range(64 // TABLE_BITS)
+        return cls(hashes, [np.load(os.path.join(directory, f'table_{t}_keys.npy'), mmap_mode=mode) for t in tables],
+                   [np.load(os.path.join(directory, f'table_{t}_order.npy'), mmap_mode=mode) for t in tables])
+
+    def query(self, frame_hash, radius):
+        # (positions, distances) of every hash within radius, nearest first.
+        frame_hash = np.uint64(frame_hash)
+        masks = self._substring_masks(radius // len(self.keys))
+        candidates = []
+        for table, (keys, order) in enumerate(zip(self.keys, self.orders)):
+            substring = np.uint16((int(frame_hash) >> (table * TABLE_BITS)) & 0xFFFF)
+            values = np.unique(substring ^ masks)
+            starts = np.searchsorted(keys, values, side='left')
+            ends = np.searchsorted(keys, values, side='right')
+            hit = ends > starts
+            starts, ends = starts[hit], ends[hit]
+            if len(starts):
+                # Concatenated ranges [start, end) without a Python loop.
+                lengths = ends - starts
+                offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+                candidates.append(np.asarray(order[offsets]))
+        if not candidates:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        positions = np.unique(np.concatenate(candidates)).astype(np.int64)
+        distances = hamming(np.asarray(self.hashes[positions]), frame_hash)
+        keep = distances <= radius
+        positions, distances = positions[keep], distances[keep]
+        order = np.lexsort((positions, distances))
+        return positions[order], distances[order]
+
+    def nearest(self, frame_hash, count=10, max_radius=16):
+        # Grows the radius until count hashes are found; exact within
+        # max_radius.
+        radius = 0
+        while True:
+            positions, distances = self.query(frame_hash, radius)
+            if len(positions) >= count or radius >= max_radius:
+                return positions[:count], distances[:count]
+            radius = min(max(2 * radius, radius + 4), max_radius)
+
+    def _substring_masks(self, radius):
+        if radius not in self._masks:
+            values = np.arange(1 << TABLE_BITS, dtype=np.uint32)
+            self._masks[radius] = values[popcount(values) <= radius].astype(np.uint16)
+        return self._masks[radius]
+
+def _near_pairs(hashes, radius):
+    # Pairs (earlier, later) of distinct hashes within radius, found the
+    # multi-index way and vectorised per band and substring mask, at most
+    # DEDUP_CHUNK_PAIRS candidates at a time. With radius = q * tables + a,
+    # a near pair agrees within q bits on one of the first a + 1 bands or
+    # within q - 1 bits on one of the others. A pair may be listed twice.
+    tables = 64 // TABLE_BITS
+    values = np.arange(1 << TABLE_BITS, dtype=np.uint32)
+    weights = popcount(values)
+    count = len(hashes)
+    positions = np.arange(count, dtype=np.int64)
+    earlier, later = [], []
+    for table in range(tables):
+        bits = radius // tables - (table > radius % tables)
+        if bits < 0:
+            continue
+        masks = values[weights <= bits].astype(np.uint16)
+        substrings = ((hashes >> np.uint64(table * TABLE_BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+        order = np.argsort(substrings, kind='stable')
+        # 16-bit bands index their buckets directly instead of searching.
+        sizes = np.bincount(substrings, minlength=1 << TABLE_BITS)
+        offsets = np.cumsum(sizes) - sizes
+        for mask in masks:
+            targets = substrings ^ mask
+            starts, lengths = offsets[targets], sizes[targets]
+            ends = np.cumsum(lengths)
+            begin = 0
+            while begin < count:
+                end = max(int(np.searchsorted(ends, ends[begin] - lengths[begin] + DEDUP_CHUNK_PAIRS, side='right')),
+                          begin + 1)
+                chunk = lengths[begin:end]
+                total = int(chunk.sum())
+                if total:
+                    query = np.repeat(positions[begin:end], chunk)
+                    ranges = np.repeat(starts[begin:end] - np.cumsum(chunk) + chunk, chunk) + np.arange(total)
+                    other = order[ranges]
+                    # Masks are symmetric, so each pair also shows up from
+                    # its earlier hash.
+                    near = other > query
+                    query, other = query[near], other[near]
+                    near = hamming(hashes[query], hashes[other]) <= radius
+                    earlier.append(query[near])
+                    later.append(other[near])
+                begin = end
+    if not earlier:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(earlier), np.concatenate(later)
+
+def _keep_first(count, earlier, later):
+    # Greedy in order: a hash is dropped when an earlier kept one is within
+    # radius. Each round decides every hash whose earlier neighbours are all
+    # decided; long chains of near neighbours are finished one by one.
+    state = np.zeros(count, dtype=np.uint8)  # 0 undecided, 1 kept, 2 dropped
+    for _ in range(DEDUP_ROUNDS):
+        undecided = state == 0
+        if not undecided.any():
+            return state == 1
+        live = undecided[later]
+        earlier, later = earlier[live], later[live]
+        kept_before = np.zeros(count, dtype=bool)
+        kept_before[later[state[earlier] == 1]] = True
+        waiting = np.zeros(count, dtype=bool)
+        waiting[later[state[earlier] == 0]] = True
+        state[undecided & kept_before] = 2
+        state[undecided & ~kept_before & ~waiting] = 1
+    order = np.argsort(later, kind='stable')
+    earlier, later = earlier[order], later[order]
+    bounds = np.searchsorted(later, np.arange(count + 1))
+    for position in np.flatnonzero(state == 0):
+        neighbours = earlier[bounds[position]:bounds[position + 1]]
+        state[position] = 2 if (state[neighbours] == 1).any() else 1
+    return state == 1
+
+def deduplicate(hashes, radius=0):
+    # Keep mask over hashes in their given order: a hash is dropped when an
+    # earlier kept one lies within radius. Deterministic for a given order.
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    keep = np.zeros(len(hashes), dtype=bool)
+    unique, first = np.unique(hashes, return_index=True)
+    if radius <= 0 or not len(unique):
+        keep[first] = True
+        return keep
+    # Exact repeats are settled by np.unique; only distinct hashes, in order
+    # of first appearance, go through the pair search.
+    order = np.argsort(first)
+    distinct, first = unique[order], first[order]
+    earlier, later = _near_pairs(distinct, radius)
+    keep[first[_keep_first(len(distinct), earlier, later)]] = True
+    return keep
+
+def _session_hashes_worker(session_dir):
+    return session_frame_hashes(session_dir)
+
+def build_hash_index(session_dirs, index_dir, workers=1):
+    # Hashes every frame of the given sessions (reusing the hashes written
+    # while recording) and writes a memory-mappable index to index_dir.
+    os.makedirs(index_dir, exist_ok=True)
+    session_dirs = [os.path.abspath(session_dir) for session_dir in session_dirs]
+    if workers > 1 and len(session_dirs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(session_dirs)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            per_session = list(executor.map(_session_hashes_worker, session_dirs))
+    else:
+        per_session = [session_frame_hashes(session_dir) for session_dir in session_dirs]
+    entries = np.zeros(sum(len(hashes) for hashes in per_session), dtype=ENTRY_DTYPE)
+    start = 0
+    for session, hashes in enumerate(per_session):
+        rows = entries[start:start + len(hashes)]
+        rows['hash'], rows['session'], rows['frame'] = hashes, session, np.arange(len(hashes))
+        start += len(hashes)
+    np.save(os.path.join(index_dir, 'entries.npy'), entries)
+    MultiIndexHash(entries['hash']).save(index_dir)
+    with open(os.path.join(index_dir, HASH_INDEX_META), 'w') as f:
+        json.dump({'sessions': session_dirs, 'frames': int(len(entries))}, f, indent=2)
+    logging.info(f"Hash index of {len(entries)} frames from {len(session_dirs)} sessions written to {index_dir}")
+    return HashIndex(index_dir)
+
+class HashIndex:
+    # A cross-session index built by build_hash_index: Hamming-radius and
+    # nearest-frame queries answered as (session_dir, frame position,
+    # distance); SessionIndex(session_dir).frame(position) resolves a hit.
+    def __init__(self, index_dir, mmap=True):
+        with open(os.path.join(index_dir, HASH_INDEX_META)) as f:
+            meta = json.load(f)
+        self.sessions = meta['sessions']
+        self.entries = np.load(os.path.join(index_dir, 'entries.npy'), mmap_mode='r' if mmap else None)
+        self.mih = MultiIndexHash.load(index_dir, mmap)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def query(self, frame_hash, radius=8):
+        return self._resolve(*self.mih.query(frame_hash, radius))
+
+    def nearest(self, frame_hash, count=10, max_radius=16):
+        return self._resolve(*self.mih.nearest(frame_hash, count, max_radius))
+
+    def _resolve(self, positions, distances):
+        entries = self.entries[positions]
+        return [(self.sessions[int(entry['session'])], int(entry['frame']), int(distance))
+                for entry, distance in zip(entries, distances)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query a perceptual-hash index of recorded frames")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="index every frame of the sessions under the given paths")
+    build.add_argument('paths', nargs='+', help="session directories or dataset trees")
+    build.add_argument('--output', required=True, help="index directory")
+    build.add_argument('--workers', type=int, default=os.cpu_count(), help="sessions hashed in parallel")
+    query = commands.add_parser('query', help="find frames that look like an image")
+    query.add_argument('index', help="index directory")
+    query.add_argument('image', help="image file to look up")
+    query.add_argument('--radius', type=int, default=None, help="all frames within this Hamming distance")
+    query.add_argument('--count', type=int, default=10, help="nearest frames to list without --radius")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level='INFO', format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'build':
+        from .shard_export import find_recorded_sessions
+        sessions = [session for path in args.paths for session in find_recorded_sessions(path)]
+        index = build_hash_index(sessions, args.output, args.workers)
+        print(f"{len(index)} frames from {len(sessions)} sessions indexed")
+        return 0
+    from .change_detection import read_image
+    frame_hash = phash(read_image(args.image))
+    index = HashIndex(args.index)
+    hits = index.query(frame_hash, args.radius) if args.radius is not None else index.nearest(frame_hash, args.count)
+    for session_dir, position, distance in hits:
+        timestamp, _, reference = SessionIndex(session_dir).frame(position)
+        print(f"{distance:2d} {session_dir} {timestamp:.3f} {reference}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
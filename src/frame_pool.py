@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+class FramePool:
+    # Recycles full-frame arrays so capture does not allocate a new screen
+    # sized buffer every tick. acquire() hands out a buffer with one
+    # reference; anything else that keeps the frame (the change detector)
+    # retains it, and the buffer goes back to the free list once every
+    # holder has released it. Frames the pool did not hand out are ignored,
+    # so release() is always safe to call. At most max_free idle buffers are
+    # kept in total; when the frame size changes (a different capture
+    # region) buffers of the least recently used size go first.
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self.hits = 0
+        self.misses = 0
+        self.returned = 0
+        self.discarded = 0
+        self._free = OrderedDict()
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free is not None:
+                self._free.move_to_end(key)
+            if free:
+                frame = free.pop()
+                self.hits += 1
+            else:
+                frame = np.empty(shape, dtype=dtype)
+                self.misses += 1
+            self._refs[id(frame)] = [frame, 1]
+        return frame
+
+    def retain(self, frame):
+        with self._lock:
+            entry = self._refs.get(id(frame))
+            if entry is not None and entry[0] is frame:
+                entry[1] += 1
+
+    def release(self, frame):
+        if frame is None:
+            return
+        with self._lock:
+            entry = self._refs.get(id(frame))
+            if entry is None or entry[0] is not frame:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._refs[id(frame)]
+            key = (frame.shape, frame.dtype.str)
+            self._free.setdefault(key, []).append(frame)
+            self._free.move_to_end(key)
+            self.returned += 1
+            while sum(len(free) for free in self._free.values()) > self.max_free:
+                oldest_key, oldest = next(iter(self._free.items()))
+                oldest.pop(0)
+                if not oldest:
+                    del self._free[oldest_key]
+                self.discarded += 1
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'pool_hits': self.hits, 'pool_misses': self.misses,
+                    'pool_hit_ratio': self.hits / requests if requests else 0.0,
+                    'pool_in_use': len(self._refs), 'pool_free': sum(len(free) for free in self._free.values()),
+                    'pool_returned': self.returned, 'pool_discarded': self.discarded}
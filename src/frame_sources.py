@@ -0,0 +1,204 @@
+import time
+import logging
+from collections import deque
+
+import numpy as np
+
+
+class FrameSource:
+    name = 'base'
+
+    def __init__(self, stats_window=100):
+        self.frames_grabbed = 0
+        self._grab_log = deque(maxlen=stats_window)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def grab(self, out=None, region=None):
+        # With out, the frame is written into that buffer when the shapes
+        # match and out itself is returned; otherwise a new array is.
+        # region is (left, top, width, height) in screen coordinates and is
+        # clipped to the captured screen.
+        start = time.perf_counter()
+        frame = self._grab(out, region)
+        end = time.perf_counter()
+        self._grab_log.append((end, end - start))
+        self.frames_grabbed += 1
+        return frame
+
+    def _grab(self, out, region):
+        raise NotImplementedError
+
+    @staticmethod
+    def _clip(region, bounds):
+        left, top, width, height = region
+        bounds_left, bounds_top, bounds_width, bounds_height = bounds
+        right = min(left + width, bounds_left + bounds_width)
+        bottom = min(top + height, bounds_top + bounds_height)
+        left, top = max(left, bounds_left), max(top, bounds_top)
+        if right <= left or bottom <= top:
+            return bounds
+        return left, top, right - left, bottom - top
+
+    @staticmethod
+    def _fill(out, image):
+        if out is not None and out.shape == image.shape and out.dtype == image.dtype:
+            np.copyto(out, image)
+            return out
+        return np.array(image)
+
+    def stats(self):
+        stats = {'backend': self.name, 'frames': self.frames_grabbed,
+                 'fps': 0.0, 'grab_ms_mean': 0.0, 'grab_ms_max': 0.0}
+        if not self._grab_log:
+            return stats
+        times, latencies = zip(*self._grab_log)
+        if len(times) > 1 and times[-1] > times[0]:
+            stats['fps'] = (len(times) - 1) / (times[-1] - times[0])
+        stats['grab_ms_mean'] = 1000 * sum(latencies) / len(latencies)
+        stats['grab_ms_max'] = 1000 * max(latencies)
+        return stats
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MssFrameSource(FrameSource):
+    # One mss instance per capture thread: the X11 connection and the XShm
+    # segment are created once in open() and reused by every grab.
+    name = 'mss'
+
+    def __init__(self, monitor=0, stats_window=100):
+        super().__init__(stats_window)
+        self.monitor_index = monitor
+        self._sct = None
+        self._monitor = None
+
+    def open(self):
+        import mss
+        self._sct = mss.mss()
+        self._monitor = self._sct.monitors[self.monitor_index]
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+    def _grab(self, out, region):
+        monitor = self._monitor
+        if region is not None:
+            # Only the region is copied out of the X server.
+            left, top, width, height = self._clip(region, (monitor['left'], monitor['top'],
+                                                           monitor['width'], monitor['height']))
+            monitor = {'left': left, 'top': top, 'width': width, 'height': height}
+        shot = self._sct.grab(monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        # The BGRA -> RGB reorder happens during the single copy out of
+        # mss's buffer.
+        return self._fill(out, bgra[:, :, 2::-1])
+
+
+class PyscreenshotFrameSource(FrameSource):
+    name = 'pyscreenshot'
+
+    def __init__(self, backend=None, stats_window=100):
+        super().__init__(stats_window)
+        self.backend = backend
+        self._grabber = None
+
+    def open(self):
+        import pyscreenshot
+        self._grabber = pyscreenshot
+
+    def close(self):
+        self._grabber = None
+
+    def _grab(self, out, region):
+        # childprocess=False keeps the backend in this process instead of
+        # spawning a helper for every frame.
+        bbox = None
+        if region is not None:
+            left, top, width, height = region
+            bbox = (left, top, left + width, top + height)
+        screenshot = self._grabber.grab(bbox=bbox, backend=self.backend, childprocess=False)
+        return self._fill(out, np.asarray(screenshot))
+
+
+class SyntheticFrameSource(FrameSource):
+    # Deterministic frames for headless tests: frame i is always the same
+    # gradient with a block moved to a position derived from i. With
+    # resize_at, the screen changes to resize_to (width, height) from that
+    # frame on, like a resolution change or a new monitor.
+    name = 'synthetic'
+
+    def __init__(self, width=640, height=480, block_size=32, static=False, stats_window=100, resize_at=None,
+                 resize_to=None):
+        super().__init__(stats_window)
+        self.block_size = block_size
+        self.static = static
+        self.resize_at = resize_at
+        self.resize_to = resize_to
+        self.index = 0
+        self._set_size(width, height)
+
+    def _set_size(self, width, height):
+        self.width = width
+        self.height = height
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        self._background = np.empty((height, width, 3), dtype=np.uint8)
+        self._background[:, :, 0] = x[None, :]
+        self._background[:, :, 1] = y[:, None]
+        self._background[:, :, 2] = 128
+
+    def frame_at(self, index, out=None):
+        frame = self._fill(out, self._background)
+        if not self.static:
+            size = self.block_size
+            span_x = max(self.width - size, 1)
+            span_y = max(self.height - size, 1)
+            left = (index * 7 * size // 4) % span_x
+            top = (index * 3 * size // 4) % span_y
+            frame[top:top + size, left:left + size] = (255, 255 - index % 256, index % 256)
+        return frame
+
+    def _grab(self, out, region):
+        if self.index == self.resize_at:
+            self._set_size(*self.resize_to)
+        if region is None:
+            frame = self.frame_at(self.index, out)
+        else:
+            left, top, width, height = self._clip(region, (0, 0, self.width, self.height))
+            frame = self._fill(out, self.frame_at(self.index)[top:top + height, left:left + width])
+        self.index += 1
+        return frame
+
+
+FRAME_SOURCES = {
+    'mss': MssFrameSource,
+    'pyscreenshot': PyscreenshotFrameSource,
+    'synthetic': SyntheticFrameSource,
+}
+
+
+def create_frame_source(config):
+    backend = config.get('screenshot_backend', 'auto')
+    options = dict(config.get('screenshot_backend_options') or {})
+    if backend == 'auto':
+        try:
+            import mss  # noqa: F401
+            backend = 'mss'
+        except ImportError:
+            logging.warning("mss is not installed, falling back to pyscreenshot")
+            backend = 'pyscreenshot'
+    if backend not in FRAME_SOURCES:
+        raise ValueError(f"Unknown screenshot backend: {backend}")
+    return FRAME_SOURCES[backend](**options)
@@ -0,0 +1,116 @@
+import time
+import logging
+import subprocess
+
+import numpy as np
+import cv2
+
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'area': cv2.INTER_AREA,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+
+FOCUSED_WINDOW = 'focused_window'
+
+def focused_window_region():
+    # (left, top, width, height) of the focused X11 window via xdotool, or
+    # None when there is no such window or xdotool is not installed.
+    try:
+        output = subprocess.run(['xdotool', 'getactivewindow', 'getwindowgeometry', '--shell'],
+                                capture_output=True, text=True, timeout=1, check=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    values = dict(line.split('=', 1) for line in output.splitlines() if '=' in line)
+    try:
+        return int(values['X']), int(values['Y']), int(values['WIDTH']), int(values['HEIGHT'])
+    except (KeyError, ValueError):
+        return None
+
+def scaled_size(width, height, scale):
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+class FrameTransform:
+    # Reduces frames at the source, before they are queued: the capture
+    # region is handed to the frame source so only that area is grabbed,
+    # then frames are downscaled and optionally converted to grayscale
+    # into a caller-supplied (pooled) buffer.
+    def __init__(self, region=None, scale=1.0, interpolation='area', grayscale=False, region_refresh=1.0,
+                 window_region=focused_window_region, clock=time.monotonic):
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation: {interpolation}")
+        if region is not None and region != FOCUSED_WINDOW:
+            region = tuple(int(value) for value in region)
+            if len(region) != 4:
+                raise ValueError(f"Capture region must be [left, top, width, height]: {region}")
+        self.region_setting = region
+        self.scale = scale
+        self.interpolation = INTERPOLATIONS[interpolation]
+        self.grayscale = grayscale
+        self.region_refresh = region_refresh
+        self.window_region = window_region
+        self.clock = clock
+        self._window = None
+        self._window_checked = None
+        self._scratch = None
+
+    @property
+    def reduces(self):
+        return self.scale != 1.0 or self.grayscale
+
+    def region(self):
+        if self.region_setting != FOCUSED_WINDOW:
+            return self.region_setting
+        # Looking the window up costs a subprocess, so it is cached for
+        # region_refresh seconds; without a focused window the whole screen
+        # is captured.
+        now = self.clock()
+        if self._window_checked is None or now - self._window_checked >= self.region_refresh:
+            self._window = self.window_region()
+            self._window_checked = now
+        return self._window
+
+    def output_shape(self, shape):
+        height, width = shape[:2]
+        if self.scale != 1.0:
+            width, height = scaled_size(width, height, self.scale)
+        if self.grayscale or len(shape) == 2:
+            return height, width
+        return (height, width) + tuple(shape[2:])
+
+    def apply(self, frame, out=None):
+        # Returns frame unchanged when there is nothing to reduce; otherwise
+        # the reduced frame, written into out when its shape fits.
+        if not self.reduces:
+            return frame
+        shape = self.output_shape(frame.shape)
+        if out is None or out.shape != shape or out.dtype != frame.dtype:
+            out = np.empty(shape, dtype=frame.dtype)
+        gray = self.grayscale and frame.ndim == 3
+        if self.scale != 1.0:
+            size = (shape[1], shape[0])
+            if gray:
+                # Resize first so the colour conversion runs on the small frame.
+                resized_shape = shape + frame.shape[2:]
+                if self._scratch is None or self._scratch.shape != resized_shape:
+                    self._scratch = np.empty(resized_shape, dtype=frame.dtype)
+                cv2.resize(frame, size, dst=self._scratch, interpolation=self.interpolation)
+                frame = self._scratch
+            else:
+                return cv2.resize(frame, size, dst=out, interpolation=self.interpolation)
+        if gray:
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=out)
+        np.copyto(out, frame)
+        return out
+
+def create_frame_transform(config):
+    transform = FrameTransform(region=config.get('screenshot_region'),
+                               scale=config.get('screenshot_scale', 1.0),
+                               interpolation=config.get('screenshot_interpolation', 'area'),
+                               grayscale=config.get('screenshot_grayscale', False),
+                               region_refresh=config.get('screenshot_region_refresh', 1.0))
+    if transform.region_setting == FOCUSED_WINDOW and focused_window_region() is None:
+        logging.warning("Could not find the focused window (is xdotool installed?), capturing the whole screen")
+    return transform
@@ -1,17 +1,33 @@
-from pynput import mouse, keyboard
+import threading
 import time
 import logging
 
+from .trajectory import TrajectorySimplifier
+
 class MouseKeyboardRecorder:
-    def __init__(self, output_queue, config):
+    def __init__(self, output_queue, config, activity=None):
         self.output_queue = output_queue
+        # Optional ActivityRate that adapts the screenshot rate to input.
+        self.activity = activity
         self.mouse_listener = None
         self.keyboard_listener = None
         self.running = False
         self.config = config
         self.last_mouse_move_time = 0
+        # 'simplify' keeps moves by trajectory error; 'throttle' is the old
+        # fixed-interval sampling.
+        self.simplifier = None
+        if config.get('mouse_move_mode', 'simplify') == 'simplify':
+            self.simplifier = TrajectorySimplifier(config.get('mouse_move_tolerance', 2.0),
+                                                   config.get('mouse_move_max_delay', 0.1),
+                                                   config.get('mouse_move_window', 64))
+        self._move_lock = threading.Lock()
+        self._expire_thread = None
 
     def start(self):
+        # pynput needs a display; importing it here keeps the module usable
+        # on headless machines.
+        from pynput import mouse, keyboard
         self.running = True
         self.mouse_listener = mouse.Listener(
             on_move=self._on_move,
@@ -22,6 +38,11 @@ class MouseKeyboardRecorder:
             on_release=self._on_release)
         self.mouse_listener.start()
         self.keyboard_listener.start()
+        if self.simplifier:
+            # Moves are only held back while the mouse keeps moving; this
+            # releases the last one once the mouse goes idle.
+            self._expire_thread = threading.Thread(target=self._expire_moves, daemon=True)
+            self._expire_thread.start()
         logging.info("Mouse and keyboard listeners started")
 
     def stop(self):
@@ -30,6 +51,11 @@ class MouseKeyboardRecorder:
             self.mouse_listener.stop()
         if self.keyboard_listener:
             self.keyboard_listener.stop()
+        if self._expire_thread:
+            self._expire_thread.join(timeout=1)
+        if self.simplifier:
+            self._flush_moves()
+            logging.info(f"Mouse trajectory: {self.simplifier.stats()}")
         logging.info("Mouse and keyboard listeners stopped")
 
     def is_running(self):
@@ -38,20 +64,50 @@ class MouseKeyboardRecorder:
     def _on_move(self, x, y):
         if self.running:
             current_time = time.time()
-            if current_time - self.last_mouse_move_time >= self.config['mouse_move_throttle']:
+            if self.activity:
+                self.activity.notify('move')
+            if self.simplifier:
+                with self._move_lock:
+                    self._put_moves(self.simplifier.add(current_time, x, y))
+            elif current_time - self.last_mouse_move_time >= self.config['mouse_move_throttle']:
                 self.output_queue.put(('mouse_move', current_time, (x, y)))
                 self.last_mouse_move_time = current_time
 
+    def _put_moves(self, points):
+        for timestamp, x, y in points:
+            self.output_queue.put(('mouse_move', timestamp, (x, y)))
+
+    def _flush_moves(self):
+        # Keeps the position the pointer had just before a click or scroll.
+        if self.simplifier:
+            with self._move_lock:
+                self._put_moves(self.simplifier.flush())
+
+    def _expire_moves(self):
+        interval = max(self.simplifier.max_delay / 2, 0.005)
+        while self.running:
+            time.sleep(interval)
+            with self._move_lock:
+                self._put_moves(self.simplifier.expire(time.time()))
+
     def _on_click(self, x, y, button, pressed):
         if self.running:
+            self._flush_moves()
+            if self.activity and pressed:
+                self.activity.notify('click')
             self.output_queue.put(('mouse_click', time.time(), (x, y, str(button), pressed)))
 
     def _on_scroll(self, x, y, dx, dy):
         if self.running:
+            self._flush_moves()
+            if self.activity:
+                self.activity.notify('scroll')
             self.output_queue.put(('mouse_scroll', time.time(), (x, y, dx, dy)))
 
     def _on_press(self, key):
         if self.running:
+            if self.activity:
+                self.activity.notify('key')
             key_str = str(key)
             if key_str in self.config['mask_keys']:
                 key_str = "[MASKED]"
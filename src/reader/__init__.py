@@ -0,0 +1,16 @@
+# Everything needed to read and query recorded sessions, without the
+# capture side: importing this package loads NumPy and the session format
+# modules only. OpenCV is imported the first time a frame is decoded.
+from ..event_log import EventLog, EVENT_TYPES, SCREENSHOT_EVENTS, format_event_data, parse_event_data
+from ..session_index import SessionIndex, build_session_index
+from ..audio_storage import AudioSegmentReader, wav_memmap
+from ..change_detection import load_frame, read_image
+from ..video_storage import VideoFrameReader, VideoReaderCache
+from ..dataset_loader import SessionDataset, PrefetchLoader, FrameCache
+from ..shard_export import iter_shard, read_sample
+from ..frame_hash import HashIndex, phash, hamming, load_frame_hashes
+
+__all__ = ['EventLog', 'EVENT_TYPES', 'SCREENSHOT_EVENTS', 'format_event_data', 'parse_event_data', 'SessionIndex',
+           'build_session_index', 'AudioSegmentReader', 'wav_memmap', 'load_frame', 'read_image',
+           'VideoFrameReader', 'VideoReaderCache', 'SessionDataset', 'PrefetchLoader', 'FrameCache', 'iter_shard',
+           'read_sample', 'HashIndex', 'phash', 'hamming', 'load_frame_hashes']
@@ -1,34 +1,91 @@
 import os
 import time
-import csv
 import queue
+import argparse
 import threading
 import logging
+from collections import deque
 from datetime import datetime
 import yaml
 
 import numpy as np
-import cv2
-import wave
-import sounddevice as sd
 
 from .screenshot_recorder import ScreenshotRecorder
+from .frame_sources import create_frame_source
+from .scheduler import create_activity_rate
+from .frame_transform import create_frame_transform
+from .encoder import FrameEncoderPool
+from .frame_pool import FramePool
+from .screenshot_storage import ScreenshotStorage
+from .shared_capture import SharedMemoryCapture
+from .buffers import StreamBuffers
+from .event_log import EventLog
+from .session_index import build_session_index
+from .audio_storage import AUDIO_DIR
+from .storage_sink import StorageSink
+from .stream_sink import StreamClient, StreamSink
+from .session_retention import SessionRetention, directory_size
 from .mouse_keyboard_recorder import MouseKeyboardRecorder
 from .audio_recorder import AudioRecorder
+from .telemetry import MetricsRegistry, MetricsServer, MetricsFileWriter, resident_memory_bytes
+
+SIZE_CHECK_INTERVAL = 5
+
+class _ClosingSession:
+    # A session after a rollover: rows stamped before cut_time still go to
+    # its writers until the late ones have arrived, then it is closed.
+    def __init__(self, session_dir, sink, screenshot_storage, cut_time):
+        self.session_dir = session_dir
+        self.sink = sink
+        self.screenshot_storage = screenshot_storage
+        self.cut_time = cut_time
+        self.audio_switched = None
 
 class DatasetRecorder:
-    def __init__(self, config_path="config.yaml"):
+    def __init__(self, config_path="config.yaml", **overrides):
         self.config = self.load_config(config_path)
+        self.config.update(overrides)
         self.base_output_dir = self.config['base_output_dir']
         self.screenshot_freq = self.config['screenshot_freq']
-        self.data_queue = queue.Queue()
+        self.frame_pool = FramePool(self.config.get('frame_pool_size', 8)) if self.config.get('frame_pool', True) else None
+        self.data_queue = StreamBuffers(self.config.get('stream_buffers'), self.config.get('spill_dir'),
+                                        on_discard=self._discard_event)
         self.running = False
         self.session_dir = None
         self.save_thread = None
-        self.csv_file = None
-        self.csv_writer = None
-        self.audio_file = None
+        self.sink = None
+        self.stream_client = None
+        self.event_log = None
         self.audio_writer = None
+        self.encoder = None
+        self.screenshot_storage = None
+        self.pending_rows = deque()
+        self.screenshot_recorder = None
+        self.mouse_keyboard_recorder = None
+        self.audio_recorder = None
+        self.activity = None
+        self.metrics = MetricsRegistry()
+        self.metrics.register(self._collect_metrics)
+        self.write_latency = self.metrics.histogram('recorder_event_write_latency_seconds',
+                                                    'Time from capture to the event log write')
+        self.encode_latency = self.metrics.histogram('recorder_encode_seconds', 'Time spent encoding one frame')
+        self.metrics_server = None
+        self.metrics_file = None
+        # Continuous recording: session rollover and retention.
+        self.rollover_minutes = self.config.get('session_rollover_minutes')
+        self.rollover_bytes = self.config.get('session_rollover_bytes')
+        self.rollover_grace = self.config.get('session_rollover_grace', 5)
+        self.retention = SessionRetention(self.base_output_dir, self.config, active=self.active_sessions)
+        self.closing = None
+        self.sessions_started = 0
+        self.session_started_at = None
+        self.session_bytes = 0
+        self._session_lock = threading.Lock()
+        self._closer_threads = []
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._watch_stop = threading.Event()
+        self.watch_thread = None
         self.setup_logging()
 
     def load_config(self, config_path):
@@ -36,41 +93,129 @@ class DatasetRecorder:
             return yaml.safe_load(f)
 
     def setup_logging(self):
+        os.makedirs(self.base_output_dir, exist_ok=True)
         logging.basicConfig(level=self.config['log_level'],
                             format='%(asctime)s - %(levelname)s - %(message)s',
                             filename=os.path.join(self.base_output_dir, 'recorder.log'))
 
-    def start_recording(self, duration):
+    def start_recording(self, duration=None):
+        # Blocks for duration seconds, or until stop() with duration None.
         try:
-            self.session_dir = self._create_session_dir()
-            self.running = True
-            self._setup_csv_file()
-            self._setup_audio_file()
-
-            self.screenshot_recorder = ScreenshotRecorder(self.data_queue, self.screenshot_freq)
-            self.mouse_keyboard_recorder = MouseKeyboardRecorder(self.data_queue)
-            self.audio_recorder = AudioRecorder(self.audio_file)
-
-            self._start_recorders()
-            self.save_thread = threading.Thread(target=self._save_data, daemon=True)
-            self.save_thread.start()
-
-            logging.info(f"Recording started for {duration} seconds...")
-            time.sleep(duration)
-
+            self.start()
+            logging.info(f"Recording for {duration if duration is not None else 'an unlimited number of'} seconds...")
+            self.wait(duration)
             self.stop_recording()
         except Exception as e:
             logging.error(f"Error during recording: {e}")
             self.stop_recording()
 
+    def start(self):
+        # Starts recording and returns at once; stop(), status() and wait()
+        # control it from there.
+        if self.running:
+            return self
+        self._stopped.clear()
+        self.session_dir = self._create_session_dir()
+        self.running = True
+        if self.config.get('stream_address'):
+            # One connection to the collector for all sessions of this run.
+            self.stream_client = StreamClient(self.config, os.path.join(self.base_output_dir, 'stream_spool'))
+            self.stream_client.start()
+        self._setup_storage_sink()
+        self._setup_screenshot_storage()
+
+        self.activity = create_activity_rate(self.config, shared=self._shared_capture())
+        self.screenshot_recorder = self._create_screenshot_recorder()
+        self.mouse_keyboard_recorder = self._create_input_recorder()
+        self.audio_recorder = self._create_audio_recorder()
+
+        self._start_recorders()
+        self.sink.start()
+        self._start_metrics()
+        self.save_thread = threading.Thread(target=self._save_data, daemon=True)
+        self.save_thread.start()
+        if self.rollover_minutes or self.rollover_bytes:
+            self._watch_stop.clear()
+            self.watch_thread = threading.Thread(target=self._watch_session, daemon=True)
+            self.watch_thread.start()
+        self.retention.start()
+        logging.info(f"Recording started in {self.session_dir}")
+        return self
+
+    def stop(self):
+        self.stop_recording()
+
+    def wait(self, timeout=None):
+        # True once recording has stopped.
+        return self._stopped.wait(timeout)
+
+    def status(self):
+        now = time.time()
+        return {'running': self.running, 'session_dir': self.session_dir, 'sessions': self.sessions_started,
+                'session_seconds': now - self.session_started_at if self.running else 0.0,
+                'session_bytes': self.session_bytes,
+                'closing_session': self.closing.session_dir if self.closing else None,
+                'events_written': self.event_log.records_written if self.event_log is not None else 0,
+                **self.retention.stats()}
+
+    def active_sessions(self):
+        closing = self.closing
+        return [self.session_dir if self.running else None, closing.session_dir if closing else None]
+
     def stop_recording(self):
+        if not self.running:
+            return
         logging.info("Stopping recording...")
         self.running = False
+        self.retention.stop()
+        if self.watch_thread:
+            self._watch_stop.set()
+            self.watch_thread.join()
+            self.watch_thread = None
         self._stop_recorders()
+        if self.save_thread:
+            self.save_thread.join()
         self.flush_data()
         self._close_files()
+        if self.stream_client:
+            self.stream_client.close()
+            self.stream_client = None
+        self._stop_metrics()
+        self._stopped.set()
         logging.info("Recording stopped and data saved.")
 
+    def rollover(self):
+        # Starts a new session while capture, input hooks and audio keep
+        # running. Rows stamped from now on go to the new session; the old
+        # one keeps receiving older rows for session_rollover_grace seconds
+        # and is then closed in the background. Returns False while the
+        # previous rollover is still being closed.
+        with self._session_lock:
+            if not self.running or self.closing is not None:
+                return False
+            session_dir = self._create_session_dir()
+            if self._shared_capture():
+                # The encoder process routes frames by the cut, so the
+                # capture side takes it where the encoder reads it.
+                cut_time = self.screenshot_recorder.rollover(session_dir)
+            else:
+                cut_time = time.time()
+            closing = _ClosingSession(self.session_dir, self.sink, self.screenshot_storage, cut_time)
+            sink = self._create_sink(session_dir)
+            storage = self._create_screenshot_storage(session_dir) if self.screenshot_storage else None
+            # The old session must be visible to the writer thread before
+            # the new writers are, or an older row could land in the new one.
+            self.closing = closing
+            self.session_dir, self.sink, self.event_log, self.audio_writer = session_dir, sink, sink.events, sink.audio
+            self.screenshot_storage = storage
+            closing.audio_switched = self.audio_recorder.switch_writer(sink.audio, cut_time)
+            sink.start()
+            self._start_metrics_file()
+            self.session_bytes = 0
+            self.session_started_at = cut_time
+        logging.info(f"Rolled over to {session_dir} in {1000 * (time.time() - cut_time):.1f} ms")
+        return True
+
     def flush_data(self):
         logging.info("Flushing remaining data...")
         while not self.data_queue.empty():
@@ -84,19 +229,68 @@ class DatasetRecorder:
     def _create_session_dir(self):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         session_dir = os.path.join(self.base_output_dir, f"session_{timestamp}")
+        # Sessions rolled over within the same second get a suffix.
+        suffix = 1
+        while self.sessions_started and os.path.exists(session_dir):
+            session_dir = os.path.join(self.base_output_dir, f"session_{timestamp}_{suffix}")
+            suffix += 1
         os.makedirs(session_dir, exist_ok=True)
+        self.session_started_at = time.time()
+        self.sessions_started += 1
         return session_dir
 
-    def _setup_csv_file(self):
-        self.csv_file = open(os.path.join(self.session_dir, "events.csv"), 'w', newline='')
-        self.csv_writer = csv.writer(self.csv_file)
-        self.csv_writer.writerow(["Timestamp", "EventType", "Data"])
+    def _setup_storage_sink(self):
+        # The sink owns the event log and audio writers; the attributes are
+        # kept so the recorders and metrics can reach them directly.
+        self.sink = self._create_sink(self.session_dir)
+        self.event_log = self.sink.events
+        self.audio_writer = self.sink.audio
+
+    def _create_sink(self, session_dir):
+        # With stream_address the session goes to a collector instead.
+        if self.stream_client:
+            return StreamSink(session_dir, self.config, self.stream_client)
+        return StorageSink(session_dir, self.config)
+
+    def _setup_screenshot_storage(self):
+        self.pending_rows = deque()
+        if self.config.get('capture_mode', 'threads') == 'shared_memory':
+            # Frames are stored by the encoder process; only rows come back.
+            self.encoder = self.screenshot_storage = None
+            return
+        self.encoder = FrameEncoderPool(workers=self.config.get('encoder_workers', 2),
+                                        max_backlog=self.config.get('encoder_max_backlog', 32))
+        self.screenshot_storage = self._create_screenshot_storage(self.session_dir)
+
+    def _create_screenshot_storage(self, session_dir):
+        # Sessions share the encoder pool; each gets its own storage, so the
+        # first frame of a session is always a keyframe.
+        return ScreenshotStorage(os.path.join(session_dir, 'screenshots'), self.config, self.encoder,
+                                 self.screenshot_freq, self.frame_pool)
 
-    def _setup_audio_file(self):
-        self.audio_file = wave.open(os.path.join(self.session_dir, "audio.wav"), 'wb')
-        self.audio_file.setnchannels(self.config['audio_channels'])
-        self.audio_file.setsampwidth(2)
-        self.audio_file.setframerate(self.config['audio_samplerate'])
+    def _shared_capture(self):
+        return self.config.get('capture_mode', 'threads') == 'shared_memory'
+
+    def _create_screenshot_recorder(self):
+        if self._shared_capture():
+            return SharedMemoryCapture(self.data_queue, self.config, self.screenshot_freq, self.session_dir,
+                                       self.activity)
+        return ScreenshotRecorder(self.data_queue, self.screenshot_freq, create_frame_source(self.config),
+                                  self.frame_pool,
+                                  self.metrics.histogram('recorder_capture_grab_seconds', 'Time to grab one frame'),
+                                  create_frame_transform(self.config), self.activity)
+
+    def _create_input_recorder(self):
+        return MouseKeyboardRecorder(self.data_queue, self.config, self.activity)
+
+    def _create_audio_recorder(self):
+        return AudioRecorder(self.audio_writer, self.config)
+
+    def _discard_event(self, event):
+        # A frame the stream buffer dropped will never be encoded, so its
+        # pooled buffer is returned here instead.
+        if event[0] == 'screenshot' and self.frame_pool is not None:
+            self.frame_pool.release(event[2])
 
     def _start_recorders(self):
         self.screenshot_recorder.start()
@@ -108,37 +302,298 @@ class DatasetRecorder:
         self.mouse_keyboard_recorder.stop()
         self.audio_recorder.stop()
 
+    def _start_metrics(self):
+        port = self.config.get('metrics_port')
+        if port is not None and self.metrics_server is None:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, self.config.get('metrics_host', '127.0.0.1'), port)
+                self.metrics_server.start()
+            except OSError as e:
+                self.metrics_server = None
+                logging.error(f"Could not serve metrics on port {port}: {e}")
+        self._start_metrics_file()
+
+    def _start_metrics_file(self):
+        # One metrics.json per session; after a rollover the old one gets
+        # its final snapshot and the new session starts its own.
+        if self.metrics_file:
+            self.metrics_file.stop()
+            self.metrics_file = None
+        interval = self.config.get('metrics_file_interval', 10)
+        if interval:
+            self.metrics_file = MetricsFileWriter(self.metrics, os.path.join(self.session_dir, 'metrics.json'),
+                                                  interval)
+            self.metrics_file.start()
+
+    def _stop_metrics(self):
+        # The final snapshot is written after the files are closed, so it
+        # includes the last flush.
+        if self.metrics_file:
+            self.metrics_file.stop()
+            self.metrics_file = None
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def _collect_metrics(self):
+        # Read from each stage's own stats() only when metrics are scraped.
+        samples = [('recorder_resident_memory_bytes', 'gauge', 'Resident memory of the recorder process', None,
+                    resident_memory_bytes()),
+                   ('recorder_running', 'gauge', 'Whether a session is being recorded', None, int(self.running)),
+                   ('recorder_sessions_total', 'counter', 'Sessions started, including rollovers', None,
+                    self.sessions_started),
+                   ('recorder_session_bytes', 'gauge', 'Last measured size of the current session', None,
+                    self.session_bytes),
+                   ('recorder_sessions_pruned_total', 'counter', 'Sessions removed by the retention policy', None,
+                    self.retention.pruned)]
+        if self.screenshot_recorder is not None:
+            capture = self.screenshot_recorder.stats()
+            samples += [
+                ('recorder_capture_frames_total', 'counter', 'Frames grabbed', None, capture.get('frames')),
+                ('recorder_capture_skipped_ticks_total', 'counter', 'Capture ticks missed or dropped', None,
+                 capture.get('skipped', 0) + capture.get('dropped', 0)),
+                ('recorder_capture_fps', 'gauge', 'Recent capture rate', None, capture.get('fps')),
+                ('recorder_capture_target_fps', 'gauge', 'Capture rate the scheduler is aiming for', None,
+                 capture.get('frequency')),
+                ('recorder_capture_effective_fps', 'gauge', 'Frames per second over the whole session', None,
+                 capture.get('effective_fps')),
+                ('recorder_capture_grab_ms', 'gauge', 'Mean grab time over the recent window', None,
+                 capture.get('grab_ms_mean')),
+                ('recorder_capture_lateness_ms', 'gauge', 'Mean tick lateness over the recent window', None,
+                 capture.get('lateness_ms_mean')),
+            ]
+        for stream, stats in self.data_queue.stats().items():
+            labels = {'stream': stream}
+            samples += [
+                ('recorder_queue_depth', 'gauge', 'Items waiting in the stream buffer', labels, stats['size']),
+                ('recorder_queue_high_water', 'gauge', 'Most items ever held in memory', labels, stats['high_water']),
+                ('recorder_queue_put_total', 'counter', 'Items put into the stream buffer', labels, stats['put']),
+                ('recorder_queue_dropped_total', 'counter', 'Items dropped by the buffer policy', labels,
+                 stats['dropped']),
+                ('recorder_queue_spilled_total', 'counter', 'Items spilled to disk', labels, stats['spilled']),
+                ('recorder_queue_blocked_seconds_total', 'counter', 'Time producers spent blocked', labels,
+                 stats['blocked_seconds']),
+            ]
+        samples.append(('recorder_pending_rows', 'gauge', 'Rows waiting for their frame to be encoded', None,
+                        len(self.pending_rows)))
+        if self.encoder is not None:
+            encoder = self.encoder.stats()
+            samples += [
+                ('recorder_encode_submitted_total', 'counter', 'Frames submitted to the encoder', None,
+                 encoder['submitted']),
+                ('recorder_encode_failed_total', 'counter', 'Frames the encoder failed to write', None,
+                 encoder['failed']),
+                ('recorder_encode_backlog', 'gauge', 'Frames waiting for an encoder', None, encoder['backlog']),
+            ]
+        if self.screenshot_storage is not None:
+            storage = self.screenshot_storage.stats()
+            for kind in ('keyframe', 'delta', 'unchanged'):
+                samples.append(('recorder_frames_stored_total', 'counter', 'Frames by storage decision',
+                                {'kind': kind}, storage.get(kind)))
+            samples += [
+                ('recorder_frame_pool_hits_total', 'counter', 'Frame buffers reused from the pool', None,
+                 storage.get('pool_hits')),
+                ('recorder_frame_pool_misses_total', 'counter', 'Frame buffers newly allocated', None,
+                 storage.get('pool_misses')),
+                ('recorder_frame_pool_in_use', 'gauge', 'Pooled frame buffers in use', None,
+                 storage.get('pool_in_use')),
+            ]
+        if self.sink is not None:
+            samples.append(('recorder_events_written_total', 'counter', 'Records written to the event log', None,
+                            self.event_log.records_written))
+        if isinstance(self.sink, StorageSink):
+            sync = self.sink.stats()
+            samples += [
+                ('recorder_storage_sync_rounds_total', 'counter', 'Group fsync rounds of the storage sink', None,
+                 sync['sync_rounds']),
+                ('recorder_storage_sync_ms_max', 'gauge', 'Longest group fsync round in milliseconds', None,
+                 sync['sync_ms_max']),
+            ]
+        if self.stream_client is not None:
+            stream = self.stream_client.stats()
+            samples += [
+                ('recorder_stream_connected', 'gauge', 'Whether the collector connection is up', None,
+                 int(stream['connected'])),
+                ('recorder_stream_bytes_sent_total', 'counter', 'Bytes sent to the collector', None,
+                 stream['bytes_sent']),
+                ('recorder_stream_raw_bytes_total', 'counter', 'Bytes streamed before compression', None,
+                 stream['raw_bytes']),
+                ('recorder_stream_queued_bytes', 'gauge', 'Batches waiting for the collector, in bytes', None,
+                 stream['queued_bytes']),
+                ('recorder_stream_spooled_total', 'counter', 'Batches spilled to the local spool', None,
+                 stream['batches_spooled']),
+                ('recorder_stream_reconnects_total', 'counter', 'Reconnections to the collector', None,
+                 stream['reconnects']),
+                ('recorder_stream_blocked_seconds_total', 'counter', 'Time the writer waited on a full stream queue',
+                 None, stream['blocked_seconds']),
+            ]
+        if self.mouse_keyboard_recorder is not None and getattr(self.mouse_keyboard_recorder, 'simplifier', None):
+            trajectory = self.mouse_keyboard_recorder.simplifier.stats()
+            samples += [
+                ('recorder_mouse_moves_received_total', 'counter', 'Mouse moves seen', None, trajectory['received']),
+                ('recorder_mouse_moves_kept_total', 'counter', 'Mouse moves kept by simplification', None,
+                 trajectory['kept']),
+            ]
+        if self.audio_recorder is not None:
+            audio = self.audio_recorder.stats()
+            samples += [
+                ('recorder_audio_frames_written_total', 'counter', 'Audio frames written', None,
+                 audio['frames_written']),
+                ('recorder_audio_buffered_frames', 'gauge', 'Audio frames waiting in the ring buffer', None,
+                 audio['available']),
+                ('recorder_audio_overflow_frames_total', 'counter',
+                 'Audio frames lost to a full ring buffer, written as silence', None,
+                 audio['overflow_frames']),
+                ('recorder_audio_callback_status_total', 'counter', 'Audio callbacks reporting a status flag', None,
+                 audio['callback_status']),
+            ]
+        return samples
+
     def _close_files(self):
-        if self.csv_file:
-            self.csv_file.close()
-        if self.audio_file:
-            self.audio_file.close()
+        self.data_queue.close()
+        if self.encoder:
+            self._commit_pending(wait=True)
+            self.encoder.shutdown()
+        closing, self.closing = self.closing, None
+        if closing:
+            self._close_session(closing)
+        for thread in self._closer_threads:
+            thread.join()
+        self._closer_threads = []
+        self._close_session(_ClosingSession(self.session_dir, self.sink, self.screenshot_storage, None))
+
+    def _close_session(self, session):
+        if session.audio_switched is not None and not session.audio_switched.wait(timeout=10):
+            logging.warning(f"Audio did not reach the rollover point of {session.session_dir}")
+        if session.screenshot_storage:
+            session.screenshot_storage.close()
+        if session.sink:
+            session.sink.close()
+            if session.sink.binary:
+                if self.config.get('event_log_export_csv', False):
+                    EventLog(session.session_dir).to_csv()
+                if self.config.get('session_index', True):
+                    self._build_session_index(session.session_dir)
+
+    def _finish_rollover(self):
+        # Called by the writer thread: once the grace period is over and no
+        # row from before the cut is waiting for its frame, the old session
+        # is closed on its own thread so writing never stalls.
+        closing = self.closing
+        if closing is None or time.time() - closing.cut_time < self.rollover_grace:
+            return
+        if any(row[0] < closing.cut_time for row, _ in self.pending_rows):
+            return
+        with self._session_lock:
+            self.closing = None
+        thread = threading.Thread(target=self._close_session, args=(closing,), daemon=True)
+        self._closer_threads = [t for t in self._closer_threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _watch_session(self):
+        # Rolls over by age or size. The size is measured every
+        # SIZE_CHECK_INTERVAL seconds, not on every write.
+        last_size_check = 0.0
+        while not self._watch_stop.wait(1.0):
+            now = time.time()
+            if self.rollover_bytes and now - last_size_check >= SIZE_CHECK_INTERVAL:
+                last_size_check = now
+                try:
+                    self.session_bytes = directory_size(self.session_dir)
+                except OSError as e:
+                    logging.error(f"Could not measure {self.session_dir}: {e}")
+            due = (self.rollover_minutes and now - self.session_started_at >= self.rollover_minutes * 60) or \
+                (self.rollover_bytes and self.session_bytes >= self.rollover_bytes)
+            if due:
+                self.rollover()
+
+    def _build_session_index(self, session_dir=None):
+        audio = {'dir': AUDIO_DIR, 'samplerate': self.config['audio_samplerate'],
+                 'channels': self.config['audio_channels']}
+        try:
+            meta = build_session_index(session_dir or self.session_dir, audio)
+            logging.info(f"Session index written: {meta['events']} events, {meta['frames']} frames")
+        except Exception as e:
+            logging.error(f"Error building session index: {e}")
 
     def _save_data(self):
         buffer = []
         last_save_time = time.time()
+        flush_interval = min(self.config['buffer_time'], self.sink.max_loss / 2)
         while self.running or not self.data_queue.empty():
             try:
                 event = self.data_queue.get(timeout=0.1)
                 buffer.append(event)
-                if len(buffer) >= self.config['buffer_size'] or time.time() - last_save_time > self.config['buffer_time']:
+            except queue.Empty:
+                self._commit_pending()
+            except Exception as e:
+                logging.error(f"Error saving data: {e}")
+                continue
+            try:
+                # Batches are also cut by time, even when the queue goes
+                # quiet, so the group sync always has something recent to
+                # make durable.
+                if len(buffer) >= self.config['buffer_size'] or \
+                        (buffer and time.time() - last_save_time > flush_interval):
                     self._process_buffer(buffer)
                     buffer = []
                     last_save_time = time.time()
-            except queue.Empty:
-                continue
             except Exception as e:
                 logging.error(f"Error saving data: {e}")
+            self._finish_rollover()
         self._process_buffer(buffer)  # Process any remaining data
 
     def _process_buffer(self, buffer):
+        buffer.sort(key=lambda event: event[1])
         for event_type, timestamp, data in buffer:
             self._process_event(event_type, timestamp, data)
+        self._commit_pending()
+        closing = self.closing
+        if closing:
+            closing.sink.flush()
+        self.sink.flush()
+
+    def _commit_row(self, row, job=None):
+        self.pending_rows.append((row, job))
+        self._commit_pending()
+
+    def _commit_pending(self, wait=False):
+        # Rows are written strictly in the order they were committed; a row
+        # whose frame is still being encoded holds back the rows behind it.
+        while self.pending_rows:
+            row, job = self.pending_rows[0]
+            if job is not None and not (wait or job.done()):
+                break
+            self.pending_rows.popleft()
+            if job is not None:
+                try:
+                    result = job.result()
+                    if isinstance(result, tuple):
+                        self.encode_latency.observe(result[1], type=row[1])
+                except Exception as e:
+                    logging.error(f"Error encoding {row[2]}: {e}")
+                    continue
+            self._write_event(*row)
+
+    def _write_event(self, timestamp, event_type, data):
+        self.write_latency.observe(time.time() - timestamp, type=event_type)
+        with self._session_lock:
+            sink = self._session_for(timestamp).sink
+        sink.append(timestamp, event_type, data)
+
+    def _session_for(self, timestamp):
+        # The closing session, for rows stamped before its rollover.
+        closing = self.closing
+        if closing is not None and timestamp < closing.cut_time:
+            return closing
+        return self
 
     def _process_event(self, event_type, timestamp, data):
         try:
             if event_type == 'screenshot':
                 self._save_screenshot(timestamp, data)
+            elif event_type == 'screenshot_stored':
+                self._commit_row(list(data))
             elif event_type in ['mouse_move', 'mouse_click', 'mouse_scroll', 'key_press', 'key_release']:
                 self._save_input_event(event_type, timestamp, data)
             else:
@@ -147,32 +602,22 @@ class DatasetRecorder:
             logging.error(f"Error processing event {event_type}: {e}")
 
     def _save_screenshot(self, timestamp, data):
-        filename = f"screenshot_{int(timestamp)}.png"
-        img_path = os.path.join(self.session_dir, 'screenshots', filename)
-        os.makedirs(os.path.dirname(img_path), exist_ok=True)
-        cv2.imwrite(img_path, cv2.cvtColor(data, cv2.COLOR_RGB2BGR))
-        self.csv_writer.writerow([timestamp, 'screenshot', filename])
+        with self._session_lock:
+            storage = self._session_for(timestamp).screenshot_storage
+        self._commit_row(*storage.save(timestamp, data))
 
     def _save_input_event(self, event_type, timestamp, data):
-        csv_data = self._format_event_data(event_type, data)
-        self.csv_writer.writerow([timestamp, event_type, csv_data])
-
-    def _format_event_data(self, event_type, data):
-        if event_type == 'mouse_move':
-            return f"x={data[0]}, y={data[1]}"
-        elif event_type == 'mouse_click':
-            return f"x={data[0]}, y={data[1]}, button={data[2]}, pressed={data[3]}"
-        elif event_type == 'mouse_scroll':
-            return f"x={data[0]}, y={data[1]}, dx={data[2]}, dy={data[3]}"
-        elif event_type in ['key_press', 'key_release']:
-            return f"key={data}"
-        else:
-            return str(data)
+        self._commit_row([timestamp, event_type, data])
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record screen, input and audio")
+    parser.add_argument('--duration', type=float, default=60, help="seconds to record")
+    parser.add_argument('--continuous', action='store_true',
+                        help="record until interrupted, rolling sessions over as configured")
+    args = parser.parse_args()
     recorder = DatasetRecorder()
     try:
-        recorder.start_recording(duration=60)  # Record for 60 seconds
+        recorder.start_recording(duration=None if args.continuous else args.duration)
     except KeyboardInterrupt:
         print("Recording stopped by user.")
     finally:
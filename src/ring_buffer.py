@@ -0,0 +1,58 @@
+import numpy as np
+
+class AudioRingBuffer:
+    # Single-producer, single-consumer ring of audio frames. The producer
+    # (the PortAudio callback) only advances write_position and the consumer
+    # only advances read_position, so neither side ever takes a lock or
+    # allocates: the callback does one or two slice copies and returns.
+    def __init__(self, capacity, channels, dtype=np.float32):
+        self.capacity = capacity
+        self.channels = channels
+        self.data = np.zeros((capacity, channels), dtype=dtype)
+        self.write_position = 0
+        self.read_position = 0
+        self.overflows = 0
+        self.overflow_frames = 0
+        self.underflows = 0
+        self.high_water = 0
+
+    def available(self):
+        return self.write_position - self.read_position
+
+    def write(self, block):
+        frames = len(block)
+        free = self.capacity - self.available()
+        if frames > free:
+            # Never overwrite unread audio: keep what fits and count the rest.
+            self.overflows += 1
+            self.overflow_frames += frames - free
+            frames = free
+        start = self.write_position % self.capacity
+        first = min(frames, self.capacity - start)
+        self.data[start:start + first] = block[:first]
+        self.data[:frames - first] = block[first:frames]
+        self.write_position += frames
+        self.high_water = max(self.high_water, self.available())
+        return frames
+
+    def read(self, max_frames=None):
+        # Returns a copy of up to max_frames unread frames, oldest first.
+        frames = self.available()
+        if max_frames is not None:
+            frames = min(frames, max_frames)
+        if frames == 0:
+            self.underflows += 1
+            return self.data[:0].copy()
+        start = self.read_position % self.capacity
+        first = min(frames, self.capacity - start)
+        if first == frames:
+            block = self.data[start:start + frames].copy()
+        else:
+            block = np.concatenate((self.data[start:], self.data[:frames - first]))
+        self.read_position += frames
+        return block
+
+    def stats(self):
+        return {'capacity': self.capacity, 'available': self.available(), 'high_water': self.high_water,
+                'overflows': self.overflows, 'overflow_frames': self.overflow_frames,
+                'underflows': self.underflows}
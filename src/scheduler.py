@@ -0,0 +1,210 @@
+import math
+import time
+import threading
+import multiprocessing
+from collections import deque
+
+class DeadlineScheduler:
+    # Ticks are placed on an absolute grid origin + n * period measured on the
+    # monotonic clock, so time spent grabbing and converting a frame never
+    # pushes later ticks back. When a tick is missed entirely the scheduler
+    # jumps to the most recent grid point instead of firing a burst of
+    # catch-up ticks.
+    #
+    # With an ActivityRate the period follows input activity: on every rate
+    # change (and for the extra frame after a click) the grid is re-anchored
+    # at the next tick, keeping indices increasing so timestamp() stays valid.
+    def __init__(self, frequency, clock=time.monotonic, wall_clock=time.time, lateness_window=1000, activity=None):
+        self.period = 1 / frequency
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.activity = activity
+        self.ticks = 0
+        self.skipped = 0
+        self.triggered = 0
+        self.lateness = deque(maxlen=lateness_window)
+        self.mode = None
+        self.mode_seconds = {}
+        self.mode_ticks = {}
+        self._origin = None
+        self._start = None
+        self._wall_origin = None
+        self._next_index = 0
+        self._last_deadline = None
+        self._mode_since = None
+        self._extra = math.inf
+        self._stop_event = threading.Event()
+        self._wake = activity.wake if activity is not None else None
+
+    @property
+    def frequency(self):
+        return 1 / self.period
+
+    def start(self):
+        self._stop_event.clear()
+        self._origin = self._start = self.clock()
+        self._wall_origin = self.wall_clock()
+        self._next_index = 0
+        self._last_deadline = None
+
+    def stop(self):
+        self._stop_event.set()
+        if self._wake is not None:
+            self._wake.set()
+
+    def deadline(self, index):
+        return self._origin + index * self.period
+
+    def timestamp(self, index):
+        return self._wall_origin + (self.deadline(index) - self._start)
+
+    def wait(self):
+        # Returns the grid index of the tick that fired, or None once stopped.
+        if self._origin is None:
+            self.start()
+        while True:
+            if self.activity is not None:
+                self._follow_activity(self.clock())
+            delay = self.deadline(self._next_index) - self.clock()
+            if delay <= 0:
+                break
+            if self._sleep(delay):
+                return None
+            if self.activity is None:
+                break
+        if self._stop_event.is_set():
+            return None
+        now = self.clock()
+        index = max(self._next_index, int((now - self._origin) / self.period))
+        self.skipped += index - self._next_index
+        self.lateness.append(now - self.deadline(index))
+        self.ticks += 1
+        if self.mode is not None:
+            self.mode_ticks[self.mode] = self.mode_ticks.get(self.mode, 0) + 1
+        self._next_index = index + 1
+        self._last_deadline = self.deadline(index)
+        return index
+
+    def _sleep(self, delay):
+        # Returns True once stopped. An activity change wakes the wait early
+        # so a click during a long idle period is not missed.
+        if self._wake is None:
+            return self._stop_event.wait(delay)
+        self._wake.wait(delay)
+        self._wake.clear()
+        return self._stop_event.is_set()
+
+    def _follow_activity(self, now):
+        mode, extra = self.activity.schedule(now)
+        next_deadline = self.deadline(self._next_index)
+        if mode != self.mode:
+            self._account_mode(now)
+            self.mode = mode
+            self.period = 1 / self.activity.frequencies[mode]
+            if self._last_deadline is not None:
+                next_deadline = max(now, self._last_deadline + self.period)
+        self._extra = min(self._extra, extra)
+        if self._extra <= next_deadline:
+            next_deadline = max(now, self._extra)
+            self._extra = math.inf
+            self.triggered += 1
+        self._origin = next_deadline - self._next_index * self.period
+
+    def _account_mode(self, now):
+        if self.mode is not None:
+            self.mode_seconds[self.mode] = self.mode_seconds.get(self.mode, 0.0) + now - self._mode_since
+        self._mode_since = now
+
+    def stats(self):
+        stats = {'frequency': self.frequency, 'ticks': self.ticks, 'skipped': self.skipped,
+                 'effective_fps': 0.0, 'lateness_ms_mean': 0.0, 'lateness_ms_max': 0.0}
+        if self._start is not None:
+            elapsed = self.clock() - self._start
+            stats['effective_fps'] = self.ticks / elapsed if elapsed > 0 else 0.0
+        if self.lateness:
+            stats['lateness_ms_mean'] = 1000 * sum(self.lateness) / len(self.lateness)
+            stats['lateness_ms_max'] = 1000 * max(self.lateness)
+        if self.activity is not None:
+            # Time and frames per activity mode, for the per-session summary.
+            seconds = dict(self.mode_seconds)
+            if self.mode is not None:
+                seconds[self.mode] = seconds.get(self.mode, 0.0) + self.clock() - self._mode_since
+            for mode in ActivityRate.MODES:
+                stats[f'{mode}_seconds'] = seconds.get(mode, 0.0)
+                stats[f'{mode}_frames'] = self.mode_ticks.get(mode, 0)
+            stats['click_frames'] = self.triggered
+        return stats
+
+class ActivityRate:
+    # Capture rate driven by input activity: 'idle' once there has been no
+    # input for idle_after seconds, 'burst' for burst_window seconds after a
+    # click, scroll or key event, and 'active' otherwise. With click_delay
+    # set, each click also asks for one frame click_delay seconds later.
+    #
+    # notify() is called from the input listeners and schedule() from the
+    # capture loop, possibly in another process: the state lives in a
+    # three-slot array (last input, last burst event, pending click frame)
+    # on the monotonic clock, and wake is set whenever the rate should
+    # change right away.
+    MODES = ('idle', 'active', 'burst')
+
+    def __init__(self, frequency, idle_frequency=None, burst_frequency=None, idle_after=5.0, burst_window=1.0,
+                 click_delay=None, clock=time.monotonic, state=None, wake=None):
+        self.frequencies = {'idle': idle_frequency or frequency, 'active': frequency,
+                            'burst': burst_frequency or frequency}
+        self.idle_after = idle_after
+        self.burst_window = burst_window
+        self.click_delay = click_delay
+        self.clock = clock
+        self.state = state if state is not None else [0.0] * 3
+        self.state[0] = clock()
+        self.state[1] = -math.inf
+        self.state[2] = math.inf
+        self.wake = wake if wake is not None else threading.Event()
+
+    def mode(self, now):
+        if now - self.state[1] < self.burst_window:
+            return 'burst'
+        if now - self.state[0] >= self.idle_after:
+            return 'idle'
+        return 'active'
+
+    def notify(self, kind):
+        # kind is 'move', 'click', 'scroll' or 'key'. Mouse moves only keep
+        # the session out of idle, so they wake the capture loop just once.
+        now = self.clock()
+        before = self.mode(now)
+        self.state[0] = now
+        if kind != 'move':
+            self.state[1] = now
+        wake = self.mode(now) != before
+        if kind == 'click' and self.click_delay is not None:
+            self.state[2] = min(self.state[2], now + self.click_delay)
+            wake = True
+        if wake:
+            self.wake.set()
+
+    def schedule(self, now):
+        # Returns the mode for now and the time of a pending click frame
+        # (inf when there is none), which is handed over only once.
+        extra = self.state[2]
+        if extra != math.inf:
+            self.state[2] = math.inf
+        return self.mode(now), extra
+
+def create_activity_rate(config, shared=False):
+    # None unless an idle rate, burst rate or click frame is configured. A
+    # shared instance can be passed to a spawned capture process.
+    idle_frequency = config.get('screenshot_idle_freq')
+    burst_frequency = config.get('screenshot_burst_freq')
+    click_delay = config.get('screenshot_click_delay')
+    if idle_frequency is None and burst_frequency is None and click_delay is None:
+        return None
+    state = wake = None
+    if shared:
+        context = multiprocessing.get_context('spawn')
+        state = context.RawArray('d', 3)
+        wake = context.Event()
+    return ActivityRate(config['screenshot_freq'], idle_frequency, burst_frequency,
+                        config.get('screenshot_idle_after', 5.0), config.get('screenshot_burst_window', 1.0),
+                        click_delay, state=state, wake=wake)
@@ -1,31 +1,87 @@
 import threading
 import time
 import logging
-import pyscreenshot as ImageGrab
-import numpy as np
+
+from .frame_sources import create_frame_source
+from .scheduler import DeadlineScheduler
 
 class ScreenshotRecorder:
-    def __init__(self, output_queue, frequency):
+    def __init__(self, output_queue, frequency, source=None, pool=None, grab_histogram=None, transform=None,
+                 activity=None):
         self.output_queue = output_queue
+        self.transform = transform
+        self._raw = None
+        self._frame_shape = None
+        self.pool = pool
+        self.grab_histogram = grab_histogram
         self.frequency = frequency
+        self.source = source if source is not None else create_frame_source({})
+        self.scheduler = DeadlineScheduler(frequency, activity=activity)
         self.running = False
 
     def start(self):
         self.running = True
         threading.Thread(target=self._record, daemon=True).start()
-        logging.info("Screenshot recorder started")
+        logging.info(f"Screenshot recorder started ({self.source.name} backend)")
 
     def stop(self):
         self.running = False
+        self.scheduler.stop()
         logging.info("Screenshot recorder stopped")
 
+    def stats(self):
+        return {**self.source.stats(), **self.scheduler.stats()}
+
     def _record(self):
-        while self.running:
-            try:
-                screenshot = ImageGrab.grab()
-                screenshot_np = np.array(screenshot)
-                self.output_queue.put(('screenshot', time.time(), screenshot_np))
-                time.sleep(1 / self.frequency)
-            except Exception as e:
-                logging.error(f"Screenshot error: {e}")
-                time.sleep(1)  # Prevent rapid error logging
+        try:
+            self.source.open()
+        except Exception as e:
+            logging.error(f"Could not open {self.source.name} screenshot backend: {e}")
+            return
+        try:
+            self.scheduler.start()
+            while self.running:
+                tick = self.scheduler.wait()
+                if tick is None:
+                    break
+                try:
+                    screenshot_np = self._capture()
+                    self.output_queue.put(('screenshot', self.scheduler.timestamp(tick), screenshot_np))
+                except Exception as e:
+                    logging.error(f"Screenshot error: {e}")
+                    time.sleep(1)  # Prevent rapid error logging
+        finally:
+            self.source.close()
+            logging.info(f"Screenshot recorder stats: {self.stats()}")
+
+    def _capture(self):
+        # Frames go into pooled buffers once their size is known; the writer
+        # releases them after encoding. With a reducing transform the full
+        # size grab lands in a private buffer reused every tick and only the
+        # reduced frame is pooled and queued.
+        region = self.transform.region() if self.transform is not None else None
+        reduce = self.transform is not None and self.transform.reduces
+        out = None if reduce else self._acquire(self._frame_shape)
+        try:
+            grab_start = time.perf_counter()
+            frame = self.source.grab(self._raw if reduce else out, region)
+            if self.grab_histogram is not None:
+                self.grab_histogram.observe(time.perf_counter() - grab_start)
+            if reduce:
+                self._raw = frame
+                out = self._acquire(self.transform.output_shape(frame.shape))
+                frame = self.transform.apply(frame, out)
+        except Exception:
+            self._release(out)
+            raise
+        if frame is not out:
+            self._release(out)
+        self._frame_shape = frame.shape
+        return frame
+
+    def _acquire(self, shape):
+        return self.pool.acquire(shape) if self.pool is not None and shape else None
+
+    def _release(self, frame):
+        if self.pool is not None:
+            self.pool.release(frame)
@@ -0,0 +1,169 @@
+import os
+import logging
+import threading
+
+import cv2
+
+from .change_detection import FrameChangeDetector, save_delta
+from .encoder import write_image, image_extension
+from .frame_hash import FrameHashLog, phash
+from .frame_transform import scaled_size
+from .video_storage import VideoFrameStore, parse_frame_reference
+
+THUMBNAIL_DIR = 'thumbnails'
+LOSSLESS_FORMATS = ('png',)
+
+def thumbnail_name(filename):
+    # Thumbnail written with a stored frame, relative to the screenshots
+    # directory: screenshot_1.png and screenshot_1.delta.npz both map to
+    # thumbnails/screenshot_1.png, segment_00000.mkv#12 to
+    # thumbnails/segment_00000_12.png.
+    if '#' in filename:
+        segment_file, frame = parse_frame_reference(filename)
+        base = f"{segment_file.split('.')[0]}_{frame}"
+    else:
+        base = filename.split('.')[0]
+    return os.path.join(THUMBNAIL_DIR, base + '.png')
+
+def write_thumbnail(path, frame, scale):
+    size = scaled_size(frame.shape[1], frame.shape[0], scale)
+    return write_image(path, cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+
+def load_thumbnail(screenshots_dir, filename):
+    image = cv2.imread(os.path.join(screenshots_dir, thumbnail_name(filename)), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(thumbnail_name(filename))
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if image.ndim == 3 else image
+
+class ScreenshotStorage:
+    # Decides how each captured frame is stored (repeat row, tile delta,
+    # image or video frame) and hands the write to the encoder. save()
+    # returns the event row and the job writing it, so the caller decides
+    # how to keep rows in order: DatasetRecorder queues them, the shared
+    # memory encoder process simply waits. Pooled frames are released once
+    # their job is done.
+    def __init__(self, screenshots_dir, config, encoder, frequency, pool=None):
+        os.makedirs(screenshots_dir, exist_ok=True)
+        self.screenshots_dir = screenshots_dir
+        self.config = config
+        self.encoder = encoder
+        self.pool = pool
+        self.video_store = None
+        if config.get('screenshot_storage', 'images') == 'video':
+            self.video_store = VideoFrameStore(screenshots_dir, frequency,
+                                               codec=config.get('video_codec', 'FFV1'),
+                                               extension=config.get('video_extension', '.mkv'),
+                                               segment_frames=config.get('video_segment_frames', 3000))
+        self.change_detector = None
+        if config.get('screenshot_change_detection', False):
+            self.change_detector = FrameChangeDetector(
+                tile_size=config.get('screenshot_tile_size', 32),
+                keyframe_interval=config.get('screenshot_keyframe_interval', 100),
+                max_delta_ratio=config.get('screenshot_max_delta_ratio', 0.5), pool=pool)
+        self.image_format = config.get('screenshot_format', 'png')
+        self.image_quality = config.get('screenshot_quality')
+        if self.change_detector and self.image_format not in LOSSLESS_FORMATS:
+            # Deltas are exact tiles laid over the decoded keyframe, so a
+            # lossy keyframe would make every rebuilt frame inexact.
+            logging.warning(f"screenshot_format {self.image_format} is lossy; with change detection keyframes "
+                            f"are stored as PNG")
+            self.image_format, self.image_quality = 'png', None
+        # With a thumbnail scale every stored frame also gets a small PNG,
+        # encoded in its own job from the same frame buffer.
+        self.thumbnail_scale = config.get('screenshot_thumbnail_scale')
+        if self.thumbnail_scale:
+            os.makedirs(os.path.join(screenshots_dir, THUMBNAIL_DIR), exist_ok=True)
+        # With screenshot_hash every stored frame is also perceptually
+        # hashed in an encoder job, for deduplication and similarity search.
+        self.hash_log = FrameHashLog(screenshots_dir) if config.get('screenshot_hash', False) else None
+        self.keyframe_name = None
+        self.last_screenshot_name = None
+
+    def save(self, timestamp, frame):
+        try:
+            row, job = self._save(timestamp, frame)
+            jobs = [job] if job is not None else []
+            if job is not None and self.thumbnail_scale:
+                jobs.append(self._save_thumbnail(row[2], frame))
+            if job is not None and self.hash_log:
+                hash_job = self.encoder.submit(phash, frame)
+                self.hash_log.track(timestamp, hash_job)
+                jobs.append(hash_job)
+        except Exception:
+            if self.pool is not None:
+                self.pool.release(frame)
+            raise
+        if self.pool is not None:
+            self._release_after(frame, jobs)
+        return row, job
+
+    def _save_thumbnail(self, filename, frame):
+        name = thumbnail_name(filename)
+        job = self.encoder.submit(write_thumbnail, os.path.join(self.screenshots_dir, name), frame,
+                                  self.thumbnail_scale)
+
+        def report(done):
+            if done.exception() is not None:
+                logging.error(f"Error writing thumbnail {name}: {done.exception()}")
+        job.add_done_callback(report)
+        return job
+
+    def _release_after(self, frame, jobs):
+        # The buffer goes back to the pool once every job reading it is done.
+        if not jobs:
+            self.pool.release(frame)
+            return
+        # Callbacks can arrive on different threads (video writer, encoder).
+        remaining = [len(jobs)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.pool.release(frame)
+        for job in jobs:
+            job.add_done_callback(done)
+
+    def _save(self, timestamp, frame):
+        kind, mask = 'keyframe', None
+        if self.change_detector:
+            kind, mask = self.change_detector.classify(frame)
+        if kind == 'unchanged':
+            return [timestamp, 'screenshot_repeat', self.last_screenshot_name], None
+        if self.video_store:
+            filename, job = self.video_store.submit(timestamp, frame)
+            row = [timestamp, 'screenshot', filename]
+        elif kind == 'delta':
+            filename = f"screenshot_{int(timestamp * 1000)}.delta.npz"
+            job = self.encoder.submit(save_delta, os.path.join(self.screenshots_dir, filename), self.keyframe_name,
+                                      frame, mask, self.change_detector.tile_size)
+            row = [timestamp, 'screenshot_delta', filename]
+        else:
+            filename = f"screenshot_{int(timestamp * 1000)}{image_extension(self.image_format)}"
+            job = self.encoder.submit(write_image, os.path.join(self.screenshots_dir, filename), frame,
+                                      self.image_format, self.image_quality)
+            row = [timestamp, 'screenshot', filename]
+            self.keyframe_name = filename
+        self.last_screenshot_name = filename
+        return row, job
+
+    def stats(self):
+        stats = self.pool.stats() if self.pool is not None else {}
+        if self.change_detector:
+            stats.update(self.change_detector.stats())
+        if self.video_store:
+            stats.update(self.video_store.stats())
+        if self.hash_log:
+            stats['frames_hashed'] = self.hash_log.records_written
+        return stats
+
+    def close(self):
+        if self.video_store:
+            self.video_store.close()
+        if self.hash_log:
+            self.hash_log.close()
+        stats = self.stats()
+        if stats:
+            logging.info(f"Screenshot storage stats: {stats}")
@@ -0,0 +1,110 @@
+import os
+import json
+import logging
+
+import numpy as np
+
+from .audio_storage import AudioSegmentReader
+from .event_log import EventLog, EVENT_CODES, EVENT_TYPES, SCREENSHOT_EVENTS
+
+INDEX_DIR = 'index'
+SESSION_META_FILE = 'session.json'
+
+def build_session_index(session_dir, audio=None):
+    # Writes sorted timestamp arrays for every stream under session_dir/index
+    # so SessionIndex can answer time-window queries with binary search on
+    # memory-mapped files. audio describes the session's audio: either
+    # segmented ({'dir', 'samplerate', 'channels', 'start_time'}) or a single
+    # WAV file ({'file', 'samplerate', 'channels', 'start_time'}).
+    index_dir = os.path.join(session_dir, INDEX_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+    log = EventLog(session_dir)
+    timestamps = log.records['timestamp']
+    order = np.argsort(timestamps, kind='stable')
+    sorted_times = timestamps[order]
+    np.save(os.path.join(index_dir, 'events_time.npy'), sorted_times)
+    np.save(os.path.join(index_dir, 'events_order.npy'), order.astype(np.int64))
+
+    types = log.records['type'][order]
+    is_frame = np.isin(types, [EVENT_CODES[name] for name in SCREENSHOT_EVENTS])
+    np.save(os.path.join(index_dir, 'frames_time.npy'), sorted_times[is_frame])
+    np.save(os.path.join(index_dir, 'frames_event.npy'), order[is_frame].astype(np.int64))
+
+    meta = {'events': int(len(order)), 'frames': int(is_frame.sum()),
+            'start_time': float(sorted_times[0]) if len(order) else None,
+            'end_time': float(sorted_times[-1]) if len(order) else None,
+            'audio': None}
+    if audio and 'dir' in audio:
+        reader = AudioSegmentReader(os.path.join(session_dir, audio['dir']), audio['samplerate'])
+        if reader.start_time is not None:
+            meta['audio'] = dict(audio, start_time=reader.start_time, samples=reader.total_samples)
+    elif audio and audio.get('start_time') is not None:
+        meta['audio'] = dict(audio, samples=_count_audio_samples(os.path.join(session_dir, audio['file'])))
+    with open(os.path.join(index_dir, SESSION_META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+def _count_audio_samples(path):
+    if not os.path.exists(path):
+        return 0
+    import wave
+    try:
+        with wave.open(path, 'rb') as wav:
+            return wav.getnframes()
+    except (wave.Error, EOFError) as e:
+        logging.warning(f"Could not read {path}: {e}")
+        return 0
+
+class SessionIndex:
+    # Time-window queries over a recorded session. All arrays are memory
+    # mapped, so opening an index costs the same for a minute or a day of
+    # recording and every lookup is a binary search.
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        index_dir = os.path.join(session_dir, INDEX_DIR)
+        self.log = EventLog(session_dir, mmap=True)
+        self.events_time = np.load(os.path.join(index_dir, 'events_time.npy'), mmap_mode='r')
+        self.events_order = np.load(os.path.join(index_dir, 'events_order.npy'), mmap_mode='r')
+        self.frames_time = np.load(os.path.join(index_dir, 'frames_time.npy'), mmap_mode='r')
+        self.frames_event = np.load(os.path.join(index_dir, 'frames_event.npy'), mmap_mode='r')
+        with open(os.path.join(index_dir, SESSION_META_FILE)) as f:
+            self.meta = json.load(f)
+
+    @property
+    def start_time(self):
+        return self.meta['start_time']
+
+    @property
+    def end_time(self):
+        return self.meta['end_time']
+
+    def events(self, t0, t1):
+        # Event records with t0 <= timestamp < t1, in timestamp order.
+        first, last = np.searchsorted(self.events_time, [t0, t1])
+        return self.log.records[self.events_order[first:last]]
+
+    def frames(self, t0, t1):
+        # (timestamp, event type, frame reference) for frames in [t0, t1).
+        first, last = np.searchsorted(self.frames_time, [t0, t1])
+        return [self.frame(position) for position in range(first, last)]
+
+    def frame_at(self, t):
+        # The last frame at or before t, or None if t precedes every frame.
+        position = np.searchsorted(self.frames_time, t, side='right') - 1
+        return self.frame(position) if position >= 0 else None
+
+    def audio_range(self, t0, t1):
+        # Sample range [start, end) of the audio file covering [t0, t1).
+        audio = self.meta['audio']
+        if not audio:
+            return 0, 0
+        start = int(round((t0 - audio['start_time']) * audio['samplerate']))
+        end = int(round((t1 - audio['start_time']) * audio['samplerate']))
+        return min(max(start, 0), audio['samples']), min(max(end, 0), audio['samples'])
+
+    def query(self, t0, t1):
+        return {'events': self.events(t0, t1), 'frames': self.frames(t0, t1), 'audio': self.audio_range(t0, t1)}
+
+    def frame(self, position):
+        record = self.log.records[self.frames_event[position]]
+        return float(record['timestamp']), EVENT_TYPES[record['type']], self.log.strings[record['ref']]
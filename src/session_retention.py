@@ -0,0 +1,125 @@
+import os
+import time
+import shutil
+import logging
+import threading
+
+SESSION_PREFIX = 'session_'
+
+def directory_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            pass  # removed while we were counting
+    return total
+
+def list_sessions(base_dir):
+    # Session directories oldest first; their names start with the time
+    # they were created.
+    if not os.path.isdir(base_dir):
+        return []
+    return [os.path.join(base_dir, name) for name in sorted(os.listdir(base_dir))
+            if name.startswith(SESSION_PREFIX) and os.path.isdir(os.path.join(base_dir, name))]
+
+def last_modified(session_dir):
+    times = [os.path.getmtime(session_dir)]
+    for entry in os.scandir(session_dir):
+        times.append(entry.stat(follow_symlinks=False).st_mtime)
+    return max(times)
+
+class SessionRetention:
+    # Prunes finished sessions under base_output_dir in a background thread:
+    # sessions older than retention_days, then the oldest ones while the
+    # sessions take more than disk_quota_bytes or the disk has less than
+    # min_free_bytes free. Sessions in active() (the one being recorded
+    # and one still being closed) are never touched. Finished sessions do
+    # not change, so each one's size is measured only once.
+    def __init__(self, base_dir, config, active=lambda: (), clock=time.time):
+        self.base_dir = base_dir
+        self.max_age = config.get('retention_days')
+        self.quota_bytes = config.get('disk_quota_bytes')
+        self.min_free_bytes = config.get('min_free_bytes')
+        self.interval = config.get('retention_check_interval', 60)
+        self.active = active
+        self.clock = clock
+        self.pruned = 0
+        self.pruned_bytes = 0
+        self._sizes = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return any(limit is not None for limit in (self.max_age, self.quota_bytes, self.min_free_bytes))
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def stats(self):
+        return {'pruned': self.pruned, 'pruned_bytes': self.pruned_bytes}
+
+    def prune(self):
+        # Returns the sessions removed by this pass.
+        active = {os.path.abspath(path) for path in self.active() if path}
+        candidates = [path for path in list_sessions(self.base_dir) if os.path.abspath(path) not in active]
+        removed = []
+        if self.max_age is not None:
+            oldest_allowed = self.clock() - self.max_age * 86400
+            for path in list(candidates):
+                if last_modified(path) < oldest_allowed:
+                    self._remove(path, 'older than the retention period')
+                    candidates.remove(path)
+                    removed.append(path)
+        if self.quota_bytes is not None:
+            used = sum(self._size(path) for path in candidates)
+            for path in active:
+                if os.path.isdir(path):
+                    used += directory_size(path)
+            while candidates and used > self.quota_bytes:
+                path = candidates.pop(0)
+                used -= self._size(path)
+                self._remove(path, 'over the disk quota')
+                removed.append(path)
+        if self.min_free_bytes is not None:
+            while candidates and shutil.disk_usage(self.base_dir).free < self.min_free_bytes:
+                path = candidates.pop(0)
+                self._remove(path, 'to keep disk space free')
+                removed.append(path)
+        return removed
+
+    def _size(self, path):
+        if path not in self._sizes:
+            self._sizes[path] = directory_size(path)
+        return self._sizes[path]
+
+    def _remove(self, path, reason):
+        size = self._size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        self._sizes.pop(path, None)
+        self.pruned += 1
+        self.pruned_bytes += size
+        logging.info(f"Removed session {path} ({size / 1e6:.1f} MB) {reason}")
+
+    def _run(self):
+        while True:
+            try:
+                self.prune()
+            except Exception as e:
+                logging.error(f"Error pruning sessions: {e}")
+            if self._stop_event.wait(self.interval):
+                return
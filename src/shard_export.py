@@ -0,0 +1,242 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tarfile
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .dataset_loader import SessionDataset
+from .event_log import EVENT_LOG_FILE
+
+MANIFEST_FILE = 'manifest.json'
+SHARD_PATTERN = 'shard-{:06d}.tar'
+IMAGE_FORMATS = ('png', 'jpg', 'webp')
+
+def find_recorded_sessions(root):
+    # Session directories (those with a binary event log) under root, in a
+    # stable order so the same tree always exports the same shards.
+    if os.path.exists(os.path.join(root, EVENT_LOG_FILE)):
+        return [root]
+    sessions = []
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        if EVENT_LOG_FILE in files:
+            sessions.append(directory)
+            subdirs[:] = []
+    return sessions
+
+def sample_key(sample):
+    return f"{sample:09d}"
+
+def unique_samples(dataset, radius=0):
+    # Dataset indices left after dropping samples whose frame is within
+    # radius (Hamming distance of perceptual hashes) of an earlier sample,
+    # across all sessions. Sessions recorded without screenshot_hash get
+    # their hash file written here first.
+    from .frame_hash import session_frame_hashes, deduplicate
+    hashes = [session_frame_hashes(session_dir)[dataset.sample_frame[dataset.sample_session == session]]
+              for session, session_dir in enumerate(dataset.session_dirs)]
+    hashes = np.concatenate(hashes) if hashes else np.zeros(0, np.uint64)
+    return np.flatnonzero(deduplicate(hashes, radius)).tolist()
+
+def plan_shards(dataset, shard_samples, seed=0, shuffle=True, samples=None):
+    # Sample order and shard boundaries depend only on the sessions, the
+    # seed and the shard size, never on the number of writer processes.
+    order = list(range(len(dataset))) if samples is None else list(samples)
+    if shuffle:
+        random.Random(seed).shuffle(order)
+    return [order[start:start + shard_samples] for start in range(0, len(order), shard_samples)]
+
+def _npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+def _image_bytes(frame, frame_format):
+    import cv2
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    ok, encoded = cv2.imencode('.' + frame_format, frame)
+    if not ok:
+        raise ValueError(f"Could not encode frame as {frame_format}")
+    return encoded.tobytes()
+
+def _add_member(tar, name, data):
+    # Fixed metadata so an export is byte-for-byte reproducible.
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+def _sample_members(dataset, index, frame_format):
+    sample = dataset[index]
+    session_id = int(dataset.sample_session[index])
+    session = dataset._session(session_id)
+    events = sample['events']
+    strings = session.index.log.strings
+    used = np.unique(np.concatenate([events['button'], events['key'], events['ref']])) if len(events) else []
+    meta = {'session': session_id, 'timestamp': sample['timestamp'], 'frame': sample['reference'],
+            'event_window': dataset.event_window, 'audio_window': dataset.audio_window,
+            'strings': {str(int(i)): strings[int(i)] for i in used if i}}
+    audio = session.index.meta.get('audio')
+    if audio:
+        meta['samplerate'] = audio['samplerate']
+        meta['channels'] = audio['channels']
+    members = [('json', json.dumps(meta).encode()), (frame_format, _image_bytes(sample['frame'], frame_format)),
+               ('events.npy', _npy_bytes(events))]
+    if sample['audio'] is not None:
+        members.append(('audio.npy', _npy_bytes(sample['audio'])))
+    return members
+
+_worker_dataset = None
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+def _write_shard_in_worker(*args):
+    return write_shard(_worker_dataset, *args)
+
+def write_shard(dataset, output_dir, shard, first_sample, indices, frame_format='png'):
+    # Writes one tar shard sequentially, WebDataset style: the members of a
+    # sample share its key (<key>.json, <key>.png, <key>.events.npy,
+    # <key>.audio.npy). Returns its manifest entry, including the byte
+    # offset of every sample's first header for random access.
+    name = SHARD_PATTERN.format(shard)
+    path = os.path.join(output_dir, name)
+    offsets = []
+    with open(path + '.tmp', 'wb') as f:
+        with tarfile.open(fileobj=f, mode='w', format=tarfile.USTAR_FORMAT) as tar:
+            for position, index in enumerate(indices):
+                offsets.append(tar.offset)
+                key = sample_key(first_sample + position)
+                for extension, data in _sample_members(dataset, index, frame_format):
+                    _add_member(tar, f"{key}.{extension}", data)
+    os.replace(path + '.tmp', path)
+    return {'name': name, 'first_sample': first_sample, 'samples': len(indices),
+            'bytes': os.path.getsize(path), 'offsets': offsets}
+
+def export_shards(session_dirs, output_dir, shard_samples=1000, workers=None, seed=0, shuffle=True,
+                  event_window=1.0, audio_window=1.0, frame_stride=1, frame_format='png', progress=None,
+                  dedup_radius=None):
+    # Packs the samples SessionDataset would serve into tar shards written
+    # by parallel worker processes, one shard per task, then writes
+    # manifest.json. progress(entry) is called as each shard finishes.
+    # With dedup_radius, near-duplicate frames are exported only once.
+    if frame_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown frame format: {frame_format}")
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    dataset = SessionDataset(session_dirs, event_window, audio_window, frame_stride)
+    samples = unique_samples(dataset, dedup_radius) if dedup_radius is not None else None
+    plan = plan_shards(dataset, shard_samples, seed, shuffle, samples)
+    jobs = [(output_dir, shard, shard * shard_samples, indices, frame_format)
+            for shard, indices in enumerate(plan)]
+    entries = [None] * len(jobs)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            entries[job[1]] = write_shard(dataset, *job)
+            if progress:
+                progress(entries[job[1]])
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=_init_worker,
+                                 initargs=(dataset,), mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(_write_shard_in_worker, *job): job[1] for job in jobs}
+            for future in as_completed(futures):
+                entries[futures[future]] = future.result()
+                if progress:
+                    progress(entries[futures[future]])
+    exported = len(dataset) if samples is None else len(samples)
+    manifest = {'format': 'webdataset', 'samples': exported, 'bytes': sum(entry['bytes'] for entry in entries),
+                'shard_samples': shard_samples, 'seed': seed, 'shuffle': shuffle, 'event_window': event_window,
+                'audio_window': audio_window, 'frame_stride': frame_stride, 'frame_format': frame_format,
+                'dedup_radius': dedup_radius, 'duplicates_removed': len(dataset) - exported,
+                'sessions': [os.path.abspath(session_dir) for session_dir in dataset.session_dirs],
+                'shards': entries}
+    with open(os.path.join(output_dir, MANIFEST_FILE + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(output_dir, MANIFEST_FILE + '.tmp'), os.path.join(output_dir, MANIFEST_FILE))
+    elapsed = time.perf_counter() - start
+    logging.info(f"Exported {manifest['samples']} samples in {len(entries)} shards "
+                 f"({manifest['bytes'] / 1e6:.1f} MB) in {elapsed:.1f} s")
+    return manifest
+
+def _decode_member(extension, data):
+    if extension == 'json':
+        return json.loads(data)
+    if extension.endswith('npy'):
+        return np.load(io.BytesIO(data), allow_pickle=False)
+    import cv2
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if image.ndim == 3 else image
+
+def iter_shard(path, offset=0):
+    # Yields the decoded samples of a shard in order, starting at a sample
+    # offset from the manifest: {'key', 'meta', 'frame', 'events', 'audio'}.
+    names = {'json': 'meta', 'events.npy': 'events', 'audio.npy': 'audio'}
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        sample = None
+        with tarfile.open(fileobj=f, mode='r|') as tar:
+            for member in tar:
+                key, _, extension = member.name.partition('.')
+                if sample is not None and key != sample['key']:
+                    yield sample
+                    sample = None
+                if sample is None:
+                    sample = {'key': key, 'meta': None, 'frame': None, 'events': None, 'audio': None}
+                sample[names.get(extension, 'frame')] = _decode_member(extension, tar.extractfile(member).read())
+        if sample is not None:
+            yield sample
+
+def read_sample(output_dir, manifest, sample):
+    # Random access to one exported sample through the manifest offsets.
+    for entry in manifest['shards']:
+        if entry['first_sample'] <= sample < entry['first_sample'] + entry['samples']:
+            offset = entry['offsets'][sample - entry['first_sample']]
+            return next(iter_shard(os.path.join(output_dir, entry['name']), offset))
+    raise IndexError(sample)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export recorded sessions as WebDataset-style tar shards")
+    parser.add_argument('paths', nargs='+', help="session directories or dataset trees to search for sessions")
+    parser.add_argument('--output', required=True, help="directory for the shards and manifest.json")
+    parser.add_argument('--shard-samples', type=int, default=1000, help="samples per shard")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="shards written in parallel")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the sample shuffle")
+    parser.add_argument('--no-shuffle', action='store_true', help="keep samples in session and time order")
+    parser.add_argument('--event-window', type=float, default=1.0, help="seconds of input events per sample")
+    parser.add_argument('--audio-window', type=float, default=1.0, help="seconds of audio per sample")
+    parser.add_argument('--frame-stride', type=int, default=1, help="use every Nth recorded frame")
+    parser.add_argument('--frame-format', choices=IMAGE_FORMATS, default='png', help="image format of the frames")
+    parser.add_argument('--dedup-radius', type=int, default=None,
+                        help="drop frames within this Hamming distance of an earlier frame (0: identical hashes)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level='INFO', format='%(asctime)s - %(levelname)s - %(message)s')
+    sessions = [session for path in args.paths for session in find_recorded_sessions(path)]
+    if not sessions:
+        print("No recorded sessions found", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    manifest = export_shards(sessions, args.output, args.shard_samples, args.workers, args.seed, not args.no_shuffle,
+                             args.event_window, args.audio_window, args.frame_stride, args.frame_format,
+                             progress=lambda entry: print(f"{entry['name']}: {entry['samples']} samples, "
+                                                          f"{entry['bytes'] / 1e6:.1f} MB", flush=True),
+                             dedup_radius=args.dedup_radius)
+    elapsed = time.perf_counter() - start
+    print(f"{manifest['samples']} samples from {len(sessions)} sessions in {len(manifest['shards'])} shards, "
+          f"{manifest['bytes'] / 1e6:.1f} MB in {elapsed:.1f} s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
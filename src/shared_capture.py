@@ -0,0 +1,317 @@
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .frame_sources import create_frame_source
+from .frame_transform import create_frame_transform
+from .scheduler import DeadlineScheduler
+from .encoder import FrameEncoderPool
+from .frame_pool import FramePool
+from .screenshot_storage import ScreenshotStorage
+
+class SharedFrameRing:
+    # Fixed-size frame slots in one shared memory block, used in FIFO order
+    # by one producer process and one consumer process. As in
+    # AudioRingBuffer each side only advances its own counter, so neither
+    # takes a lock, and frames never go through a pipe: only
+    # (slot, shape, dtype) descriptors do.
+    def __init__(self, slots, slot_bytes, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.name = self.shm.name
+        self.written = context.RawValue('Q', 0)
+        self.released = context.RawValue('Q', 0)
+        self.owner = True
+        self.resized = False
+
+    def __getstate__(self):
+        # Only picklable while spawning a process (RawValue); the child
+        # attaches to the same block by name.
+        return {'slots': self.slots, 'slot_bytes': self.slot_bytes, 'name': self.name,
+                'written': self.written, 'released': self.released}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=self.name)
+        self.owner = False
+        self.resized = False
+
+    def in_use(self):
+        return self.written.value - self.released.value
+
+    def next_slot(self, shape, dtype=np.uint8):
+        # View of the next free slot for the producer to grab into, or None
+        # when every slot is busy or the frame would not fit.
+        if self.in_use() >= self.slots or int(np.prod(shape)) * np.dtype(dtype).itemsize > self.slot_bytes:
+            return None
+        return self._view(self.written.value % self.slots, shape, dtype)
+
+    def write(self, frame):
+        # Publishes frame in the next slot and returns its descriptor, or None
+        # when the consumer still holds every slot. A frame grabbed straight
+        # into next_slot() is not copied again.
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame of {frame.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+        if self.in_use() >= self.slots:
+            return None
+        slot = self.written.value % self.slots
+        view = self._view(slot, frame.shape, frame.dtype)
+        if view.ctypes.data != frame.ctypes.data:
+            view[...] = frame
+        self.written.value += 1
+        return slot, frame.shape, frame.dtype.str
+
+    def read(self, descriptor, out=None):
+        # Returns a private copy (into out when given) and frees the slot.
+        # The copy is needed because the change detector keeps previous
+        # frames around.
+        slot, shape, dtype = descriptor
+        view = self._view(slot, shape, np.dtype(dtype))
+        if out is None:
+            frame = np.array(view)
+        else:
+            frame = out
+            np.copyto(frame, view)
+        del view
+        self.released.value += 1
+        return frame
+
+    def resize(self, slot_bytes):
+        # Producer side, once the consumer has released every slot: moves
+        # to a new block of bigger slots and returns its name, which the
+        # consumer must attach() to before reading anything written here.
+        # The counters carry on, so no slot changes meaning.
+        shm = shared_memory.SharedMemory(create=True, size=self.slots * slot_bytes)
+        if not self.owner:
+            self.shm.close()
+        self.shm, self.name, self.slot_bytes = shm, shm.name, slot_bytes
+        return self.name
+
+    def attach(self, name, slot_bytes):
+        # Consumer side of resize(). The consumer is the last user of the
+        # blocks resize() makes, so it unlinks them.
+        self.shm.close()
+        if self.resized:
+            self.shm.unlink()
+        self.shm, self.name, self.slot_bytes = shared_memory.SharedMemory(name=name), name, slot_bytes
+        self.resized = True
+
+    def close(self):
+        self.shm.close()
+        if self.owner or self.resized:
+            self.shm.unlink()
+
+    def _view(self, slot, shape, dtype):
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+def _capture_main(config, frequency, ring, frames, stop_event, activity=None):
+    # Capture process: grabs frames on the deadline grid into ring slots.
+    # When the encoder holds every slot the tick is dropped rather than
+    # delaying the grid.
+    dropped = 0
+    frame_shape = None
+    raw = None
+    source = create_frame_source(config)
+    transform = create_frame_transform(config)
+    scheduler = DeadlineScheduler(frequency, activity=activity)
+    try:
+        source.open()
+        scheduler.start()
+        while not stop_event.is_set():
+            tick = scheduler.wait()
+            if tick is None:
+                break
+            if ring.in_use() >= ring.slots:
+                dropped += 1
+                continue
+            try:
+                # Once the frame size is known the source (or the transform,
+                # when frames are reduced) writes straight into the shared slot.
+                region = transform.region()
+                if transform.reduces:
+                    raw = source.grab(raw, region)
+                    frame = transform.apply(raw, ring.next_slot(transform.output_shape(raw.shape)))
+                else:
+                    frame = source.grab(ring.next_slot(frame_shape) if frame_shape else None, region)
+                frame_shape = frame.shape
+                if frame.nbytes > ring.slot_bytes:
+                    # The screen grew (a resolution change or a new monitor):
+                    # once the encoder has released every slot, the ring
+                    # moves to bigger ones.
+                    while ring.in_use() and not stop_event.is_set():
+                        stop_event.wait(0.005)
+                    if stop_event.is_set():
+                        break
+                    frames.put(('ring', ring.resize(frame.nbytes), frame.nbytes))
+                    frames.put(('warning', f"Frames grew to {frame.shape}, shared memory slots resized to "
+                                           f"{frame.nbytes} bytes"))
+                frames.put(('frame', scheduler.timestamp(tick), ring.write(frame)))
+                del frame
+            except Exception as e:
+                frames.put(('error', f"Screenshot error: {e}"))
+                stop_event.wait(1)  # Prevent rapid error reporting
+    except Exception as e:
+        frames.put(('error', f"Could not open {source.name} screenshot backend: {e}"))
+    finally:
+        source.close()
+        frames.put(('done', {**source.stats(), **scheduler.stats(), 'dropped': dropped}))
+
+def _encoder_main(config, frequency, screenshots_dir, ring, frames, rows, cut, cut_dir):
+    # Encoder process: stores frames exactly as the threaded recorder does,
+    # encoding inline, and sends back only the finished event rows.
+    pool = FramePool(config.get('frame_pool_size', 8))
+    storage = ScreenshotStorage(screenshots_dir, config, FrameEncoderPool(workers=0), frequency, pool)
+    applied_cut = 0.0
+    try:
+        while True:
+            message = frames.get()
+            if message[0] == 'done':
+                rows.put(('stats', message[1]))
+                break
+            if message[0] in ('error', 'warning'):
+                rows.put(message)
+                continue
+            if message[0] == 'ring':
+                ring.attach(message[1], message[2])
+                continue
+            _, timestamp, descriptor = message
+            # Frames go to a session by timestamp, like the recorder's rows.
+            # A frame stamped after a cut is read here after the cut was
+            # published (both under the same lock), so it is never missed.
+            with cut.get_lock():
+                cut_time, next_dir = cut.value, cut_dir.value
+            if cut_time > applied_cut and timestamp >= cut_time:
+                # Frames arrive in capture order, so the first one past the
+                # cut starts the new session's storage (with a keyframe).
+                storage.close()
+                storage = ScreenshotStorage(os.fsdecode(next_dir), config, FrameEncoderPool(workers=0), frequency,
+                                            pool)
+                applied_cut = cut_time
+            try:
+                frame = ring.read(descriptor, pool.acquire(descriptor[1], descriptor[2]))
+                row, job = storage.save(timestamp, frame)
+                if job is not None:
+                    job.result()
+                rows.put(('row', row))
+            except Exception as e:
+                rows.put(('error', f"Error storing screenshot at {timestamp}: {e}"))
+    finally:
+        storage.close()
+        ring.close()
+        rows.put(('done', storage.stats()))
+
+class SharedMemoryCapture:
+    # Drop-in replacement for ScreenshotRecorder that runs capture and
+    # encoding in two spawned processes, so grabbing and converting frames
+    # never holds this process's GIL while the input hooks and audio run.
+    # Frames move between the two processes through a SharedFrameRing;
+    # output_queue only receives 'screenshot_stored' rows.
+    def __init__(self, output_queue, config, frequency, session_dir, activity=None):
+        self.output_queue = output_queue
+        # A shared ActivityRate (see create_activity_rate) is notified here
+        # and followed by the capture process.
+        self.activity = activity
+        self.config = config
+        self.frequency = frequency
+        self.screenshots_dir = os.path.join(session_dir, 'screenshots')
+        self.context = multiprocessing.get_context('spawn')
+        self.ring = None
+        self.processes = []
+        self.frames = self.rows = None
+        self.cut = self.cut_dir = None
+        self.stop_event = None
+        self.forward_thread = None
+        self.capture_stats = {}
+        self.storage_stats = {}
+        self.rows_forwarded = 0
+
+    def start(self):
+        self.ring = SharedFrameRing(self.config.get('shared_memory_slots', 8), self._slot_bytes(), self.context)
+        self.frames = self.context.Queue()
+        self.rows = self.context.Queue()
+        # The latest rollover: cut time and screenshots directory.
+        self.cut = self.context.Value('d', 0.0)
+        self.cut_dir = self.context.Array('c', 4096)
+        self.stop_event = self.context.Event()
+        self.processes = [
+            self.context.Process(target=_capture_main, daemon=True,
+                                 args=(self.config, self.frequency, self.ring, self.frames, self.stop_event,
+                                       self.activity)),
+            self.context.Process(target=_encoder_main, daemon=True,
+                                 args=(self.config, self.frequency, self.screenshots_dir, self.ring, self.frames,
+                                       self.rows, self.cut, self.cut_dir)),
+        ]
+        for process in self.processes:
+            process.start()
+        self.forward_thread = threading.Thread(target=self._forward_rows, daemon=True)
+        self.forward_thread.start()
+        logging.info(f"Shared memory capture started ({self.ring.slots} slots of {self.ring.slot_bytes} bytes)")
+
+    def stop(self):
+        if self.stop_event is None:
+            return
+        self.stop_event.set()
+        self.forward_thread.join(timeout=30)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.ring.close()
+        self.stop_event = None
+        logging.info(f"Shared memory capture stopped: {self.stats()}")
+
+    def stats(self):
+        return {**self.capture_stats, **self.storage_stats, 'rows': self.rows_forwarded}
+
+    def rollover(self, session_dir):
+        # Frames captured from the returned cut time on are stored under
+        # session_dir. The cut is taken while the lock is held, so the
+        # encoder sees it before any frame stamped after it.
+        self.screenshots_dir = os.path.join(session_dir, 'screenshots')
+        with self.cut.get_lock():
+            cut_time = time.time()
+            self.cut_dir.value = os.fsencode(self.screenshots_dir)
+            self.cut.value = cut_time
+        return cut_time
+
+    def _slot_bytes(self):
+        # Sizes the slots from one reduced probe frame of the whole screen,
+        # since the grab size is only known once the backend is open; any
+        # capture region is smaller.
+        source = create_frame_source(self.config)
+        source.open()
+        try:
+            return create_frame_transform(self.config).apply(source.grab()).nbytes
+        finally:
+            source.close()
+
+    def _forward_rows(self):
+        while True:
+            try:
+                message = self.rows.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    logging.error("Shared memory capture processes exited unexpectedly")
+                    return
+                continue
+            if message[0] == 'row':
+                row = message[1]
+                self.output_queue.put(('screenshot_stored', row[0], row))
+                self.rows_forwarded += 1
+            elif message[0] == 'error':
+                logging.error(message[1])
+            elif message[0] == 'warning':
+                logging.warning(message[1])
+            elif message[0] == 'stats':
+                self.capture_stats = message[1]
+            elif message[0] == 'done':
+                self.storage_stats = message[1]
+                return
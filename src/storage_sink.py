@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+import yaml
+
+from .audio_storage import AudioSegmentWriter, AUDIO_DIR, recover_audio
+from .event_log import (EventLogWriter, CsvEventWriter, recover_event_log, recover_csv, EVENT_LOG_FILE,
+                        CSV_FILE)
+from .session_index import build_session_index
+
+class GroupSync:
+    # Group commit for everything a session writes. Writers only flush to
+    # the OS as they go; this thread fsyncs all of them together every
+    # max_loss / 2 seconds, and each writer skips the fsync when nothing
+    # was written since the last round. The fsync rate therefore stays
+    # bounded however high the event rate is, and with writers flushing at
+    # least as often, a crash loses at most about max_loss seconds of data.
+    def __init__(self, max_loss=1.0):
+        self.interval = max_loss / 2
+        self.targets = []
+        self.rounds = 0
+        self.sync_seconds = 0.0
+        self.max_sync_seconds = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def register(self, target):
+        self.targets.append(target)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def sync(self):
+        with self._lock:
+            start = time.perf_counter()
+            for target in self.targets:
+                try:
+                    target.sync()
+                except Exception as e:
+                    logging.error(f"Error syncing {type(target).__name__}: {e}")
+            elapsed = time.perf_counter() - start
+            self.rounds += 1
+            self.sync_seconds += elapsed
+            self.max_sync_seconds = max(self.max_sync_seconds, elapsed)
+
+    def stats(self):
+        return {'sync_rounds': self.rounds, 'sync_interval': self.interval,
+                'sync_ms_mean': 1000 * self.sync_seconds / self.rounds if self.rounds else 0.0,
+                'sync_ms_max': 1000 * self.max_sync_seconds}
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sync()
+
+class StorageSink:
+    # Everything DatasetRecorder writes for a session apart from frames:
+    # the event log (binary or CSV) and the audio segments, made durable
+    # together by one GroupSync. The binary log is written in checksummed
+    # batches and WAV headers are patched at every sync, so a killed
+    # recorder leaves a session recover_session() can repair.
+    def __init__(self, session_dir, config):
+        self.session_dir = session_dir
+        self.max_loss = config.get('storage_max_loss', 1.0)
+        if config.get('event_log_format', 'binary') == 'csv':
+            self.events = CsvEventWriter(session_dir)
+        else:
+            self.events = EventLogWriter(session_dir)
+        self.audio = AudioSegmentWriter(os.path.join(session_dir, AUDIO_DIR), config['audio_samplerate'],
+                                        config['audio_channels'],
+                                        segment_seconds=config.get('audio_segment_seconds', 300),
+                                        audio_format=config.get('audio_format', 'wav'))
+        self.group_sync = GroupSync(self.max_loss)
+        self.group_sync.register(self.events)
+        self.group_sync.register(self.audio)
+
+    @property
+    def binary(self):
+        return isinstance(self.events, EventLogWriter)
+
+    def start(self):
+        self.group_sync.start()
+
+    def append(self, timestamp, event_type, data):
+        self.events.append(timestamp, event_type, data)
+
+    def flush(self):
+        # Called at the end of every writer batch; the next sync round makes
+        # it durable.
+        self.events.flush()
+
+    def stats(self):
+        return self.group_sync.stats()
+
+    def close(self):
+        self.group_sync.stop()
+        self.events.flush()
+        self.group_sync.sync()
+        self.events.close()
+        self.audio.close()
+        logging.info(f"Storage sink stats: {self.stats()}")
+
+def recover_session(session_dir, config):
+    # Turns a session left by a killed recorder back into a readable one:
+    # the event log is cut back to its last intact batch (or events.csv to
+    # its last complete row), audio segments get correct headers, and the
+    # session index is rebuilt. Returns what was kept and dropped.
+    report = {'session': session_dir}
+    if os.path.exists(os.path.join(session_dir, EVENT_LOG_FILE)):
+        report['events'], report['dropped_events'] = recover_event_log(session_dir)
+    elif os.path.exists(os.path.join(session_dir, CSV_FILE)):
+        report['csv_truncated'] = recover_csv(session_dir)
+    audio_dir = os.path.join(session_dir, AUDIO_DIR)
+    if os.path.isdir(audio_dir):
+        report['audio_samples'] = recover_audio(audio_dir)
+    if 'events' in report:
+        audio = {'dir': AUDIO_DIR, 'samplerate': config['audio_samplerate'],
+                 'channels': config['audio_channels']}
+        build_session_index(session_dir, audio if os.path.isdir(audio_dir) else None)
+        report['index'] = True
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Repair sessions left behind by a recorder that was killed")
+    parser.add_argument('sessions', nargs='+', help="session directories")
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                         'config.yaml'),
+                        help="recorder settings, defaults to the repository config.yaml")
+    args = parser.parse_args(argv)
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    failed = 0
+    for session_dir in args.sessions:
+        try:
+            print(json.dumps(recover_session(session_dir, config)))
+        except Exception as e:
+            print(f"Could not recover {session_dir}: {e}", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
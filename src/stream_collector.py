@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import socket
+import struct
+import logging
+import argparse
+import threading
+
+import yaml
+
+from .audio_storage import AUDIO_DIR, sync_path
+from .session_index import build_session_index
+from .storage_sink import StorageSink
+from .stream_sink import (HELLO, OPEN, EVENTS, AUDIO, FILE, CLOSE, ACK, ACK_OK, ACK_REJECTED, FILE_HEADER,
+                          RejectedBatch, parse_address, read_batch, decode_audio)
+
+class _CollectedSession:
+    def __init__(self, session_dir, sink, meta):
+        self.session_dir = session_dir
+        self.sink = sink
+        self.meta = meta
+        self.closed = False
+        # Directories with entries added since the last sync.
+        self.directories = set()
+
+class StreamCollector:
+    # Receives the streams of any number of recorders (see StreamSink) and
+    # writes each of their sessions as a standard session directory under
+    # output_dir/<source>/<session name>, through the same StorageSink and
+    # index build the recorder uses. Every connection has its own thread;
+    # batches are applied in order per client and acked once written, and
+    # batches a client resends after a reconnect are acked but skipped. The
+    # ack means the batch is on disk: recorders delete their local frames
+    # when it arrives, so each batch's files, events, audio and new
+    # directory entries are synced before it is acked. A
+    # batch that cannot be read is acked as rejected, so its client drops
+    # it instead of resending it forever.
+    def __init__(self, output_dir, config, address):
+        self.output_dir = output_dir
+        self.config = config
+        self.address = address
+        self.sessions = {}
+        self.sessions_closed = 0
+        self.batches = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self._applied = {}
+        self._client_locks = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._connections = set()
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)  # left behind by an earlier collector
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen(64)
+        if family == socket.AF_INET:
+            # With port 0 the system picks one; report the real address.
+            host, port = self._listener.getsockname()[:2]
+            self.address = f"tcp://{host}:{port}"
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        logging.info(f"Collector listening on {self.address}, writing to {self.output_dir}")
+        return self
+
+    def stop(self):
+        # Sessions whose recorder never closed them are closed as they are.
+        self._stopping = True
+        if self._listener:
+            try:
+                self._listener.shutdown(socket.SHUT_RDWR)  # wakes the blocked accept()
+            except OSError:
+                pass
+            self._listener.close()
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        for key in list(self.sessions):
+            self._close(key)
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        logging.info(f"Collector stats: {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            return {'connections': len(self._connections), 'clients': len(self._applied),
+                    'sessions_open': len(self.sessions), 'sessions_closed': self.sessions_closed,
+                    'batches': self.batches, 'duplicate_batches': self.duplicates,
+                    'rejected_batches': self.rejected}
+
+    def _accept(self):
+        while not self._stopping:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._connections.add(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        client = None
+        try:
+            _, messages = read_batch(connection)
+            kind, _, body = messages[0]
+            if kind != HELLO:
+                raise ValueError("stream did not start with a hello")
+            hello = json.loads(body)
+            client, source = hello['client'], hello['source']
+            with self._lock:
+                client_lock = self._client_locks.setdefault(client, threading.Lock())
+            with client_lock:
+                # Sessions a restarted collector does not know yet.
+                for name, meta in hello['sessions'].items():
+                    if (source, name) not in self.sessions:
+                        self._open(source, name, meta)
+                connection.sendall(ACK.pack(self._applied.get(client, 0), ACK_OK))
+            while not self._stopping:
+                status = ACK_OK
+                try:
+                    seq, messages = read_batch(connection)
+                except RejectedBatch as e:
+                    logging.error(f"Rejecting batch {e.seq} of recorder {client}: {e}")
+                    seq, messages, status = e.seq, [], ACK_REJECTED
+                with client_lock:
+                    if seq <= self._applied.get(client, 0):
+                        self.duplicates += 1
+                        status = ACK_OK
+                    else:
+                        touched = []
+                        for kind, name, body in messages:
+                            try:
+                                session = self._apply(source, kind, name, body)
+                            except (ValueError, KeyError, TypeError, struct.error) as e:
+                                # Malformed content; I/O errors still drop
+                                # the connection so the batch comes again.
+                                logging.error(f"Skipping a message for {source}/{name}: {e}")
+                                continue
+                            if session is not None and session not in touched:
+                                touched.append(session)
+                        for session in touched:
+                            self._sync(session)
+                        with self._lock:
+                            self._applied[client] = seq
+                            self.batches += 1
+                            if status == ACK_REJECTED:
+                                self.rejected += 1
+                    connection.sendall(ACK.pack(self._applied.get(client, 0), status))
+        except (ConnectionError, OSError):
+            pass  # the recorder reconnects and resends what was not acked
+        except Exception as e:
+            logging.error(f"Error receiving from recorder {client}: {e}")
+        finally:
+            with self._lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def _apply(self, source, kind, name, body):
+        # Returns the session the message wrote to, for _sync.
+        key = (source, name)
+        if kind == OPEN:
+            self._open(source, name, json.loads(body))
+            return self.sessions.get(key)
+        session = self.sessions.get(key)
+        if session is None:
+            logging.error(f"Data for unknown session {source}/{name}")
+            return None
+        if kind == EVENTS:
+            for timestamp, event_type, data in json.loads(body):
+                session.sink.append(timestamp, event_type, data)
+            session.sink.flush()
+        elif kind == AUDIO:
+            block, start_time = decode_audio(body)
+            session.sink.audio.write(block, start_time)
+        elif kind == FILE:
+            offset, last, size = FILE_HEADER.unpack_from(body)
+            path = body[FILE_HEADER.size:FILE_HEADER.size + size].decode()
+            self._write_file(session, path, offset, last, memoryview(body)[FILE_HEADER.size + size:])
+        elif kind == CLOSE:
+            self._close(key)
+        return session
+
+    def _open(self, source, name, meta):
+        if (source, name) in self.sessions:
+            return
+        base = os.path.join(self.output_dir, os.path.basename(source), os.path.basename(name))
+        # A session reopened after a collector restart continues in a new
+        # directory instead of overwriting what was already written.
+        session_dir, suffix = base, 1
+        while os.path.exists(session_dir):
+            session_dir = f"{base}_{suffix}"
+            suffix += 1
+        os.makedirs(session_dir)
+        sink = StorageSink(session_dir, {**self.config, 'audio_samplerate': meta['audio_samplerate'],
+                                         'audio_channels': meta['audio_channels']})
+        sink.start()
+        session = _CollectedSession(session_dir, sink, meta)
+        session.directories.update((self.output_dir, os.path.dirname(session_dir), session_dir,
+                                    os.path.join(session_dir, AUDIO_DIR)))
+        with self._lock:
+            self.sessions[(source, name)] = session
+        logging.info(f"Receiving {source}/{name} into {session_dir}")
+
+    def _write_file(self, session, path, offset, last, data):
+        # Chunks arrive in order; the file takes its name with the last one.
+        parts = path.split('/')
+        if path.startswith('/') or '..' in parts:
+            logging.error(f"Refusing to write {path} outside {session.session_dir}")
+            return
+        full_path = os.path.join(session.session_dir, *parts)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if offset and not os.path.exists(full_path + '.part'):
+            # Its first chunks went to a collector that has since restarted.
+            raise ValueError(f"chunk at {offset} of {path} without the start of the file")
+        with open(full_path + '.part', 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if last:
+            os.replace(full_path + '.part', full_path)
+        session.directories.add(os.path.dirname(full_path))
+
+    def _sync(self, session):
+        # Everything applied for the session so far, before the ack. A
+        # closed session's sink synced itself when it closed.
+        if not session.closed:
+            session.sink.flush()
+            session.sink.group_sync.sync()
+        for directory in sorted(session.directories):
+            sync_path(directory)
+        session.directories.clear()
+
+    def _close(self, key):
+        with self._lock:
+            session = self.sessions.pop(key, None)
+        if session is None:
+            return
+        session.closed = True
+        session.sink.close()
+        if session.sink.binary and self.config.get('session_index', True):
+            audio = {'dir': AUDIO_DIR, 'samplerate': session.meta['audio_samplerate'],
+                     'channels': session.meta['audio_channels']}
+            try:
+                build_session_index(session.session_dir, audio)
+            except Exception as e:
+                logging.error(f"Error building session index of {session.session_dir}: {e}")
+        with self._lock:
+            self.sessions_closed += 1
+        logging.info(f"Session {session.session_dir} complete")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collect sessions streamed by recorders into session directories")
+    parser.add_argument('--listen', default='tcp://127.0.0.1:7070',
+                        help="tcp://host:port or unix:///path/to/socket")
+    parser.add_argument('--output', required=True, help="directory for the collected sessions")
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                         'config.yaml'),
+                        help="storage settings, defaults to the repository config.yaml")
+    args = parser.parse_args(argv)
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    logging.basicConfig(level=config.get('log_level', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+    collector = StreamCollector(args.output, config, args.listen).start()
+    print(f"Collecting on {collector.address}, press Ctrl+C to stop", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,578 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import socket
+import struct
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from .event_log import SCREENSHOT_EVENTS
+
+# Wire format. Every batch is a header (magic, flags, sequence number,
+# payload size) followed by its payload, optionally zlib compressed. The
+# payload is a run of messages: kind, session name size, body size, then
+# the name and body. The collector answers every batch with the highest
+# sequence number it has applied for the client, and whether that batch
+# was rejected as unreadable. Files go in chunks: offset, whether it is the
+# last chunk, path size, then the path and the data.
+BATCH_MAGIC = b'AIRS'
+BATCH_HEADER = struct.Struct('<4sBQI')
+MESSAGE_HEADER = struct.Struct('<BHI')
+ACK = struct.Struct('<QB')
+AUDIO_HEADER = struct.Struct('<dII')
+FILE_HEADER = struct.Struct('<QBH')
+FLAG_ZLIB = 1
+MAX_BATCH_BYTES = 1 << 30
+MAX_MESSAGE_BYTES = 64 << 20
+ACK_OK, ACK_REJECTED = 0, 1
+SPOOL_STATE = 'client.json'
+
+# Message kinds.
+HELLO, OPEN, EVENTS, AUDIO, FILE, CLOSE = range(6)
+
+class RejectedBatch(ValueError):
+    # A batch read off the stream that cannot be applied. The stream itself
+    # is still in step, so the collector acks it as rejected and goes on.
+    def __init__(self, seq, reason):
+        super().__init__(reason)
+        self.seq = seq
+
+def parse_address(address):
+    # "tcp://host:port", "host:port" or "unix:///path/to/socket".
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('tcp://'):
+        address = address[len('tcp://'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+def encode_message(kind, name, body):
+    name = name.encode()
+    return MESSAGE_HEADER.pack(kind, len(name), len(body)) + name + body
+
+def decode_messages(payload):
+    offset = 0
+    while offset < len(payload):
+        kind, name_size, body_size = MESSAGE_HEADER.unpack_from(payload, offset)
+        offset += MESSAGE_HEADER.size
+        name = payload[offset:offset + name_size].decode()
+        offset += name_size
+        yield kind, name, payload[offset:offset + body_size]
+        offset += body_size
+
+def encode_batch(seq, messages, compression='zlib', level=1):
+    payload = b''.join(messages)
+    flags = 0
+    if compression == 'zlib':
+        payload = zlib.compress(payload, level)
+        flags |= FLAG_ZLIB
+    return BATCH_HEADER.pack(BATCH_MAGIC, flags, seq, len(payload)) + payload
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+def read_batch(sock):
+    # (seq, messages) of the next batch on the socket.
+    magic, flags, seq, size = BATCH_HEADER.unpack(recv_exact(sock, BATCH_HEADER.size))
+    if magic != BATCH_MAGIC:
+        raise ValueError("not a recorder stream")
+    if size > MAX_BATCH_BYTES:
+        # Skipped in pieces, never held in memory.
+        remaining = size
+        while remaining:
+            remaining -= len(recv_exact(sock, min(remaining, 1 << 20)))
+        raise RejectedBatch(seq, f"batch of {size} bytes is over the {MAX_BATCH_BYTES} byte limit")
+    payload = recv_exact(sock, size)
+    try:
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return seq, list(decode_messages(payload))
+    except (zlib.error, struct.error, UnicodeDecodeError) as e:
+        raise RejectedBatch(seq, f"unreadable batch: {e}")
+
+def encode_audio(block, start_time):
+    block = np.ascontiguousarray(block, dtype='<i2')
+    channels = block.shape[1] if block.ndim == 2 else 1
+    return AUDIO_HEADER.pack(start_time, len(block), channels) + block.tobytes()
+
+def decode_audio(body):
+    start_time, frames, channels = AUDIO_HEADER.unpack_from(body)
+    return np.frombuffer(body, dtype='<i2', offset=AUDIO_HEADER.size).reshape(frames, channels), start_time
+
+class _Batch:
+    # A sealed batch waiting for its ack: in memory, or in a spool file
+    # once the memory budget is used up. files are local files sent in it,
+    # removed once it is acked.
+    def __init__(self, seq, data=None, path=None, size=0, files=()):
+        self.seq = seq
+        self.data = data
+        self.path = path
+        self.size = size
+        self.files = files
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+class StreamClient:
+    # Ships a recorder's sessions to a collector over one TCP or Unix socket.
+    # Messages are gathered into batches of about stream_batch_bytes (or
+    # whatever arrived within stream_batch_interval), compressed and sent
+    # by a background thread. Batches stay queued until the collector acks
+    # them, so after a reconnect the unacked ones are sent again and the
+    # collector skips any it already applied. The queue holds
+    # stream_buffer_bytes in memory, then spills to stream_spool_dir up to
+    # stream_spool_bytes; beyond that send() blocks, which holds back the
+    # writer thread and lets the stream buffers apply their own policy.
+    # With a spool, the client id, last sequence number and open sessions
+    # are kept there too: batches still unacked when close() gives up, or
+    # when the process dies, are sent by the next start() with the same
+    # spool, which then closes the sessions left open. One spool per client.
+    def __init__(self, config, spool_dir=None):
+        self.address = config['stream_address']
+        self.source = config.get('stream_source') or socket.gethostname()
+        self.client_id = uuid.uuid4().hex
+        self.compression = config.get('stream_compression', 'zlib')
+        if self.compression not in ('zlib', 'none'):
+            raise ValueError(f"Unknown stream compression: {self.compression}")
+        self.level = config.get('stream_compression_level', 1)
+        # Half the collector's limit leaves room for the message that fills
+        # a batch past batch_bytes.
+        self.batch_bytes = min(config.get('stream_batch_bytes', 256 * 1024), MAX_BATCH_BYTES // 2)
+        self.batch_interval = config.get('stream_batch_interval', 0.2)
+        self.buffer_bytes = config.get('stream_buffer_bytes', 64 * 1024 * 1024)
+        self.spool_bytes = config.get('stream_spool_bytes', 1024 * 1024 * 1024)
+        self.spool_dir = config.get('stream_spool_dir') or spool_dir
+        self.reconnect_max = config.get('stream_reconnect_max', 10.0)
+        self.close_timeout = config.get('stream_close_timeout', 30)
+        self.sessions = {}
+        self._messages = []
+        self._message_bytes = 0
+        self._files = []
+        self._recovered = {}
+        self._recovered_seq = 0
+        self._opened_at = None
+        self._queue = deque()
+        self._memory_bytes = 0
+        self._spooled_bytes = 0
+        self._seq = 0
+        self._sent_seq = 0
+        self._sock = None
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._was_connected = False
+        self.connected = False
+        self.batches_sent = 0
+        self.bytes_sent = 0
+        self.raw_bytes = 0
+        self.reconnects = 0
+        self.batches_spooled = 0
+        self.batches_rejected = 0
+        self.blocked_seconds = 0.0
+
+    def start(self):
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._recover()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def open_session(self, name, meta):
+        with self._cond:
+            self.sessions[name] = meta
+            self._add(encode_message(OPEN, name, json.dumps(meta).encode()))
+
+    def close_session(self, name):
+        with self._cond:
+            self.sessions.pop(name, None)
+            self._add(encode_message(CLOSE, name, b''))
+            self._seal()
+
+    def send(self, kind, name, body, remove=None):
+        # remove: a local file to delete once this message is acked.
+        with self._cond:
+            if remove:
+                self._files.append(remove)
+            self._add(encode_message(kind, name, body))
+
+    def flush(self):
+        with self._cond:
+            self._seal()
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue) + bool(self._messages)
+
+    def stats(self):
+        with self._cond:
+            return {'connected': self.connected, 'batches_sent': self.batches_sent, 'bytes_sent': self.bytes_sent,
+                    'raw_bytes': self.raw_bytes, 'reconnects': self.reconnects,
+                    'batches_spooled': self.batches_spooled, 'batches_rejected': self.batches_rejected,
+                    'queued_batches': len(self._queue),
+                    'queued_bytes': self._memory_bytes + self._spooled_bytes,
+                    'blocked_seconds': self.blocked_seconds}
+
+    def close(self, timeout=None):
+        # Waits up to timeout for the collector to ack everything queued.
+        timeout = self.close_timeout if timeout is None else timeout
+        with self._cond:
+            self._seal()
+            deadline = time.time() + timeout
+            while self._queue and time.time() < deadline:
+                self._cond.wait(min(0.1, max(deadline - time.time(), 0)))
+            if self._queue and self.spool_dir:
+                # Kept for the next start with this spool. The spool limit
+                # applies while recording; nothing is dropped here.
+                for batch in self._queue:
+                    if batch.data is not None:
+                        batch.path = self._spool(batch.seq, batch.data)
+                        batch.data = None
+                        self._memory_bytes -= batch.size
+                        self._spooled_bytes += batch.size
+                logging.warning(f"Stream closed with {len(self._queue)} batches not acknowledged by "
+                                f"{self.address}, left in {self.spool_dir} for the next start")
+            elif self._queue:
+                logging.warning(f"Stream closed with {len(self._queue)} batches not acknowledged by "
+                                f"{self.address}")
+            self._stopping = True
+            self._cond.notify_all()
+        self._disconnect()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        logging.info(f"Stream client stats: {self.stats()}")
+
+    def _add(self, message):
+        if len(message) > MAX_MESSAGE_BYTES:
+            raise ValueError(f"Stream message of {len(message)} bytes is over the {MAX_MESSAGE_BYTES} byte limit")
+        if not self._messages:
+            self._opened_at = time.time()
+        self._messages.append(message)
+        self._message_bytes += len(message)
+        if self._message_bytes >= self.batch_bytes:
+            self._seal()
+
+    def _seal(self, block=True):
+        # Called with the lock held. Only producers block on a full queue;
+        # the sender thread, which is what empties it, never does.
+        if not self._messages:
+            return
+        self._seq += 1
+        self._save_state()
+        data = encode_batch(self._seq, self._messages, self.compression, self.level)
+        self.raw_bytes += self._message_bytes
+        files = self._files
+        self._messages, self._message_bytes, self._files = [], 0, []
+        start = time.perf_counter()
+        while block and not self._stopping and self._memory_bytes + len(data) > self.buffer_bytes and \
+                (not self.spool_dir or self._spooled_bytes + len(data) > self.spool_bytes):
+            self._cond.wait(0.1)
+        self.blocked_seconds += time.perf_counter() - start
+        if self._memory_bytes + len(data) > self.buffer_bytes and self.spool_dir and \
+                self._spooled_bytes + len(data) <= self.spool_bytes:
+            path = self._spool(self._seq, data)
+            self._queue.append(_Batch(self._seq, path=path, size=len(data), files=files))
+            self._spooled_bytes += len(data)
+            self.batches_spooled += 1
+        else:
+            self._queue.append(_Batch(self._seq, data=data, size=len(data), files=files))
+            self._memory_bytes += len(data)
+        self._cond.notify_all()
+
+    def _spool(self, seq, data):
+        path = os.path.join(self.spool_dir, f"{self.client_id}-{seq:012d}.batch")
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _save_state(self):
+        # Written before a sequence number can reach the collector, so a
+        # restarted client never reuses one the collector has applied.
+        if not self.spool_dir:
+            return
+        path = os.path.join(self.spool_dir, SPOOL_STATE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'client': self.client_id, 'seq': self._seq, 'sessions': self.sessions}, f)
+        os.replace(path + '.tmp', path)
+
+    def _recover(self):
+        # Queues the batches a previous client left in the spool, under its
+        # id and sequence numbers, then closes the sessions it left open.
+        # Local files of those batches are not removed after replay.
+        path = os.path.join(self.spool_dir, SPOOL_STATE)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            state = json.load(f)
+        with self._cond:
+            self.client_id, self._seq = state['client'], state['seq']
+            prefix = f"{self.client_id}-"
+            for name in sorted(os.listdir(self.spool_dir)):
+                if name.startswith(prefix) and name.endswith('.batch'):
+                    batch_path = os.path.join(self.spool_dir, name)
+                    size = os.path.getsize(batch_path)
+                    self._queue.append(_Batch(int(name[len(prefix):-len('.batch')]), path=batch_path, size=size))
+                    self._spooled_bytes += size
+            # Sent in the hello until the closes are acked, so a restarted
+            # collector can take the replayed batches as well.
+            self._recovered = dict(state['sessions'])
+            for name in self._recovered:
+                self._add(encode_message(CLOSE, name, b''))
+            self._seal()
+            self._recovered_seq = self._seq
+        if self._queue:
+            logging.info(f"Replaying {len(self._queue)} spooled batches to {self.address}, closing "
+                         f"{len(self._recovered)} sessions left open")
+
+    def _acknowledge(self, seq):
+        with self._cond:
+            while self._queue and self._queue[0].seq <= seq:
+                batch = self._queue.popleft()
+                if batch.path:
+                    self._spooled_bytes -= batch.size
+                    try:
+                        os.remove(batch.path)
+                    except OSError as e:
+                        logging.error(f"Could not remove spooled batch {batch.path}: {e}")
+                else:
+                    self._memory_bytes -= batch.size
+                for path in batch.files:
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        logging.error(f"Could not remove sent file {path}: {e}")
+            if self._recovered and seq >= self._recovered_seq:
+                self._recovered = {}
+            self._cond.notify_all()
+
+    def _connect(self):
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(10)
+            sock.connect(address)
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._cond:
+                hello = {'client': self.client_id, 'source': self.source,
+                         'sessions': {**self._recovered, **self.sessions}}
+            sock.sendall(encode_batch(0, [encode_message(HELLO, '', json.dumps(hello).encode())], 'none'))
+            acked, _ = ACK.unpack(recv_exact(sock, ACK.size))
+            sock.settimeout(None)
+        except Exception:
+            sock.close()
+            raise
+        self._acknowledge(acked)
+        with self._cond:
+            self._sock = sock
+            self._sent_seq = acked
+            self.connected = True
+        threading.Thread(target=self._read_acks, args=(sock,), daemon=True).start()
+
+    def _disconnect(self, sock=None):
+        with self._cond:
+            sock = sock or self._sock
+            if sock is None or sock is not self._sock:
+                return
+            self._sock = None
+            self.connected = False
+            self._cond.notify_all()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def _read_acks(self, sock):
+        try:
+            while True:
+                seq, status = ACK.unpack(recv_exact(sock, ACK.size))
+                if status == ACK_REJECTED:
+                    # Resending it would only be rejected again.
+                    logging.error(f"Collector {self.address} rejected batch {seq}, dropping it")
+                    with self._cond:
+                        self.batches_rejected += 1
+                self._acknowledge(seq)
+        except Exception:
+            self._disconnect(sock)
+
+    def _next_batch(self):
+        # The oldest batch not yet sent on this connection, sealing the
+        # open one once it is batch_interval old.
+        with self._cond:
+            while not self._stopping and self._sock is not None:
+                if self._messages and time.time() - self._opened_at >= self.batch_interval:
+                    self._seal(block=False)
+                if self._queue and self._queue[-1].seq > self._sent_seq:
+                    # Sequence numbers in the queue increase by at least one
+                    # per batch (a replayed spool may have gaps), so this
+                    # position is at or after the one wanted.
+                    position = min(max(self._sent_seq - self._queue[0].seq + 1, 0), len(self._queue) - 1)
+                    while position and self._queue[position - 1].seq > self._sent_seq:
+                        position -= 1
+                    return self._sock, self._queue[position]
+                self._cond.wait(self.batch_interval / 2)
+            return None, None
+
+    def _run(self):
+        delay = 0.1
+        while not self._stopping:
+            if self._sock is None:
+                try:
+                    self._connect()
+                    if self._was_connected:
+                        self.reconnects += 1
+                        logging.info(f"Reconnected to collector {self.address}")
+                    self._was_connected = True
+                    delay = 0.1
+                except Exception as e:
+                    if delay == 0.1:
+                        logging.warning(f"Could not connect to collector {self.address}: {e}")
+                    with self._cond:
+                        self._cond.wait(delay)
+                    delay = min(delay * 2, self.reconnect_max)
+                    continue
+            sock, batch = self._next_batch()
+            if batch is None:
+                continue
+            try:
+                data = batch.read()
+                sock.sendall(data)
+            except Exception as e:
+                logging.warning(f"Lost connection to collector {self.address}: {e}")
+                self._disconnect(sock)
+                delay = 0.2
+                continue
+            with self._cond:
+                self._sent_seq = max(self._sent_seq, batch.seq)
+                self.batches_sent += 1
+                self.bytes_sent += len(data)
+
+class _StreamEventWriter:
+    # Gathers event rows between flushes and sends them as one message.
+    def __init__(self, sink):
+        self.sink = sink
+        self.rows = []
+        self.records_written = 0
+
+    def append(self, timestamp, event_type, data):
+        self.rows.append([timestamp, event_type, list(data) if isinstance(data, tuple) else data])
+        self.records_written += 1
+
+    def flush(self):
+        if self.rows:
+            self.sink.client.send(EVENTS, self.sink.name, json.dumps(self.rows).encode())
+            self.rows = []
+
+    def close(self):
+        self.flush()
+
+class _StreamAudioWriter:
+    # Stands in for AudioSegmentWriter: each block is sent with the time of
+    # its first sample.
+    def __init__(self, sink, samplerate, channels):
+        self.sink = sink
+        self.samplerate = samplerate
+        self.channels = channels
+        self.start_time = None
+        self.frames_written = 0
+
+    def write(self, block, first_sample_time=None):
+        if self.start_time is None:
+            self.start_time = first_sample_time if first_sample_time is not None else time.time()
+        start_time = self.start_time + self.frames_written / self.samplerate
+        self.sink.client.send(AUDIO, self.sink.name, encode_audio(block, start_time))
+        self.frames_written += len(block)
+
+    def close(self):
+        pass
+
+class StreamSink:
+    # Drop-in for StorageSink that sends a session to a collector instead of
+    # writing it. Frames are still encoded into the local session directory
+    # by ScreenshotStorage; each one is sent when its row is committed and
+    # removed once the collector acks it, unless stream_keep_local is set. Files written on
+    # the side, such as thumbnails, frame hashes and video segments, are
+    # sent when the session closes.
+    def __init__(self, session_dir, config, client):
+        self.session_dir = session_dir
+        self.client = client
+        self.name = os.path.basename(os.path.normpath(session_dir))
+        self.max_loss = config.get('storage_max_loss', 1.0)
+        self.keep_local = config.get('stream_keep_local', False)
+        self.chunk_bytes = min(config.get('stream_file_chunk_bytes', 4 * 1024 * 1024), MAX_MESSAGE_BYTES // 2)
+        self.files_sent = 0
+        self._sent = set()
+        self.events = _StreamEventWriter(self)
+        self.audio = _StreamAudioWriter(self, config['audio_samplerate'], config['audio_channels'])
+        client.open_session(self.name, {'audio_samplerate': config['audio_samplerate'],
+                                        'audio_channels': config['audio_channels'], 'started': time.time()})
+
+    @property
+    def binary(self):
+        # Nothing is written locally; the collector builds the index.
+        return False
+
+    def start(self):
+        pass
+
+    def append(self, timestamp, event_type, data):
+        # The frame goes out before its row, so the collector never has a
+        # row whose file is missing.
+        if event_type in SCREENSHOT_EVENTS and event_type != 'screenshot_repeat' and '#' not in str(data):
+            self._send_file(os.path.join('screenshots', str(data)))
+        self.events.append(timestamp, event_type, data)
+
+    def flush(self):
+        self.events.flush()
+
+    def stats(self):
+        return self.client.stats()
+
+    def close(self):
+        self.events.close()
+        for directory, _, files in os.walk(self.session_dir):
+            for name in sorted(files):
+                path = os.path.relpath(os.path.join(directory, name), self.session_dir)
+                if path != 'metrics.json' and path not in self._sent:
+                    self._send_file(path)
+        self.client.close_session(self.name)
+        logging.info(f"Stream sink sent {self.events.records_written} events, {self.audio.frames_written} "
+                     f"audio frames and {self.files_sent} files of {self.name}")
+
+    def _send_file(self, path):
+        # In chunks, so a video segment of any size is never read whole; the
+        # local file goes once the batch with its last chunk is acked.
+        full_path = os.path.join(self.session_dir, path)
+        name = path.replace(os.sep, '/').encode()
+        offset = 0
+        try:
+            with open(full_path, 'rb') as f:
+                while True:
+                    data = f.read(self.chunk_bytes)
+                    last = len(data) < self.chunk_bytes
+                    self.client.send(FILE, self.name, FILE_HEADER.pack(offset, last, len(name)) + name + data,
+                                     remove=full_path if last and not self.keep_local else None)
+                    offset += len(data)
+                    if last:
+                        break
+        except OSError as e:
+            logging.error(f"Could not send {full_path}: {e}")
+            return
+        self.files_sent += 1
+        self._sent.add(path)
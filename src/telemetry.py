@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import logging
+import resource
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Upper bounds in seconds, from sub-millisecond event handling up to the
+# writer's batch interval.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+def resident_memory_bytes():
+    # Current RSS from /proc on Linux, peak RSS elsewhere.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Counter:
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self, name):
+        with self._lock:
+            return [(name, dict(key), value) for key, value in self.values.items()]
+
+class Histogram:
+    # Fixed-bucket latency histogram. observe() is a bisect and three
+    # additions under a lock, cheap enough to call for every event.
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self, name):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self.series.items():
+                labels = dict(key)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    samples.append((f'{name}_bucket', {**labels, 'le': str(bound)}, cumulative))
+                samples.append((f'{name}_sum', labels, total))
+                samples.append((f'{name}_count', labels, count))
+        return samples
+
+class MetricsRegistry:
+    # Counters and histograms are updated inline by the pipeline; everything
+    # that a component already tracks in its stats() is read by collectors
+    # only when metrics are rendered, so it costs nothing between scrapes.
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._add(name, 'counter', help_text, Counter)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(name, 'histogram', help_text, lambda: Histogram(buckets))
+
+    def register(self, collector):
+        # collector() returns (name, type, help, labels, value) tuples.
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self):
+        # Returns {name: (type, help, [(sample_name, labels, value), ...])}.
+        families = {}
+        with self._lock:
+            metrics = list(self._metrics.items())
+            collectors = list(self._collectors)
+        for name, (kind, help_text, metric) in metrics:
+            families[name] = (kind, help_text, metric.samples(name))
+        for collector in collectors:
+            try:
+                for name, kind, help_text, labels, value in collector():
+                    if value is None:
+                        continue
+                    families.setdefault(name, (kind, help_text, []))[2].append((name, labels or {}, value))
+            except Exception as e:
+                logging.error(f"Metrics collector failed: {e}")
+        return families
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in sorted(self.collect().items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_label_text(labels)} {float(value)!r}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        snapshot = {}
+        for name, (kind, _, samples) in self.collect().items():
+            snapshot[name] = [{'name': sample_name, 'labels': labels, 'value': value}
+                              for sample_name, labels, value in samples]
+        return snapshot
+
+    def _add(self, name, kind, help_text, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (kind, help_text, factory())
+            return self._metrics[name][2]
+
+class MetricsServer:
+    # Serves registry.render() on GET /metrics in the Prometheus text format
+    # from a daemon thread. Port 0 picks a free port (see self.port).
+    def __init__(self, registry, host='127.0.0.1', port=9464):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class MetricsFileWriter:
+    # Rewrites a JSON snapshot of the registry every interval seconds, via a
+    # temporary file so readers never see a partial write.
+    def __init__(self, registry, path, interval=10):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.write()
+
+    def write(self):
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'time': time.time(), 'metrics': self.registry.snapshot()}, f, default=float)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error writing metrics file: {e}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
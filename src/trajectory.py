@@ -0,0 +1,69 @@
+import math
+
+def synchronized_distance(point, start, end):
+    # Distance between point and where the straight, constant-speed motion
+    # from start to end would have been at point's timestamp. Unlike the
+    # perpendicular distance this also catches pauses and speed changes
+    # along a straight line.
+    duration = end[0] - start[0]
+    ratio = (point[0] - start[0]) / duration if duration > 0 else 0.5
+    x = start[1] + ratio * (end[1] - start[1])
+    y = start[2] + ratio * (end[2] - start[2])
+    return math.hypot(point[1] - x, point[2] - y)
+
+class TrajectorySimplifier:
+    # Streaming, error-bounded simplification of (timestamp, x, y) mouse
+    # points. Points are held back while every held point stays within
+    # `tolerance` pixels of the motion from the last kept point to the
+    # newest one; when that stops being true the last point that still
+    # satisfied it is kept. Nothing is held longer than max_delay seconds or
+    # max_window points, and flush() releases the held endpoint at once
+    # (before a click or scroll).
+    def __init__(self, tolerance=2.0, max_delay=0.1, max_window=64):
+        self.tolerance = tolerance
+        self.max_delay = max_delay
+        self.max_window = max_window
+        self.anchor = None
+        self.pending = []
+        self.received = 0
+        self.kept = 0
+
+    def add(self, timestamp, x, y):
+        point = (timestamp, x, y)
+        self.received += 1
+        if self.anchor is None:
+            return self._keep(point)
+        emitted = []
+        if self.pending and (len(self.pending) >= self.max_window or not self._fits(point)):
+            emitted = self.flush()
+        self.pending.append(point)
+        return emitted + self.expire(timestamp)
+
+    def expire(self, now):
+        if self.pending and now - self.pending[0][0] >= self.max_delay:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self.pending:
+            return []
+        point = self.pending[-1]
+        self.pending = []
+        return self._keep(point)
+
+    def stats(self):
+        return {'received': self.received, 'kept': self.kept,
+                'ratio': self.kept / self.received if self.received else 0.0}
+
+    def _fits(self, point):
+        # Every held point except the newest must stay close to anchor -> point;
+        # the newest one is covered because it would become the new endpoint.
+        for held in self.pending:
+            if synchronized_distance(held, self.anchor, point) > self.tolerance:
+                return False
+        return True
+
+    def _keep(self, point):
+        self.anchor = point
+        self.kept += 1
+        return [point]
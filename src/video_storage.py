@@ -0,0 +1,155 @@
+import os
+import re
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+FRAME_INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('segment', '<u4'), ('frame', '<u4')])
+FRAME_INDEX_FILE = 'frames.idx'
+SEGMENT_PATTERN = re.compile(r'^segment_(\d+)\.\w+$')
+
+def segment_name(segment, extension):
+    return f"segment_{segment:05d}{extension}"
+
+def frame_reference(segment_file, frame):
+    return f"{segment_file}#{frame}"
+
+def parse_frame_reference(reference):
+    segment_file, frame = reference.rsplit('#', 1)
+    return segment_file, int(frame)
+
+class VideoFrameStore:
+    # Appends frames to segmented video files through cv2.VideoWriter and
+    # records (timestamp, segment, frame) for every frame in frames.idx.
+    # Segment and frame numbers are assigned when a frame is submitted, so
+    # the caller gets its reference immediately; the encoding itself happens
+    # in order on a single background thread.
+    def __init__(self, directory, fps, codec='FFV1', extension='.mkv', segment_frames=3000):
+        self.directory = directory
+        self.fps = fps
+        self.codec = codec
+        self.extension = extension
+        self.segment_frames = segment_frames
+        self.segment = -1
+        self.frames_in_segment = 0
+        self.frame_size = None
+        self.frames_written = 0
+        self._writer = None
+        self._writer_segment = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._index_file = open(os.path.join(directory, FRAME_INDEX_FILE), 'ab')
+
+    def submit(self, timestamp, frame):
+        frame_size = (frame.shape[1], frame.shape[0])
+        if frame_size != self.frame_size or self.frames_in_segment >= self.segment_frames:
+            self.segment += 1
+            self.frames_in_segment = 0
+            self.frame_size = frame_size
+        segment, index = self.segment, self.frames_in_segment
+        self.frames_in_segment += 1
+        future = self._executor.submit(self._write, timestamp, segment, index, frame)
+        return frame_reference(segment_name(segment, self.extension), index), future
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+        self._index_file.close()
+        logging.info(f"Video storage: {self.frames_written} frames in {self.segment + 1} segments")
+
+    def stats(self):
+        return {'frames': self.frames_written, 'segments': self.segment + 1}
+
+    def _write(self, timestamp, segment, index, frame):
+        import cv2
+        from .encoder import to_bgr
+        if segment != self._writer_segment:
+            if self._writer is not None:
+                self._writer.release()
+            path = os.path.join(self.directory, segment_name(segment, self.extension))
+            self._writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), self.fps,
+                                           (frame.shape[1], frame.shape[0]))
+            if not self._writer.isOpened():
+                raise IOError(f"Could not open video writer for {path} with codec {self.codec}")
+            self._writer_segment = segment
+        self._writer.write(to_bgr(frame))
+        self._index_file.write(np.array([(timestamp, segment, index)], dtype=FRAME_INDEX_DTYPE).tobytes())
+        self.frames_written += 1
+
+class VideoFrameReader:
+    # Random access to frames stored by VideoFrameStore. Consecutive reads
+    # from the same segment continue decoding instead of seeking again.
+    def __init__(self, directory):
+        self.directory = directory
+        path = os.path.join(directory, FRAME_INDEX_FILE)
+        self.index = np.fromfile(path, dtype=FRAME_INDEX_DTYPE) if os.path.exists(path) else \
+            np.empty(0, dtype=FRAME_INDEX_DTYPE)
+        self.segments = {}
+        for filename in os.listdir(directory):
+            match = SEGMENT_PATTERN.match(filename)
+            if match:
+                self.segments[int(match.group(1))] = filename
+        self._capture = None
+        self._capture_segment = None
+        self._next_frame = None
+
+    def find(self, timestamp):
+        # Position in the index of the last frame at or before timestamp.
+        position = np.searchsorted(self.index['timestamp'], timestamp, side='right') - 1
+        return max(position, 0)
+
+    def read_at(self, timestamp):
+        entry = self.index[self.find(timestamp)]
+        return self.read(int(entry['segment']), int(entry['frame']))
+
+    def read_reference(self, reference):
+        segment_file, frame = parse_frame_reference(reference)
+        match = SEGMENT_PATTERN.match(segment_file)
+        return self.read(int(match.group(1)), frame)
+
+    def read(self, segment, frame):
+        # OpenCV is only loaded once a video frame is actually decoded.
+        import cv2
+        if segment != self._capture_segment:
+            self.close()
+            self._capture = cv2.VideoCapture(os.path.join(self.directory, self.segments[segment]))
+            self._capture_segment = segment
+            self._next_frame = 0
+        if frame != self._next_frame:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        ok, image = self._capture.read()
+        if not ok:
+            raise IOError(f"Could not read frame {frame} of segment {segment}")
+        self._next_frame = frame + 1
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+        self._capture = None
+        self._capture_segment = None
+
+class VideoReaderCache:
+    # The last few VideoFrameReaders by screenshots directory, for callers
+    # that resolve many video references (see load_frame): each reader
+    # parses frames.idx once and keeps its segment open between reads.
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._readers = OrderedDict()
+
+    def get(self, directory):
+        reader = self._readers.get(directory)
+        if reader is None:
+            reader = self._readers[directory] = VideoFrameReader(directory)
+            while len(self._readers) > self.maxsize:
+                self._readers.popitem(last=False)[1].close()
+        self._readers.move_to_end(directory)
+        return reader
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
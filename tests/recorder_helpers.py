@@ -0,0 +1,19 @@
+def open_session(session_dir, **overrides):
+    # A DatasetRecorder writing its session straight into session_dir, with
+    # the event log and screenshot storage open but no capture threads, so
+    # tests can feed it events synchronously.
+    from src.recorder import DatasetRecorder
+    recorder = DatasetRecorder(base_output_dir=session_dir, encoder_workers=0, **overrides)
+    recorder.session_dir = session_dir
+    recorder._setup_storage_sink()
+    recorder._setup_screenshot_storage()
+    return recorder
+
+def record(session_dir, events, **overrides):
+    # Writes (event_type, timestamp, data) events as the recorder's writer
+    # thread does and closes the session; the recorder is returned for its
+    # stats and metrics.
+    recorder = open_session(session_dir, **overrides)
+    recorder._process_buffer(list(events))
+    recorder._close_files()
+    return recorder
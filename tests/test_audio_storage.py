@@ -0,0 +1,65 @@
+import os
+import wave
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.audio_storage import AudioSegmentWriter, AudioSegmentReader, wav_memmap
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+def pcm(start, frames, channels=2):
+    return np.arange(start, start + frames * channels, dtype=np.int16).reshape(frames, channels)
+
+class TestAudioSegments(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write(self, audio_format='wav'):
+        writer = AudioSegmentWriter(self.tmpdir, 100, 2, segment_seconds=0.5, audio_format=audio_format)
+        writer.write(pcm(0, 30), first_sample_time=50.0)
+        writer.write(pcm(60, 95), first_sample_time=99.0)
+        writer.close()
+        return writer
+
+    def test_segments_and_index(self):
+        writer = self.write()
+        self.assertEqual((writer.segments, writer.samples_written), (3, 125))
+        reader = AudioSegmentReader(self.tmpdir, 100)
+        self.assertEqual(reader.files, ['segment_00000.wav', 'segment_00001.wav', 'segment_00002.wav'])
+        self.assertEqual(reader.segments['sample_offset'].tolist(), [0, 50, 100])
+        self.assertEqual(reader.segments['start_time'].tolist(), [50.0, 50.5, 51.0])
+        self.assertEqual(reader.total_samples, 125)
+        with wave.open(os.path.join(self.tmpdir, 'segment_00001.wav'), 'rb') as wav:
+            self.assertEqual(wav.getnframes(), 50)
+
+    def test_read_across_segments(self):
+        self.write()
+        reader = AudioSegmentReader(self.tmpdir, 100)
+        np.testing.assert_array_equal(reader.read(45, 105), pcm(90, 60))
+        np.testing.assert_array_equal(reader.read_time(50.2, 50.3), pcm(40, 10))
+        self.assertEqual(reader.sample_range(0, 1000), (0, 125))
+        self.assertEqual(len(reader.read(200, 300)), 0)
+
+    @unittest.skipIf(soundfile is None, "soundfile is not installed")
+    def test_flac_segments(self):
+        self.write('flac')
+        reader = AudioSegmentReader(self.tmpdir, 100)
+        self.assertTrue(reader.files[0].endswith('.flac'))
+        np.testing.assert_array_equal(reader.read(45, 105), pcm(90, 60))
+
+    def test_wav_memmap(self):
+        self.write()
+        audio = wav_memmap(os.path.join(self.tmpdir, 'segment_00000.wav'))
+        self.assertIsInstance(audio, np.memmap)
+        self.assertEqual(audio.shape, (50, 2))
+        self.assertEqual(audio[1].tolist(), [2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
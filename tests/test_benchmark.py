@@ -0,0 +1,24 @@
+import unittest
+
+from benchmarks.recorder_benchmark import run_benchmark, compare_results
+
+class TestRecorderBenchmark(unittest.TestCase):
+    def test_short_run_reports_metrics(self):
+        report = run_benchmark(duration=1, fps=10, width=64, height=48, input_rate=100,
+                               overrides={'encoder_workers': 0, 'buffer_time': 0.2})
+        results = report['results']
+        self.assertGreater(results['throughput']['frames_per_s'], 0)
+        self.assertGreater(results['latency_ms']['all']['count'], 0)
+        self.assertIn('total', results['drops'])
+        self.assertGreater(results['memory']['peak_rss_mb'], 0)
+        self.assertGreater(results['storage']['bytes_per_minute'], 0)
+        self.assertEqual(compare_results(report, report), [])
+
+    def test_compare_flags_regressions(self):
+        baseline = {'results': {'throughput': {'frames_per_s': 10.0}, 'memory': {'peak_rss_mb': 100.0}}}
+        current = {'results': {'throughput': {'frames_per_s': 8.0}, 'memory': {'peak_rss_mb': 105.0}}}
+        regressions = compare_results(current, baseline, tolerance=0.1)
+        self.assertEqual([r['metric'] for r in regressions], ['throughput.frames_per_s'])
+
+if __name__ == '__main__':
+    unittest.main()
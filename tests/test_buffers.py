@@ -0,0 +1,116 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from benchmarks.recorder_benchmark import BenchmarkRecorder, ROOT
+from src.buffers import StreamBuffers
+from src.event_log import EventLog
+
+def stream_config(**policies):
+    return {name: {'maxsize': maxsize, 'policy': policy} for name, (maxsize, policy) in policies.items()}
+
+class TestStreamBuffers(unittest.TestCase):
+    def drain(self, buffers):
+        items = []
+        while not buffers.empty():
+            items.append(buffers.get(block=False))
+        return items
+
+    def test_get_returns_oldest_across_streams(self):
+        buffers = StreamBuffers()
+        buffers.put(('screenshot', 2.0, 'frame'))
+        buffers.put(('mouse_move', 1.0, (1, 2)))
+        buffers.put(('key_press', 1.5, 'a'))
+        self.assertEqual([item[1] for item in self.drain(buffers)], [1.0, 1.5, 2.0])
+        with self.assertRaises(queue.Empty):
+            buffers.get(timeout=0.01)
+
+    def test_drop_oldest(self):
+        buffers = StreamBuffers(stream_config(screenshot=(2, 'drop_oldest')))
+        for i in range(5):
+            buffers.put(('screenshot', float(i), i))
+        self.assertEqual([item[2] for item in self.drain(buffers)], [3, 4])
+        stats = buffers.stats()['screenshot']
+        self.assertEqual((stats['put'], stats['dropped'], stats['high_water']), (5, 3, 2))
+
+    def test_drop_newest(self):
+        buffers = StreamBuffers(stream_config(screenshot=(2, 'drop_newest')))
+        for i in range(5):
+            buffers.put(('screenshot', float(i), i))
+        self.assertEqual([item[2] for item in self.drain(buffers)], [0, 1])
+        self.assertEqual(buffers.stats()['screenshot']['dropped'], 3)
+
+    def test_spill_keeps_everything_in_order(self):
+        buffers = StreamBuffers(stream_config(screenshot=(2, 'spill')))
+        for i in range(6):
+            buffers.put(('screenshot', float(i), [i] * 3))
+        self.assertEqual(buffers.qsize(), 6)
+        self.assertEqual(buffers.get()[2], [0, 0, 0])
+        buffers.put(('screenshot', 6.0, [6] * 3))
+        self.assertEqual([item[2][0] for item in self.drain(buffers)], [1, 2, 3, 4, 5, 6])
+        stats = buffers.stats()['screenshot']
+        self.assertEqual((stats['spilled'], stats['dropped'], stats['size']), (5, 0, 0))
+        buffers.close()
+
+    def test_streams_without_a_buffer_go_to_input(self):
+        # The recorder in src/ has no audio stream; the legacy recorder.py
+        # configures one.
+        buffers = StreamBuffers()
+        self.assertEqual(sorted(buffers.stats()), ['input', 'screenshot'])
+        buffers.put(('audio', 1.0, 'chunk'))
+        self.assertEqual(buffers.stats()['input']['put'], 1)
+        buffers = StreamBuffers(stream_config(audio=(2, 'spill')))
+        buffers.put(('audio', 1.0, 'chunk'))
+        self.assertEqual(buffers.stats()['audio']['put'], 1)
+
+    def test_block_waits_for_room(self):
+        buffers = StreamBuffers(stream_config(input=(1, 'block')))
+        buffers.put(('key_press', 1.0, 'a'))
+        with self.assertRaises(queue.Full):
+            buffers.put(('key_press', 2.0, 'b'), timeout=0.01)
+        producer = threading.Thread(target=buffers.put, args=(('key_press', 3.0, 'c'),))
+        producer.start()
+        time.sleep(0.05)
+        self.assertEqual(buffers.get()[2], 'a')
+        producer.join(timeout=1)
+        self.assertEqual(buffers.get()[2], 'c')
+        stats = buffers.stats()['input']
+        self.assertEqual((stats['put'], stats['dropped']), (2, 0))
+        self.assertGreater(stats['blocked_seconds'], 0)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            StreamBuffers(stream_config(input=(1, 'shrug')))
+
+class SlowWriterRecorder(BenchmarkRecorder):
+    # A writer that falls behind the screenshot stream.
+    def _write_event(self, timestamp, event_type, data):
+        super()._write_event(timestamp, event_type, data)
+        if event_type == 'screenshot':
+            time.sleep(0.05)
+
+class TestRecorderSpill(unittest.TestCase):
+    def test_screenshots_spill_instead_of_dropping(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        recorder = SlowWriterRecorder(os.path.join(ROOT, 'config.yaml'), 50, base_output_dir=tmpdir,
+                                      screenshot_freq=40, screenshot_backend='synthetic',
+                                      screenshot_backend_options={'width': 64, 'height': 48},
+                                      screenshot_change_detection=False, encoder_workers=0, buffer_time=0.2,
+                                      metrics_port=None,
+                                      stream_buffers={'screenshot': {'maxsize': 2, 'policy': 'spill'}})
+        recorder.start()
+        time.sleep(1.0)
+        session_dir = recorder.session_dir
+        recorder.stop()
+        stats = recorder.data_queue.stats()['screenshot']
+        self.assertGreater(stats['spilled'], 0)
+        self.assertEqual((stats['dropped'], stats['size']), (0, 0))
+        self.assertEqual(len(EventLog(session_dir).of_type('screenshot')), stats['put'])
+
+if __name__ == '__main__':
+    unittest.main()
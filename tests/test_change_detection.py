@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import cv2
+
+from src.change_detection import FrameChangeDetector, changed_tiles, save_delta, load_frame
+from src.event_log import EventLog
+from src.frame_sources import SyntheticFrameSource
+from tests.recorder_helpers import record
+
+class TestChangedTiles(unittest.TestCase):
+    def test_marks_only_changed_tiles(self):
+        a = np.zeros((70, 100, 3), dtype=np.uint8)
+        b = a.copy()
+        b[5, 5, 1] = 1
+        b[69, 99, 0] = 1
+        mask = changed_tiles(b, a, 32)
+        self.assertEqual(mask.shape, (3, 4))
+        self.assertEqual(np.argwhere(mask).tolist(), [[0, 0], [2, 3]])
+
+class TestFrameChangeDetector(unittest.TestCase):
+    def test_classification(self):
+        detector = FrameChangeDetector(tile_size=8, keyframe_interval=2, max_delta_ratio=0.5)
+        frame = np.zeros((32, 32, 3), dtype=np.uint8)
+        self.assertEqual(detector.classify(frame)[0], 'keyframe')
+        self.assertEqual(detector.classify(frame.copy())[0], 'unchanged')
+        changed = frame.copy()
+        changed[0, 0] = 255
+        kind, mask = detector.classify(changed)
+        self.assertEqual(kind, 'delta')
+        self.assertEqual(mask.sum(), 1)
+        changed = changed.copy()
+        changed[31, 31] = 255
+        self.assertEqual(detector.classify(changed)[0], 'delta')
+        changed = changed.copy()
+        changed[16, 16] = 255
+        self.assertEqual(detector.classify(changed)[0], 'keyframe')
+        self.assertEqual(detector.stats(), {'keyframe': 2, 'delta': 2, 'unchanged': 1})
+
+    def test_large_change_forces_keyframe(self):
+        detector = FrameChangeDetector(tile_size=8, max_delta_ratio=0.5)
+        detector.classify(np.zeros((32, 32, 3), dtype=np.uint8))
+        self.assertEqual(detector.classify(np.ones((32, 32, 3), dtype=np.uint8))[0], 'keyframe')
+
+class TestDeltaRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_frames_rebuild_exactly(self):
+        source = SyntheticFrameSource(width=100, height=70, block_size=10)
+        detector = FrameChangeDetector(tile_size=16, keyframe_interval=3, max_delta_ratio=0.9)
+        keyframe_name = None
+        stored = []
+        for i in range(8):
+            frame = source.grab()
+            kind, mask = detector.classify(frame)
+            if kind == 'keyframe':
+                keyframe_name = f"frame_{i}.png"
+                cv2.imwrite(os.path.join(self.tmpdir, keyframe_name), cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+                stored.append((keyframe_name, frame))
+            elif kind == 'delta':
+                name = f"frame_{i}.delta.npz"
+                save_delta(os.path.join(self.tmpdir, name), keyframe_name, frame, mask, 16)
+                stored.append((name, frame))
+        self.assertTrue(any(name.endswith('.npz') for name, _ in stored))
+        for name, frame in stored:
+            np.testing.assert_array_equal(load_frame(self.tmpdir, name), frame)
+
+class TestRecorderDeltaStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_session_rows_and_files(self):
+        frame = SyntheticFrameSource(width=64, height=48, static=True).grab()
+        changed = frame.copy()
+        changed[0:4, 0:4] = 0
+        events = [('screenshot', 1.0, frame), ('screenshot', 1.1, frame.copy()), ('screenshot', 1.2, changed)]
+        record(self.tmpdir, events, screenshot_change_detection=True, screenshot_tile_size=16)
+        rows = list(EventLog(self.tmpdir).rows())
+        self.assertEqual([row[1] for row in rows], ['screenshot', 'screenshot_repeat', 'screenshot_delta'])
+        self.assertEqual(rows[1][2], rows[0][2])
+        screenshots_dir = os.path.join(self.tmpdir, 'screenshots')
+        np.testing.assert_array_equal(load_frame(screenshots_dir, rows[2][2]), changed)
+
+    def test_lossy_format_keeps_keyframes_lossless(self):
+        from src.encoder import FrameEncoderPool
+        from src.screenshot_storage import ScreenshotStorage
+        screenshots_dir = os.path.join(self.tmpdir, 'lossy')
+        with self.assertLogs(level='WARNING'):
+            config = {'screenshot_change_detection': True, 'screenshot_tile_size': 8, 'screenshot_format': 'jpeg',
+                      'screenshot_quality': 30}
+            storage = ScreenshotStorage(screenshots_dir, config, FrameEncoderPool(workers=0), frequency=1)
+        source = SyntheticFrameSource(width=64, height=48, block_size=8)
+        frames = [source.grab() for _ in range(4)]
+        rows = [storage.save(float(i), frame)[0] for i, frame in enumerate(frames)]
+        storage.close()
+        self.assertTrue(rows[0][2].endswith('.png'))
+        self.assertEqual(rows[1][1], 'screenshot_delta')
+        for row, frame in zip(rows, frames):
+            np.testing.assert_array_equal(load_frame(screenshots_dir, row[2]), frame)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import csv
+import wave
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import cv2
+
+from src.audio_storage import AudioSegmentReader, AUDIO_DIR
+from src.change_detection import load_frame
+from src.compaction import compact_session, compact_dataset, find_sessions, COMPACTION_FILE, ORIGINALS_DIR
+from src.event_log import EventLog
+from src.frame_sources import SyntheticFrameSource
+from src.session_index import SessionIndex
+
+CONFIG = {'audio_samplerate': 8000, 'audio_channels': 1, 'screenshot_change_detection': True,
+          'screenshot_tile_size': 8}
+
+class TestCompaction(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.source = SyntheticFrameSource(width=64, height=48, block_size=8)
+
+    def make_session(self, name, standalone=False, frames=4):
+        # The first DatasetRecorder layout (screenshots/, key=value data,
+        # audio.wav) or the standalone recorder's (frames next to
+        # events.csv, tuple data, audio_<time>.npy chunks).
+        session_dir = os.path.join(self.tmpdir, 'dataset', name)
+        frames_dir = session_dir if standalone else os.path.join(session_dir, 'screenshots')
+        os.makedirs(frames_dir)
+        rows, images = [], {}
+        for i in range(frames):
+            timestamp = 1000.0 + i * 0.5
+            filename = f"screenshot_{1000 + i}.png"
+            image = self.source.frame_at(i // 2 * 2)  # every other frame repeats
+            cv2.imwrite(os.path.join(frames_dir, filename), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            images[filename] = image
+            rows.append([timestamp, 'screenshot', filename])
+            if standalone:
+                rows.append([timestamp + 0.1, 'mouse_click', str((i, 2 * i, 'Button.left', True))])
+            else:
+                rows.append([timestamp + 0.1, 'mouse_move', f"x={i}, y={2 * i}"])
+                rows.append([timestamp + 0.2, 'key_press', "key='a'"])
+        with open(os.path.join(session_dir, 'events.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Timestamp", "EventType", "Data"])
+            writer.writerows(rows)
+        audio = (np.arange(16000) % 200 - 100).astype('<i2')[:, None]
+        if standalone:
+            np.save(os.path.join(session_dir, 'audio_1001.npy'), audio[:8000].astype(np.float32) / 32767)
+            np.save(os.path.join(session_dir, 'audio_1002.npy'), audio[8000:].astype(np.float32) / 32767)
+        else:
+            with wave.open(os.path.join(session_dir, 'audio.wav'), 'wb') as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(8000)
+                wav.writeframes(audio.tobytes())
+        return session_dir, rows, images, audio
+
+    def check_compacted(self, session_dir, rows, images, audio):
+        log = EventLog(session_dir)
+        self.assertEqual([float(t) for t in log.records['timestamp']], [row[0] for row in rows])
+        screenshots = os.path.join(session_dir, 'screenshots')
+        for (_, event_type, data), (_, _, original) in zip(log.rows(), rows):
+            if event_type.startswith('screenshot'):
+                np.testing.assert_array_equal(load_frame(screenshots, data), images[original])
+        self.assertIn('screenshot_repeat', {row[1] for row in log.rows()})
+        reader = AudioSegmentReader(os.path.join(session_dir, AUDIO_DIR), 8000)
+        np.testing.assert_array_equal(reader.read(0, reader.total_samples), audio)
+        self.assertEqual(SessionIndex(session_dir).meta['events'], len(rows))
+
+    def test_in_place(self):
+        session_dir, rows, images, audio = self.make_session('session_a')
+        result = compact_session(session_dir, CONFIG)
+        self.assertEqual(result['status'], 'compacted', result.get('error'))
+        self.assertEqual((result['events'], result['frames']), (12, 4))
+        self.check_compacted(session_dir, rows, images, audio)
+        self.assertEqual(sorted(os.listdir(os.path.join(session_dir, ORIGINALS_DIR))),
+                         ['audio.wav', 'events.csv', 'screenshots'])
+        self.assertEqual(EventLog(session_dir).event_data(EventLog(session_dir).records[1]), (0, 0))
+        # A second run only finishes what was asked for.
+        self.assertEqual(compact_session(session_dir, CONFIG, delete_originals=True)['status'], 'skipped')
+        self.assertFalse(os.path.exists(os.path.join(session_dir, ORIGINALS_DIR)))
+
+    def test_standalone_layout_to_output(self):
+        session_dir, rows, images, audio = self.make_session('session_b', standalone=True)
+        output_dir = os.path.join(self.tmpdir, 'compacted')
+        result = compact_session(session_dir, dict(CONFIG, screenshot_format='webp', screenshot_quality=101),
+                                 output_dir)
+        self.assertEqual(result['status'], 'compacted', result.get('error'))
+        self.check_compacted(output_dir, rows, images, audio)
+        self.assertTrue(os.path.exists(os.path.join(session_dir, 'events.csv')))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, COMPACTION_FILE)))
+
+    def test_resumes_interrupted_runs(self):
+        session_dir, rows, images, audio = self.make_session('session_c')
+        # A staging directory left by a killed run, and legacy files already
+        # moved aside by an interrupted in-place commit.
+        os.makedirs(session_dir + '.compacting')
+        originals = os.path.join(session_dir, ORIGINALS_DIR)
+        os.makedirs(originals)
+        for name in ('audio.wav', 'screenshots', 'events.csv'):
+            os.replace(os.path.join(session_dir, name), os.path.join(originals, name))
+        self.assertEqual(find_sessions(os.path.join(self.tmpdir, 'dataset')), [session_dir])
+        self.assertEqual(compact_session(session_dir, CONFIG)['status'], 'compacted')
+        self.check_compacted(session_dir, rows, images, audio)
+        self.assertFalse(os.path.exists(session_dir + '.compacting'))
+
+    def test_failed_verification_leaves_session_untouched(self):
+        session_dir, _, _, _ = self.make_session('session_d')
+        # Without change detection JPEG keyframes stay lossy.
+        result = compact_session(session_dir, dict(CONFIG, screenshot_format='jpeg', screenshot_quality=50,
+                                                   screenshot_change_detection=False))
+        self.assertEqual(result['status'], 'failed')
+        self.assertIn('does not match', result['error'])
+        self.assertEqual(sorted(os.listdir(session_dir)), ['audio.wav', 'events.csv', 'screenshots'])
+
+    def test_dataset_in_parallel(self):
+        for name in ('session_e', 'session_f'):
+            self.make_session(name)
+        finished = []
+        results, summary = compact_dataset(os.path.join(self.tmpdir, 'dataset'), CONFIG, workers=2,
+                                           delete_originals=True, progress=finished.append)
+        self.assertEqual([result['status'] for result in results], ['compacted', 'compacted'])
+        self.assertEqual(len(finished), 2)
+        self.assertEqual(summary['frames'], 8)
+        self.assertGreater(summary['frames_per_s'], 0)
+        self.assertEqual(find_sessions(os.path.join(self.tmpdir, 'dataset')),
+                         [result['session'] for result in sorted(results, key=lambda r: r['session'])])
+        _, summary = compact_dataset(os.path.join(self.tmpdir, 'dataset'), CONFIG, workers=2)
+        self.assertEqual(summary['skipped'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
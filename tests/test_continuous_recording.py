@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from benchmarks.recorder_benchmark import BenchmarkRecorder, ROOT
+from src.audio_recorder import AudioRecorder
+from src.audio_storage import AudioSegmentReader, AUDIO_DIR
+from src.event_log import EventLog
+from src.session_index import SessionIndex
+from src.session_retention import SessionRetention, list_sessions
+
+class TestAudioSwitch(unittest.TestCase):
+    def test_block_is_split_at_the_cut(self):
+        old, new = MagicMock(), MagicMock()
+        recorder = AudioRecorder(old, {'audio_channels': 1, 'audio_samplerate': 100})
+        recorder.running = True
+        recorder._callback(np.zeros((10, 1), dtype=np.float32), 10, None, None)
+        recorder.first_sample_time = 50.0
+        switched = recorder.switch_writer(new, 50.04)
+        recorder._drain()
+        self.assertTrue(switched.is_set())
+        self.assertEqual(len(old.write.call_args[0][0]), 4)
+        block, start_time = new.write.call_args[0]
+        self.assertEqual(len(block), 6)
+        self.assertAlmostEqual(start_time, 50.04)
+        self.assertIs(recorder.audio_writer, new)
+
+    def test_switch_waits_for_the_cut(self):
+        old, new = MagicMock(), MagicMock()
+        recorder = AudioRecorder(old, {'audio_channels': 1, 'audio_samplerate': 100})
+        recorder.running = True
+        recorder._callback(np.zeros((10, 1), dtype=np.float32), 10, None, None)
+        recorder.first_sample_time = 50.0
+        switched = recorder.switch_writer(new, 60.0)
+        recorder._drain()
+        self.assertFalse(switched.is_set())
+        new.write.assert_not_called()
+
+class TestSessionRetention(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sessions = []
+        for i, mtime in enumerate((1000, 2000, 3000, 4000)):
+            path = os.path.join(self.tmpdir, f"session_2024010{i}_000000")
+            os.makedirs(path)
+            with open(os.path.join(path, 'events.bin'), 'wb') as f:
+                f.write(b'\0' * 1000)
+            os.utime(os.path.join(path, 'events.bin'), (mtime, mtime))
+            os.utime(path, (mtime, mtime))
+            self.sessions.append(path)
+
+    def test_quota_removes_oldest_but_not_active(self):
+        retention = SessionRetention(self.tmpdir, {'disk_quota_bytes': 2500},
+                                     active=lambda: [self.sessions[0], None])
+        self.assertEqual(retention.prune(), self.sessions[1:3])
+        self.assertEqual(list_sessions(self.tmpdir), [self.sessions[0], self.sessions[3]])
+        self.assertEqual(retention.stats(), {'pruned': 2, 'pruned_bytes': 2000})
+
+    def test_age(self):
+        retention = SessionRetention(self.tmpdir, {'retention_days': 1}, clock=lambda: 2500 + 86400)
+        self.assertEqual(retention.prune(), self.sessions[:2])
+
+    def test_disabled_without_limits(self):
+        retention = SessionRetention(self.tmpdir, {})
+        self.assertFalse(retention.enabled)
+        retention.start()
+        retention.stop()
+        self.assertEqual(len(list_sessions(self.tmpdir)), 4)
+
+class TestRollover(unittest.TestCase):
+    def test_sessions_follow_each_other_without_gaps(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        recorder = BenchmarkRecorder(os.path.join(ROOT, 'config.yaml'), 200, base_output_dir=tmpdir,
+                                     screenshot_freq=10, screenshot_backend='synthetic',
+                                     screenshot_backend_options={'width': 64, 'height': 48},
+                                     encoder_workers=0, buffer_time=0.2, metrics_port=None,
+                                     session_rollover_grace=0.3)
+        self.assertIs(recorder.start(), recorder)
+        self.assertFalse(recorder.wait(0.6))
+        first = recorder.session_dir
+        self.assertTrue(recorder.rollover())
+        self.assertFalse(recorder.rollover())  # the first one is still closing
+        cut_time = recorder.closing.cut_time
+        recorder.wait(1.0)
+        self.assertIsNone(recorder.closing)
+        self.assertEqual(recorder.status()['sessions'], 2)
+        recorder.stop()
+        self.assertTrue(recorder.wait(0))
+        self.assertFalse(recorder.status()['running'])
+
+        second = recorder.session_dir
+        self.assertEqual(list_sessions(tmpdir), [first, second])
+        first_log, second_log = EventLog(first), EventLog(second)
+        self.assertTrue((first_log.records['timestamp'] < cut_time).all())
+        self.assertTrue((second_log.records['timestamp'] >= cut_time).all())
+        self.assertEqual(SessionIndex(first).meta['events'], len(first_log))
+        for session in (first, second):
+            frames = SessionIndex(session).frames(0, float('inf'))
+            self.assertEqual(frames[0][1], 'screenshot')
+        # Audio continues sample for sample in the next session.
+        readers = [AudioSegmentReader(os.path.join(session, AUDIO_DIR), recorder.audio_recorder.samplerate)
+                   for session in (first, second)]
+        self.assertAlmostEqual(readers[1].start_time,
+                               readers[0].start_time + readers[0].total_samples / recorder.audio_recorder.samplerate)
+        self.assertAlmostEqual(readers[1].start_time, cut_time, delta=0.001)
+        self.assertEqual(readers[0].total_samples + readers[1].total_samples, recorder.audio_recorder.frames_written)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.audio_storage import AudioSegmentWriter
+from src.change_detection import FrameChangeDetector, save_delta
+from src.dataset_loader import SessionDataset, PrefetchLoader
+from src.encoder import write_image
+from src.event_log import EventLogWriter
+from src.frame_sources import SyntheticFrameSource
+from src.session_index import build_session_index
+
+def make_session(session_dir, frames=6, samplerate=1000):
+    screenshots_dir = os.path.join(session_dir, 'screenshots')
+    os.makedirs(screenshots_dir)
+    source = SyntheticFrameSource(width=48, height=32, block_size=8)
+    detector = FrameChangeDetector(tile_size=8, keyframe_interval=2, max_delta_ratio=1.0)
+    writer = EventLogWriter(session_dir)
+    stored = []
+    keyframe = None
+    for i in range(frames):
+        timestamp = 100 + i * 0.5
+        frame = source.grab()
+        writer.append(timestamp - 0.25, 'mouse_move', (i, i))
+        kind, mask = detector.classify(frame)
+        if kind == 'keyframe':
+            keyframe = f"screenshot_{i}.png"
+            write_image(os.path.join(screenshots_dir, keyframe), frame)
+            writer.append(timestamp, 'screenshot', keyframe)
+        else:
+            name = f"screenshot_{i}.delta.npz"
+            save_delta(os.path.join(screenshots_dir, name), keyframe, frame, mask, 8)
+            writer.append(timestamp, 'screenshot_delta', name)
+        stored.append(frame)
+    writer.close()
+    audio_writer = AudioSegmentWriter(os.path.join(session_dir, 'audio'), samplerate, 2, segment_seconds=0.7)
+    audio_writer.write(np.arange(2 * samplerate * frames, dtype=np.int16).reshape(-1, 2), 100.0)
+    audio_writer.close()
+    build_session_index(session_dir, {'dir': 'audio', 'samplerate': samplerate, 'channels': 2})
+    return stored
+
+class TestSessionDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sessions = [os.path.join(self.tmpdir, name) for name in ('a', 'b')]
+        self.frames = [make_session(session) for session in self.sessions]
+
+    def test_samples_are_aligned(self):
+        dataset = SessionDataset(self.sessions, event_window=0.3, audio_window=0.5)
+        self.assertEqual(len(dataset), 12)
+        sample = dataset[8]
+        self.assertEqual(sample['session'], self.sessions[1])
+        self.assertEqual(sample['timestamp'], 101.0)
+        np.testing.assert_array_equal(sample['frame'], self.frames[1][2])
+        self.assertEqual(sample['events']['x'].tolist(), [2])
+        self.assertEqual(sample['audio'].shape, (500, 2))
+        self.assertEqual(sample['audio'][0].tolist(), [1000, 1001])
+
+    def test_frame_cache(self):
+        dataset = SessionDataset(self.sessions[:1], frame_cache_size=2)
+        for i in range(len(dataset)):
+            np.testing.assert_array_equal(dataset[i]['frame'], self.frames[0][i])
+        dataset[len(dataset) - 1]
+        stats = dataset.cache_stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertGreater(stats['hits'], 0)
+
+class TestPrefetchLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.session = os.path.join(self.tmpdir, 'session')
+        make_session(self.session, frames=7)
+        self.dataset = SessionDataset(self.session)
+
+    def test_threads_keep_order(self):
+        loader = PrefetchLoader(self.dataset, workers=3, prefetch=2)
+        timestamps = [sample['timestamp'] for sample in loader]
+        self.assertEqual(timestamps, [100 + i * 0.5 for i in range(7)])
+
+    def test_batches_and_shuffle(self):
+        loader = PrefetchLoader(self.dataset, batch_size=3, shuffle=True, seed=1)
+        batches = list(loader)
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual(len(loader), 3)
+        timestamps = sorted(sample['timestamp'] for batch in batches for sample in batch)
+        self.assertEqual(timestamps, [100 + i * 0.5 for i in range(7)])
+
+    def test_processes(self):
+        loader = PrefetchLoader(self.dataset, workers=2, use_processes=True)
+        self.assertEqual(len([sample['frame'].shape for sample in loader]), 7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+import numpy as np
+
+from src.change_detection import load_frame
+from src.encoder import FrameEncoderPool, write_image, image_extension
+from src.event_log import EventLog
+from src.frame_sources import SyntheticFrameSource
+from tests.recorder_helpers import open_session
+
+class TestWriteImage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.frame = SyntheticFrameSource(width=64, height=48).grab()
+
+    def test_lossless_formats_round_trip(self):
+        for image_format, quality in [('png', 9), ('webp', 101)]:
+            filename = 'frame' + image_extension(image_format)
+            size = write_image(os.path.join(self.tmpdir, filename), self.frame, image_format, quality)
+            self.assertEqual(size, os.path.getsize(os.path.join(self.tmpdir, filename)))
+            np.testing.assert_array_equal(load_frame(self.tmpdir, filename), self.frame)
+
+    def test_jpeg(self):
+        path = os.path.join(self.tmpdir, 'frame.jpg')
+        write_image(path, self.frame, 'jpeg', 80)
+        self.assertEqual(load_frame(self.tmpdir, 'frame.jpg').shape, self.frame.shape)
+
+class TestFrameEncoderPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.frame = SyntheticFrameSource(width=64, height=48).grab()
+
+    def test_inline_pool(self):
+        pool = FrameEncoderPool(workers=0)
+        future = pool.submit(write_image, os.path.join(self.tmpdir, 'a.png'), self.frame)
+        self.assertTrue(future.done())
+        failed = pool.submit(write_image, os.path.join(self.tmpdir, 'missing', 'b.png'), self.frame)
+        self.assertIsNotNone(failed.exception())
+        stats = pool.stats()
+        self.assertEqual((stats['submitted'], stats['completed'], stats['failed'], stats['backlog']), (2, 1, 1, 0))
+
+    def test_process_pool(self):
+        pool = FrameEncoderPool(workers=1, max_backlog=2)
+        futures = [pool.submit(write_image, os.path.join(self.tmpdir, f"{i}.png"), self.frame) for i in range(4)]
+        for future in futures:
+            future.result(timeout=60)
+        pool.shutdown()
+        stats = pool.stats()
+        self.assertEqual(stats['completed'], 4)
+        self.assertLessEqual(stats['peak_backlog'], 2)
+        self.assertEqual(len(os.listdir(self.tmpdir)), 4)
+
+class TestOrderedCommit(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.recorder = open_session(self.tmpdir)
+
+    def read_rows(self):
+        self.recorder.event_log.flush()
+        return list(EventLog(self.tmpdir).rows())
+
+    def test_rows_wait_for_pending_frames(self):
+        job = Future()
+        self.recorder._commit_row([1.0, 'screenshot', 'a.png'], job)
+        self.recorder._save_input_event('mouse_move', 1.1, (1, 2))
+        self.assertEqual(self.read_rows(), [])
+        job.set_result(None)
+        self.recorder._commit_pending()
+        self.assertEqual([row[1] for row in self.read_rows()], ['screenshot', 'mouse_move'])
+
+    def test_failed_frames_are_not_committed(self):
+        job = Future()
+        job.set_exception(IOError("disk full"))
+        self.recorder._commit_row([1.0, 'screenshot', 'a.png'], job)
+        self.recorder._save_input_event('key_press', 1.1, 'a')
+        self.assertEqual([row[1] for row in self.read_rows()], ['key_press'])
+
+    def test_buffer_is_committed_in_timestamp_order(self):
+        frame = SyntheticFrameSource(width=16, height=16).grab()
+        self.recorder._process_buffer([('mouse_move', 2.0, (1, 2)), ('screenshot', 1.0, frame),
+                                       ('key_press', 1.5, 'a')])
+        self.assertEqual([row[1] for row in self.read_rows()], ['screenshot', 'key_press', 'mouse_move'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.event_log import EventLogWriter, EventLog, EVENT_DTYPE, RECORD, format_event_data, parse_event_data
+from tests.recorder_helpers import record
+
+EVENTS = [
+    (1.0, 'mouse_move', (10, 20)),
+    (1.1, 'mouse_click', (10, 20, 'Button.left', True)),
+    (1.2, 'mouse_click', (10, 20, 'Button.left', False)),
+    (1.3, 'mouse_scroll', (-5, 7, 0, -1)),
+    (1.4, 'key_press', "'a'"),
+    (1.5, 'key_release', "'a'"),
+    (1.6, 'screenshot', 'screenshot_1600.png'),
+    (1.7, 'screenshot_repeat', 'screenshot_1600.png'),
+    (1.8, 'key_press', 'Key.shift'),
+]
+
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write_events(self, batch_size=4):
+        writer = EventLogWriter(self.tmpdir, batch_size=batch_size)
+        for event in EVENTS:
+            writer.append(*event)
+        writer.close()
+        return writer
+
+    def test_record_layout(self):
+        self.assertEqual(EVENT_DTYPE.itemsize, RECORD.size)
+
+    def test_round_trip(self):
+        writer = self.write_events()
+        self.assertEqual(writer.records_written, len(EVENTS))
+        log = EventLog(self.tmpdir)
+        self.assertEqual(len(log), len(EVENTS))
+        self.assertEqual([log.event_data(record) for record in log.records], [event[2] for event in EVENTS])
+        np.testing.assert_array_equal(log.records['timestamp'], [event[0] for event in EVENTS])
+        self.assertEqual(log.strings.count("'a'"), 1)
+        self.assertEqual(len(log.of_type('key_press')), 2)
+
+    def test_memory_map(self):
+        self.write_events()
+        log = EventLog(self.tmpdir, mmap=True)
+        self.assertIsInstance(log.records, np.memmap)
+        self.assertEqual(log.records['x'][3], -5)
+
+    def test_truncated_log(self):
+        self.write_events()
+        path = os.path.join(self.tmpdir, 'events.bin')
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+        self.assertEqual(len(EventLog(self.tmpdir)), len(EVENTS) - 1)
+
+    def test_csv_export_matches_legacy_format(self):
+        self.write_events()
+        path = EventLog(self.tmpdir).to_csv()
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["Timestamp", "EventType", "Data"])
+        expected = [[str(t), event_type, format_event_data(event_type, data)] for t, event_type, data in EVENTS]
+        self.assertEqual(rows[1:], expected)
+
+class TestRecorderEventLogFormats(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def record(self, **overrides):
+        record(self.tmpdir, [('mouse_move', 1.0, (1, 2)), ('key_press', 2.0, 'Key.enter')], **overrides)
+
+    def test_binary_log_with_csv_export(self):
+        self.record(event_log_export_csv=True)
+        self.assertEqual([row[1] for row in EventLog(self.tmpdir).rows()], ['mouse_move', 'key_press'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'events.csv')))
+
+    def test_csv_format(self):
+        self.record(event_log_format='csv')
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'events.bin')))
+        with open(os.path.join(self.tmpdir, 'events.csv')) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[1], ['1.0', 'mouse_move', 'x=1, y=2'])
+
+class TestParseEventData(unittest.TestCase):
+    def test_inverts_format_event_data(self):
+        for _, event_type, data in EVENTS:
+            self.assertEqual(parse_event_data(event_type, format_event_data(event_type, data)), data)
+
+    def test_tuple_reprs(self):
+        self.assertEqual(parse_event_data('mouse_move', '(10, 20)'), (10, 20))
+        self.assertEqual(parse_event_data('mouse_click', "(1, 2, 'Button.left', True)"), (1, 2, 'Button.left', True))
+        self.assertEqual(parse_event_data('key_press', "'a'"), "'a'")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from src.encoder import FrameEncoderPool
+from src.frame_hash import (MultiIndexHash, HashIndex, build_hash_index, deduplicate, hamming, load_frame_hashes,
+                            phash, session_frame_hashes)
+from src.frame_sources import SyntheticFrameSource
+from src.screenshot_storage import ScreenshotStorage
+from src.shard_export import export_shards
+from tests.test_dataset_loader import make_session
+
+class TestPerceptualHash(unittest.TestCase):
+    def setUp(self):
+        self.frame = SyntheticFrameSource(width=160, height=120, block_size=16).grab()
+
+    def test_similar_frames_have_close_hashes(self):
+        noisy = np.clip(self.frame.astype(np.int16) + np.random.default_rng(0).integers(-4, 5, self.frame.shape),
+                        0, 255).astype(np.uint8)
+        self.assertLessEqual(hamming(phash(self.frame), phash(noisy)), 4)
+        other = np.random.default_rng(5).integers(0, 256, self.frame.shape, dtype=np.uint8)
+        self.assertGreater(hamming(phash(self.frame), phash(other)), 10)
+
+    def test_hash_does_not_depend_on_resolution(self):
+        small = self.frame[::2, ::2]
+        self.assertLessEqual(hamming(phash(self.frame), phash(small)), 4)
+
+class TestMultiIndexHash(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        base = rng.integers(0, 2 ** 63, 200, dtype=np.uint64)
+        # Clusters of hashes a few bits apart from each base hash.
+        flips = np.uint64(1) << rng.integers(0, 64, (200, 5)).astype(np.uint64)
+        self.hashes = np.concatenate([base, base ^ flips[:, 0], base ^ flips[:, 1] ^ flips[:, 2] ^ flips[:, 3]])
+        self.index = MultiIndexHash(self.hashes)
+
+    def test_query_matches_brute_force(self):
+        for radius in (0, 3, 6, 12):
+            for query in self.hashes[::37]:
+                positions, distances = self.index.query(query, radius)
+                brute = np.flatnonzero(hamming(self.hashes, query) <= radius)
+                self.assertEqual(sorted(positions.tolist()), brute.tolist())
+                self.assertEqual(distances.tolist(), sorted(distances.tolist()))
+
+    def test_nearest(self):
+        positions, distances = self.index.nearest(self.hashes[5] ^ np.uint64(1), count=1)
+        self.assertEqual(distances[0], 1)
+        self.assertEqual(self.hashes[positions[0]], self.hashes[5])
+
+    def test_memory_mapped_reload(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.index.save(tmpdir)
+        loaded = MultiIndexHash.load(tmpdir)
+        self.assertIsInstance(loaded.hashes, np.memmap)
+        for a, b in zip(loaded.query(self.hashes[3], 6), self.index.query(self.hashes[3], 6)):
+            np.testing.assert_array_equal(a, b)
+
+    def test_deduplicate_keeps_first(self):
+        keep = deduplicate(self.hashes, radius=0)
+        self.assertEqual(keep.sum(), len(np.unique(self.hashes)))
+        keep = deduplicate(self.hashes, radius=4)
+        self.assertTrue(keep[:200].all())
+        kept = self.hashes[keep]
+        for position, value in enumerate(kept):
+            self.assertTrue((hamming(np.delete(kept, position), value) > 4).all())
+
+    def greedy(self, hashes, radius):
+        keep = np.zeros(len(hashes), dtype=bool)
+        for position, value in enumerate(hashes):
+            keep[position] = not (hamming(hashes[keep], value) <= radius).any()
+        return keep
+
+    def test_deduplicate_matches_greedy(self):
+        # Random walks one bit at a time make long chains of near hashes.
+        rng = np.random.default_rng(2)
+        walk = np.uint64(rng.integers(0, 2 ** 63)) ^ np.bitwise_xor.accumulate(
+            np.uint64(1) << rng.integers(0, 64, 300).astype(np.uint64))
+        hashes = np.concatenate([walk, self.hashes, walk[rng.integers(0, 300, 100)]])
+        for radius in (1, 4, 7, 9):
+            np.testing.assert_array_equal(deduplicate(hashes, radius), self.greedy(hashes, radius))
+        # Small passes and the in-order finish for long chains agree too.
+        with patch('src.frame_hash.DEDUP_CHUNK_PAIRS', 64), patch('src.frame_hash.DEDUP_ROUNDS', 2):
+            np.testing.assert_array_equal(deduplicate(hashes, 5), self.greedy(hashes, 5))
+
+    def test_deduplicate_large(self):
+        # 200k hashes around 20k bases; bounded so a per-hash loop shows up.
+        rng = np.random.default_rng(3)
+        base = rng.integers(0, 2 ** 63, 20000, dtype=np.uint64)
+        hashes = base[rng.integers(0, 20000, 200000)] ^ (np.uint64(1) << rng.integers(0, 64, 200000).astype(np.uint64))
+        hashes[:20000] = base
+        start = time.perf_counter()
+        keep = deduplicate(hashes, radius=2)
+        self.assertLess(time.perf_counter() - start, 30)
+        self.assertTrue(keep[:20000].all())
+        self.assertEqual(keep.sum(), 20000)
+
+class TestSessionHashes(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_storage_writes_hashes(self):
+        screenshots_dir = os.path.join(self.tmpdir, 'screenshots')
+        storage = ScreenshotStorage(screenshots_dir, {'screenshot_hash': True, 'screenshot_change_detection': True},
+                                    FrameEncoderPool(workers=0), frequency=1)
+        source = SyntheticFrameSource(width=64, height=48, block_size=8)
+        frames = [source.grab() for _ in range(3)]
+        rows = [storage.save(10.0 + i, frame)[0] for i, frame in enumerate(frames + [frames[-1]])]
+        storage.close()
+        self.assertEqual(rows[-1][1], 'screenshot_repeat')
+        records = load_frame_hashes(screenshots_dir)
+        self.assertEqual(records['timestamp'].tolist(), [10.0, 11.0, 12.0])
+        self.assertEqual(records['hash'].tolist(), [phash(frame) for frame in frames])
+        self.assertEqual(storage.stats()['frames_hashed'], 3)
+
+    def test_index_across_sessions(self):
+        sessions = [os.path.join(self.tmpdir, name) for name in ('a', 'b')]
+        frames = [make_session(session) for session in sessions]
+        self.assertEqual(session_frame_hashes(sessions[0]).tolist(), [phash(frame) for frame in frames[0]])
+        index = build_hash_index(sessions, os.path.join(self.tmpdir, 'hash_index'))
+        self.assertEqual(len(index), 12)
+        reopened = HashIndex(os.path.join(self.tmpdir, 'hash_index'))
+        hits = reopened.query(phash(frames[1][2]), radius=0)
+        self.assertIn((os.path.abspath(sessions[1]), 2, 0), hits)
+        self.assertEqual(reopened.nearest(phash(frames[0][4]), count=1)[0][2], 0)
+
+    def test_export_drops_duplicates(self):
+        # make_session records the same synthetic frames in every session.
+        sessions = [os.path.join(self.tmpdir, 'dataset', name) for name in ('a', 'b')]
+        for session in sessions:
+            make_session(session)
+        manifest = export_shards(sessions, os.path.join(self.tmpdir, 'shards'), shard_samples=5, workers=1,
+                                 event_window=0.3, audio_window=0.5, dedup_radius=0)
+        self.assertEqual(manifest['duplicates_removed'], 6)
+        self.assertEqual(manifest['samples'], 6)
+
+if __name__ == '__main__':
+    unittest.main()
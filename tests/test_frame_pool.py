@@ -0,0 +1,110 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.buffers import StreamBuffers
+from src.change_detection import FrameChangeDetector
+from src.encoder import FrameEncoderPool, to_bgr
+from src.frame_pool import FramePool
+from src.frame_sources import SyntheticFrameSource
+from src.screenshot_storage import ScreenshotStorage
+
+class TestFramePool(unittest.TestCase):
+    def test_hits_after_release(self):
+        pool = FramePool(max_free=2)
+        first = pool.acquire((4, 4, 3))
+        pool.release(first)
+        second = pool.acquire((4, 4, 3))
+        self.assertIs(second, first)
+        pool.acquire((8, 8, 3))
+        stats = pool.stats()
+        self.assertEqual((stats['pool_hits'], stats['pool_misses'], stats['pool_in_use']), (1, 2, 2))
+
+    def test_retained_frame_is_not_reused(self):
+        pool = FramePool()
+        frame = pool.acquire((4, 4, 3))
+        pool.retain(frame)
+        pool.release(frame)
+        self.assertIsNot(pool.acquire((4, 4, 3)), frame)
+        pool.release(frame)
+        self.assertIs(pool.acquire((4, 4, 3)), frame)
+
+    def test_foreign_frames_ignored(self):
+        pool = FramePool()
+        pool.release(np.zeros((4, 4, 3), dtype=np.uint8))
+        pool.release(None)
+        self.assertEqual(pool.stats()['pool_free'], 0)
+
+    def test_free_list_is_bounded(self):
+        pool = FramePool(max_free=1)
+        frames = [pool.acquire((2, 2, 3)) for _ in range(3)]
+        for frame in frames:
+            pool.release(frame)
+        stats = pool.stats()
+        self.assertEqual((stats['pool_free'], stats['pool_discarded']), (1, 2))
+
+class TestPooledCapture(unittest.TestCase):
+    def test_grab_fills_buffer_in_place(self):
+        source = SyntheticFrameSource(width=16, height=8, block_size=4)
+        out = np.empty((8, 16, 3), dtype=np.uint8)
+        frame = source.grab(out)
+        self.assertIs(frame, out)
+        np.testing.assert_array_equal(frame, source.frame_at(0))
+        self.assertEqual(source.grab(np.empty((2, 2, 3), dtype=np.uint8)).shape, (8, 16, 3))
+
+    def test_to_bgr_reuses_scratch_and_keeps_input(self):
+        frame = SyntheticFrameSource(width=16, height=8).grab()
+        original = frame.copy()
+        first = to_bgr(frame)
+        np.testing.assert_array_equal(first, frame[:, :, ::-1])
+        self.assertIs(to_bgr(frame), first)
+        np.testing.assert_array_equal(frame, original)
+
+    def test_to_bgr_keeps_a_scratch_per_shape(self):
+        # Full frames and thumbnails alternate on the same encoder thread.
+        full = SyntheticFrameSource(width=16, height=8).grab()
+        thumbnail = full[::2, ::2].copy()
+        buffers = [to_bgr(full), to_bgr(thumbnail)]
+        for _ in range(3):
+            self.assertIs(to_bgr(full), buffers[0])
+            self.assertIs(to_bgr(thumbnail), buffers[1])
+        np.testing.assert_array_equal(to_bgr(thumbnail), thumbnail[:, :, ::-1])
+
+    def test_detector_holds_keyframe_and_previous(self):
+        pool = FramePool()
+        detector = FrameChangeDetector(tile_size=4, pool=pool)
+        source = SyntheticFrameSource(width=16, height=16, block_size=4)
+        frames = [source.grab(pool.acquire((16, 16, 3))) for _ in range(3)]
+        for frame in frames:
+            detector.classify(frame)
+            pool.release(frame)
+        # frames[0] is the keyframe and frames[2] the previous frame.
+        self.assertEqual(pool.stats()['pool_in_use'], 2)
+        detector.reset()
+        self.assertEqual(pool.stats()['pool_in_use'], 0)
+
+    def test_storage_returns_frames_after_encoding(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pool = FramePool()
+        storage = ScreenshotStorage(tmpdir, {'screenshot_change_detection': True, 'screenshot_tile_size': 4},
+                                    FrameEncoderPool(workers=0), 10, pool)
+        source = SyntheticFrameSource(width=16, height=16, block_size=4)
+        for i in range(6):
+            storage.save(i, source.grab(pool.acquire((16, 16, 3))))
+        stats = storage.stats()
+        self.assertEqual(stats['pool_in_use'], 2)
+        self.assertGreaterEqual(stats['pool_hits'], 3)
+
+    def test_dropped_frames_are_discarded(self):
+        discarded = []
+        buffers = StreamBuffers({'screenshot': {'maxsize': 1, 'policy': 'drop_oldest'}},
+                                on_discard=discarded.append)
+        buffers.put(('screenshot', 1.0, 'a'))
+        buffers.put(('screenshot', 2.0, 'b'))
+        self.assertEqual(discarded, [('screenshot', 1.0, 'a')])
+
+if __name__ == '__main__':
+    unittest.main()
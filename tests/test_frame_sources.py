@@ -0,0 +1,69 @@
+import unittest
+import queue
+import time
+
+import numpy as np
+
+from src.frame_sources import SyntheticFrameSource, PyscreenshotFrameSource, create_frame_source
+from src.screenshot_recorder import ScreenshotRecorder
+
+class TestSyntheticFrameSource(unittest.TestCase):
+    def test_frames_are_deterministic(self):
+        first = SyntheticFrameSource(width=64, height=48, block_size=8)
+        second = SyntheticFrameSource(width=64, height=48, block_size=8)
+        for _ in range(5):
+            np.testing.assert_array_equal(first.grab(), second.grab())
+
+    def test_frame_shape_and_motion(self):
+        source = SyntheticFrameSource(width=64, height=48, block_size=8)
+        frame0 = source.grab()
+        frame1 = source.grab()
+        self.assertEqual(frame0.shape, (48, 64, 3))
+        self.assertEqual(frame0.dtype, np.uint8)
+        self.assertFalse(np.array_equal(frame0, frame1))
+
+    def test_static_frames_do_not_change(self):
+        source = SyntheticFrameSource(width=64, height=48, static=True)
+        np.testing.assert_array_equal(source.grab(), source.grab())
+
+    def test_stats(self):
+        source = SyntheticFrameSource(width=32, height=32)
+        self.assertEqual(source.stats()['frames'], 0)
+        for _ in range(3):
+            source.grab()
+            time.sleep(0.01)
+        stats = source.stats()
+        self.assertEqual(stats['backend'], 'synthetic')
+        self.assertEqual(stats['frames'], 3)
+        self.assertGreater(stats['fps'], 0)
+        self.assertGreaterEqual(stats['grab_ms_max'], stats['grab_ms_mean'])
+
+class TestCreateFrameSource(unittest.TestCase):
+    def test_selects_backend_from_config(self):
+        source = create_frame_source({'screenshot_backend': 'synthetic',
+                                      'screenshot_backend_options': {'width': 16, 'height': 8}})
+        self.assertIsInstance(source, SyntheticFrameSource)
+        self.assertEqual(source.grab().shape, (8, 16, 3))
+
+    def test_pyscreenshot_backend(self):
+        source = create_frame_source({'screenshot_backend': 'pyscreenshot'})
+        self.assertIsInstance(source, PyscreenshotFrameSource)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_frame_source({'screenshot_backend': 'nope'})
+
+class TestScreenshotRecorderWithSource(unittest.TestCase):
+    def test_records_from_source(self):
+        output_queue = queue.Queue()
+        recorder = ScreenshotRecorder(output_queue, 50, SyntheticFrameSource(width=16, height=16))
+        recorder.start()
+        time.sleep(0.2)
+        recorder.stop()
+        event_type, timestamp, frame = output_queue.get(timeout=1)
+        self.assertEqual(event_type, 'screenshot')
+        self.assertEqual(frame.shape, (16, 16, 3))
+        self.assertGreater(recorder.stats()['frames'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.encoder import FrameEncoderPool
+from src.frame_pool import FramePool
+from src.frame_sources import SyntheticFrameSource
+from src.frame_transform import FrameTransform, FOCUSED_WINDOW, create_frame_transform
+from src.screenshot_recorder import ScreenshotRecorder
+from src.screenshot_storage import ScreenshotStorage, thumbnail_name, load_thumbnail
+
+class TestFrameTransform(unittest.TestCase):
+    def setUp(self):
+        self.frame = SyntheticFrameSource(width=64, height=48, block_size=8).grab()
+
+    def test_identity_returns_frame(self):
+        transform = FrameTransform()
+        self.assertFalse(transform.reduces)
+        self.assertIs(transform.apply(self.frame), self.frame)
+
+    def test_downscale_into_buffer(self):
+        transform = FrameTransform(scale=0.25)
+        out = np.empty((12, 16, 3), dtype=np.uint8)
+        self.assertEqual(transform.output_shape(self.frame.shape), (12, 16, 3))
+        self.assertIs(transform.apply(self.frame, out), out)
+        self.assertAlmostEqual(float(out.mean()), float(self.frame.mean()), delta=2)
+
+    def test_grayscale_and_scale(self):
+        transform = FrameTransform(scale=0.5, grayscale=True, interpolation='nearest')
+        reduced = transform.apply(self.frame)
+        self.assertEqual(reduced.shape, (24, 32))
+        self.assertEqual(transform.apply(self.frame, np.empty((1, 1), dtype=np.uint8)).shape, (24, 32))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            FrameTransform(interpolation='bogus')
+        with self.assertRaises(ValueError):
+            FrameTransform(region=[0, 0, 10])
+
+    def test_focused_window_is_cached(self):
+        now = [0.0]
+        lookups = []
+
+        def window():
+            lookups.append(now[0])
+            return (10, 20, 100, 50)
+        transform = FrameTransform(region=FOCUSED_WINDOW, region_refresh=1.0, window_region=window,
+                                   clock=lambda: now[0])
+        self.assertEqual(transform.region(), (10, 20, 100, 50))
+        now[0] = 0.5
+        transform.region()
+        now[0] = 1.5
+        transform.region()
+        self.assertEqual(lookups, [0.0, 1.5])
+
+    def test_config(self):
+        transform = create_frame_transform({'screenshot_region': [0, 0, 32, 16], 'screenshot_scale': 0.5})
+        self.assertEqual(transform.region(), (0, 0, 32, 16))
+        self.assertTrue(transform.reduces)
+
+class TestReducedCapture(unittest.TestCase):
+    def test_region_is_clipped(self):
+        source = SyntheticFrameSource(width=64, height=48)
+        full = source.frame_at(0)
+        frame = source.grab(region=(40, 30, 100, 100))
+        np.testing.assert_array_equal(frame, full[30:48, 40:64])
+
+    def test_recorder_queues_reduced_pooled_frames(self):
+        queued = []
+
+        class Queue:
+            def put(self, item):
+                queued.append(item)
+        pool = FramePool()
+        recorder = ScreenshotRecorder(Queue(), 10, SyntheticFrameSource(width=64, height=48), pool,
+                                      transform=FrameTransform(region=(0, 0, 32, 32), scale=0.5, grayscale=True))
+        frames = [recorder._capture() for _ in range(3)]
+        self.assertEqual(frames[0].shape, (16, 16))
+        pool.release(frames[0])
+        self.assertIs(recorder._capture(), frames[0])
+        self.assertEqual(pool.stats()['pool_hits'], 1)
+
+class TestThumbnails(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(thumbnail_name('screenshot_1.png'), os.path.join('thumbnails', 'screenshot_1.png'))
+        self.assertEqual(thumbnail_name('screenshot_1.delta.npz'), os.path.join('thumbnails', 'screenshot_1.png'))
+        self.assertEqual(thumbnail_name('segment_00000.mkv#12'), os.path.join('thumbnails', 'segment_00000_12.png'))
+
+    def test_written_with_each_stored_frame(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pool = FramePool()
+        storage = ScreenshotStorage(tmpdir, {'screenshot_change_detection': True, 'screenshot_tile_size': 8,
+                                             'screenshot_thumbnail_scale': 0.25},
+                                    FrameEncoderPool(workers=0), 10, pool)
+        source = SyntheticFrameSource(width=64, height=48, block_size=8)
+        rows = [storage.save(i, source.grab(pool.acquire((48, 64, 3))))[0] for i in range(3)]
+        self.assertEqual([row[1] for row in rows], ['screenshot', 'screenshot_delta', 'screenshot_delta'])
+        for row in rows:
+            self.assertEqual(load_thumbnail(tmpdir, row[2]).shape, (12, 16, 3))
+        self.assertEqual(pool.stats()['pool_in_use'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
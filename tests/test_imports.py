@@ -0,0 +1,35 @@
+import unittest
+
+import src
+from benchmarks.import_benchmark import measure, run_benchmark, compare_results, CAPTURE_MODULES
+
+class TestImportPaths(unittest.TestCase):
+    def test_reader_loads_no_capture_modules(self):
+        _, modules = measure('import src.reader', runs=1)
+        self.assertEqual([module for module in CAPTURE_MODULES if module in modules], [])
+
+    def test_package_import_is_lazy(self):
+        _, modules = measure('import src', runs=1)
+        self.assertNotIn('src.recorder', modules)
+        self.assertNotIn('numpy', modules)
+
+    def test_lazy_exports(self):
+        from src.recorder import DatasetRecorder
+        self.assertIs(src.DatasetRecorder, DatasetRecorder)
+        self.assertIn('AudioRecorder', dir(src))
+        with self.assertRaises(AttributeError):
+            src.NoSuchRecorder
+
+class TestImportBenchmark(unittest.TestCase):
+    def test_report_and_comparison(self):
+        report = run_benchmark(runs=1, targets={'reader': 'import src.reader'})
+        result = report['results']['reader']
+        self.assertGreater(result['import_ms']['median'], 0)
+        self.assertEqual(result['capture_modules'], [])
+        self.assertTrue(result['slowest'])
+        slower = {'results': {'reader': {'import_ms': {'median': result['import_ms']['median'] * 2}}}}
+        self.assertEqual(compare_results(report, report), [])
+        self.assertEqual([r['metric'] for r in compare_results(slower, report)], ['reader.import_ms.median'])
+
+if __name__ == '__main__':
+    unittest.main()
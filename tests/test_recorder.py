@@ -1,16 +1,22 @@
+import shutil
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 from src import DatasetRecorder
 
 class TestDatasetRecorder(unittest.TestCase):
-    @patch('src.recorder.ScreenshotRecorder')
-    @patch('src.recorder.MouseKeyboardRecorder')
-    @patch('src.recorder.AudioRecorder')
-    def setUp(self, mock_audio, mock_mouse_keyboard, mock_screenshot):
-        self.mock_audio = mock_audio
-        self.mock_mouse_keyboard = mock_mouse_keyboard
-        self.mock_screenshot = mock_screenshot
-        self.recorder = DatasetRecorder(base_output_dir="test_output", screenshot_freq=1)
+    def setUp(self):
+        self.mock_audio = self._patch('src.recorder.AudioRecorder')
+        self.mock_mouse_keyboard = self._patch('src.recorder.MouseKeyboardRecorder')
+        self.mock_screenshot = self._patch('src.recorder.ScreenshotRecorder')
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.recorder = DatasetRecorder(base_output_dir=self.tmpdir, screenshot_freq=1)
+
+    def _patch(self, target):
+        patcher = patch(target)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
 
     def test_start_recording(self):
         with patch('src.recorder.time.sleep'):
@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from src.ring_buffer import AudioRingBuffer
+from src.audio_recorder import AudioRecorder, float_to_pcm16
+
+def block(start, frames, channels=2):
+    return np.arange(start, start + frames * channels, dtype=np.float32).reshape(frames, channels)
+
+class TestAudioRingBuffer(unittest.TestCase):
+    def test_wraps_around_in_order(self):
+        ring = AudioRingBuffer(8, 2)
+        ring.write(block(0, 6))
+        np.testing.assert_array_equal(ring.read(4), block(0, 4))
+        ring.write(block(12, 5))
+        np.testing.assert_array_equal(ring.read(), np.concatenate((block(8, 2), block(12, 5))))
+        self.assertEqual(ring.available(), 0)
+        self.assertEqual(ring.high_water, 7)
+
+    def test_overflow_keeps_unread_audio(self):
+        ring = AudioRingBuffer(4, 1)
+        self.assertEqual(ring.write(block(0, 3, 1)), 3)
+        self.assertEqual(ring.write(block(3, 3, 1)), 1)
+        np.testing.assert_array_equal(ring.read(), block(0, 4, 1))
+        stats = ring.stats()
+        self.assertEqual((stats['overflows'], stats['overflow_frames'], stats['high_water']), (1, 2, 4))
+
+    def test_underflow(self):
+        ring = AudioRingBuffer(4, 1)
+        self.assertEqual(len(ring.read()), 0)
+        self.assertEqual(ring.underflows, 1)
+
+class TestAudioRecorderWriter(unittest.TestCase):
+    def test_callback_fills_ring_and_writer_converts(self):
+        audio_writer = MagicMock()
+        recorder = AudioRecorder(audio_writer, {'audio_channels': 1, 'audio_samplerate': 100})
+        recorder.running = True
+        recorder._callback(np.array([[0.5], [-1.5], [1.0]], dtype=np.float32), 3, None, None)
+        self.assertIsNotNone(recorder.first_sample_time)
+        audio_writer.write.assert_not_called()
+        recorder._drain()
+        block, first_sample_time = audio_writer.write.call_args[0]
+        self.assertEqual(block.dtype, np.int16)
+        self.assertEqual(block.tolist(), [[16383], [-32767], [32767]])
+        self.assertEqual(first_sample_time, recorder.first_sample_time)
+        self.assertEqual(recorder.stats()['frames_written'], 3)
+
+    def test_overflow_keeps_later_blocks_on_time(self):
+        # 150 frames into a 100 frame ring: the 50 dropped become silence, so
+        # the next block still starts at its real time.
+        audio_writer = MagicMock()
+        recorder = AudioRecorder(audio_writer, {'audio_channels': 1, 'audio_samplerate': 100,
+                                                'audio_buffer_seconds': 1})
+        recorder.running = True
+        recorder._callback(np.full((150, 1), 0.5, dtype=np.float32), 150, None, None)
+        recorder._drain()
+        block, first_sample_time = audio_writer.write.call_args[0]
+        self.assertEqual(len(block), 150)
+        self.assertEqual(block[100:].tolist(), [[0]] * 50)
+        recorder._callback(np.full((10, 1), 0.5, dtype=np.float32), 10, None, None)
+        recorder._drain()
+        _, next_time = audio_writer.write.call_args[0]
+        self.assertAlmostEqual(next_time, recorder.first_sample_time + 1.5)
+        self.assertEqual(recorder.stats()['silence_frames'], 50)
+
+    def test_callback_status_is_counted_not_logged(self):
+        recorder = AudioRecorder(MagicMock(), {'audio_channels': 1, 'audio_samplerate': 100})
+        recorder._callback(np.zeros((2, 1), dtype=np.float32), 2, None, 'input overflow')
+        self.assertEqual(recorder.callback_status_count, 1)
+        self.assertEqual(recorder.ring.available(), 0)
+
+    def test_float_to_pcm16(self):
+        self.assertEqual(float_to_pcm16(np.array([0.0, 2.0], dtype=np.float32)).tolist(), [0, 32767])
+
+if __name__ == '__main__':
+    unittest.main()
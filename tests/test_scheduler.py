@@ -0,0 +1,147 @@
+import unittest
+
+from src.scheduler import DeadlineScheduler, ActivityRate, create_activity_rate
+from src.mouse_keyboard_recorder import MouseKeyboardRecorder
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestDeadlineScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = DeadlineScheduler(10, clock=self.clock, wall_clock=lambda: 1000.0)
+        self.scheduler._stop_event.wait = self._advance
+
+    def _advance(self, delay):
+        self.clock.now += delay
+        return False
+
+    def test_ticks_land_on_grid_despite_work(self):
+        self.scheduler.start()
+        timestamps = []
+        for _ in range(5):
+            tick = self.scheduler.wait()
+            timestamps.append(self.scheduler.timestamp(tick))
+            self.clock.now += 0.03  # time spent grabbing the frame
+        self.assertEqual([round(t, 6) for t in timestamps], [1000.0, 1000.1, 1000.2, 1000.3, 1000.4])
+        self.assertEqual(self.scheduler.skipped, 0)
+        self.assertAlmostEqual(self.clock.now, 0.43)
+
+    def test_missed_ticks_are_skipped(self):
+        self.scheduler.start()
+        self.assertEqual(self.scheduler.wait(), 0)
+        self.clock.now += 0.35  # stall for more than three periods
+        self.assertEqual(self.scheduler.wait(), 3)
+        self.assertEqual(self.scheduler.skipped, 2)
+        self.assertAlmostEqual(self.scheduler.lateness[-1], 0.05)
+        self.assertEqual(self.scheduler.wait(), 4)
+        self.assertAlmostEqual(self.clock.now, 0.4)
+
+    def test_stats(self):
+        self.scheduler.start()
+        self.scheduler.wait()
+        self.clock.now += 0.12
+        self.scheduler.wait()
+        stats = self.scheduler.stats()
+        self.assertEqual(stats['ticks'], 2)
+        self.assertEqual(stats['skipped'], 0)
+        self.assertAlmostEqual(stats['lateness_ms_max'], 20.0)
+
+    def test_stop_interrupts_wait(self):
+        scheduler = DeadlineScheduler(0.01)
+        scheduler.start()
+        scheduler.wait()
+        scheduler.stop()
+        self.assertIsNone(scheduler.wait())
+
+class TestActivityRate(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.inputs = []
+
+    def _scheduler(self, **options):
+        self.activity = ActivityRate(10, clock=self.clock, **options)
+        scheduler = DeadlineScheduler(10, clock=self.clock, wall_clock=lambda: 1000.0, activity=self.activity)
+        scheduler._wake.wait = self._advance
+        return scheduler
+
+    def _advance(self, delay):
+        # Moves the clock to the deadline, or to the next scripted input
+        # event before it, which is delivered as the listeners would.
+        target = self.clock.now + delay
+        if self.inputs and self.inputs[0][0] < target:
+            self.clock.now, kind = self.inputs.pop(0)
+            self.activity.notify(kind)
+            return self.activity.wake.is_set()
+        self.clock.now = target
+        return False
+
+    def _timestamps(self, scheduler, until):
+        timestamps = []
+        while self.clock.now < until:
+            timestamps.append(round(scheduler.timestamp(scheduler.wait()) - 1000.0, 6))
+        return timestamps
+
+    def test_drops_to_idle_rate(self):
+        scheduler = self._scheduler(idle_frequency=1, idle_after=0.5)
+        timestamps = self._timestamps(scheduler, 3.0)
+        self.assertEqual(timestamps, [0.0, 0.1, 0.2, 0.3, 0.4, 1.4, 2.4, 3.4])
+        self.assertEqual(scheduler.stats()['idle_frames'], 3)
+
+    def test_click_bursts_and_wakes_idle_wait(self):
+        scheduler = self._scheduler(idle_frequency=1, idle_after=0.5, burst_frequency=20, burst_window=0.2)
+        self.inputs = [(1.2, 'click')]
+        timestamps = self._timestamps(scheduler, 1.9)
+        # Idle from 0.5, the click at 1.2 is captured at once, then 20 Hz for
+        # the burst window, 10 Hz while active and idle again after 0.5 s.
+        self.assertEqual(timestamps[5:], [1.2, 1.25, 1.3, 1.35, 1.45, 1.55, 1.65, 2.65])
+        stats = scheduler.stats()
+        self.assertEqual(stats['burst_frames'], 4)
+        self.assertAlmostEqual(stats['burst_seconds'], 0.2)
+
+    def test_extra_frame_after_click(self):
+        scheduler = self._scheduler(click_delay=0.03)
+        self.inputs = [(0.21, 'click')]
+        timestamps = self._timestamps(scheduler, 0.4)
+        self.assertEqual(timestamps, [0.0, 0.1, 0.2, 0.24, 0.34, 0.44])
+        self.assertEqual(scheduler.stats()['click_frames'], 1)
+
+    def test_moves_keep_the_session_active(self):
+        scheduler = self._scheduler(idle_frequency=1, idle_after=0.5)
+        self.inputs = [(0.45, 'move'), (0.85, 'move')]
+        timestamps = self._timestamps(scheduler, 1.5)
+        self.assertEqual(timestamps[-3:], [1.2, 1.3, 2.3])
+
+    def test_config(self):
+        self.assertIsNone(create_activity_rate({'screenshot_freq': 10}))
+        activity = create_activity_rate({'screenshot_freq': 10, 'screenshot_idle_freq': 2}, shared=True)
+        self.assertEqual(activity.frequencies, {'idle': 2, 'active': 10, 'burst': 10})
+        self.assertEqual(len(activity.state), 3)
+
+    def test_input_recorder_notifies(self):
+        kinds = []
+
+        class Activity:
+            def notify(self, kind):
+                kinds.append(kind)
+
+        class Queue:
+            def put(self, item):
+                pass
+        recorder = MouseKeyboardRecorder(Queue(), {'mouse_move_mode': 'throttle', 'mouse_move_throttle': 0,
+                                                   'mask_keys': []}, Activity())
+        recorder.running = True
+        recorder._on_move(1, 2)
+        recorder._on_click(1, 2, 'Button.left', True)
+        recorder._on_click(1, 2, 'Button.left', False)
+        recorder._on_scroll(1, 2, 0, 1)
+        recorder._on_press('a')
+        recorder._on_release('a')
+        self.assertEqual(kinds, ['move', 'click', 'scroll', 'key'])
+
+if __name__ == '__main__':
+    unittest.main()
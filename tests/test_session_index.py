@@ -0,0 +1,59 @@
+import os
+import wave
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.event_log import EventLogWriter
+from src.session_index import build_session_index, SessionIndex
+
+class TestSessionIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        writer = EventLogWriter(self.tmpdir)
+        # Slightly out of order, as rows from different streams can be.
+        for event in [(10.0, 'screenshot', 'a.png'), (10.05, 'mouse_move', (1, 1)),
+                      (10.02, 'key_press', "'x'"), (10.1, 'screenshot_repeat', 'a.png'),
+                      (10.15, 'mouse_click', (2, 2, 'Button.left', True)), (10.2, 'screenshot', 'b.png')]:
+            writer.append(*event)
+        writer.close()
+        with wave.open(os.path.join(self.tmpdir, 'audio.wav'), 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(1000)
+            wav.writeframes(np.zeros(500, dtype=np.int16).tobytes())
+        self.meta = build_session_index(self.tmpdir, {'file': 'audio.wav', 'start_time': 9.9,
+                                                      'samplerate': 1000, 'channels': 1})
+        self.index = SessionIndex(self.tmpdir)
+
+    def test_meta(self):
+        self.assertEqual((self.meta['events'], self.meta['frames']), (6, 3))
+        self.assertEqual((self.index.start_time, self.index.end_time), (10.0, 10.2))
+        self.assertEqual(self.index.meta['audio']['samples'], 500)
+
+    def test_events_window_is_sorted(self):
+        events = self.index.events(10.01, 10.15)
+        np.testing.assert_array_equal(events['timestamp'], [10.02, 10.05, 10.1])
+        self.assertEqual(len(self.index.events(11, 12)), 0)
+
+    def test_frames(self):
+        self.assertEqual(self.index.frames(10.0, 10.2),
+                         [(10.0, 'screenshot', 'a.png'), (10.1, 'screenshot_repeat', 'a.png')])
+        self.assertEqual(self.index.frame_at(10.19), (10.1, 'screenshot_repeat', 'a.png'))
+        self.assertIsNone(self.index.frame_at(9.0))
+
+    def test_audio_range(self):
+        self.assertEqual(self.index.audio_range(10.0, 10.1), (100, 200))
+        self.assertEqual(self.index.audio_range(9.0, 20.0), (0, 500))
+
+    def test_query(self):
+        result = self.index.query(10.1, 10.3)
+        self.assertEqual(len(result['events']), 3)
+        self.assertEqual(len(result['frames']), 2)
+        self.assertEqual(result['audio'], (200, 400))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.dataset_loader import SessionDataset
+from src.shard_export import export_shards, find_recorded_sessions, iter_shard, read_sample, MANIFEST_FILE
+from tests.test_dataset_loader import make_session
+
+class TestShardExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sessions = [os.path.join(self.tmpdir, 'dataset', name) for name in ('a', 'b')]
+        for session in self.sessions:
+            make_session(session)
+        self.dataset = SessionDataset(self.sessions, event_window=0.3, audio_window=0.5)
+
+    def export(self, name, **kwargs):
+        output_dir = os.path.join(self.tmpdir, name)
+        return output_dir, export_shards(self.sessions, output_dir, shard_samples=5, event_window=0.3,
+                                         audio_window=0.5, seed=7, **kwargs)
+
+    def test_samples_round_trip(self):
+        output_dir, manifest = self.export('serial', workers=1)
+        self.assertEqual(manifest['samples'], 12)
+        self.assertEqual([entry['samples'] for entry in manifest['shards']], [5, 5, 2])
+        self.assertTrue(os.path.exists(os.path.join(output_dir, MANIFEST_FILE)))
+        seen = []
+        for entry in manifest['shards']:
+            for sample in iter_shard(os.path.join(output_dir, entry['name'])):
+                meta = sample['meta']
+                original = next(i for i in range(len(self.dataset))
+                                if self.dataset.sample_session[i] == meta['session']
+                                and self.dataset[i]['timestamp'] == meta['timestamp'])
+                expected = self.dataset[original]
+                np.testing.assert_array_equal(sample['frame'], expected['frame'])
+                np.testing.assert_array_equal(sample['events'], expected['events'])
+                np.testing.assert_array_equal(sample['audio'], expected['audio'])
+                self.assertEqual(meta['samplerate'], 1000)
+                seen.append(original)
+        self.assertEqual(sorted(seen), list(range(12)))
+        self.assertNotEqual(seen, list(range(12)))
+
+    def test_parallel_export_is_identical(self):
+        serial_dir, serial = self.export('serial', workers=1)
+        parallel_dir, parallel = self.export('parallel', workers=2)
+        self.assertEqual(serial['shards'], parallel['shards'])
+        for entry in serial['shards']:
+            with open(os.path.join(serial_dir, entry['name']), 'rb') as a, \
+                    open(os.path.join(parallel_dir, entry['name']), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_offsets_give_random_access(self):
+        output_dir, manifest = self.export('serial', workers=1)
+        sample = read_sample(output_dir, manifest, 7)
+        self.assertEqual(sample['key'], '000000007')
+        with tarfile.open(os.path.join(output_dir, manifest['shards'][1]['name'])) as tar:
+            self.assertEqual([name for name in tar.getnames() if name.startswith('000000007.')],
+                             ['000000007.json', '000000007.png', '000000007.events.npy', '000000007.audio.npy'])
+        with self.assertRaises(IndexError):
+            read_sample(output_dir, manifest, 12)
+
+    def test_find_sessions(self):
+        self.assertEqual(find_recorded_sessions(os.path.join(self.tmpdir, 'dataset')), self.sessions)
+
+if __name__ == '__main__':
+    unittest.main()
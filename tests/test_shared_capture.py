@@ -0,0 +1,109 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.buffers import StreamBuffers
+from src.change_detection import load_frame
+from src.shared_capture import SharedFrameRing, SharedMemoryCapture
+
+class TestSharedFrameRing(unittest.TestCase):
+    def test_fifo_slots_and_full_ring(self):
+        ring = SharedFrameRing(2, 48)
+        self.addCleanup(ring.close)
+        frames = [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(3)]
+        first = ring.write(frames[0])
+        second = ring.write(frames[1])
+        self.assertIsNone(ring.write(frames[2]))
+        np.testing.assert_array_equal(ring.read(first), frames[0])
+        third = ring.write(frames[2])
+        self.assertEqual(third[0], first[0])
+        np.testing.assert_array_equal(ring.read(second), frames[1])
+        np.testing.assert_array_equal(ring.read(third), frames[2])
+        self.assertEqual(ring.in_use(), 0)
+
+    def test_frame_too_large(self):
+        ring = SharedFrameRing(1, 16)
+        self.addCleanup(ring.close)
+        with self.assertRaises(ValueError):
+            ring.write(np.zeros((4, 4, 3), dtype=np.uint8))
+
+class TestSharedMemoryCapture(unittest.TestCase):
+    def test_frames_stored_by_child_processes(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = {'screenshot_backend': 'synthetic', 'screenshot_backend_options': {'width': 32, 'height': 32},
+                  'screenshot_change_detection': False, 'shared_memory_slots': 4}
+        output_queue = StreamBuffers()
+        capture = SharedMemoryCapture(output_queue, config, 20, tmpdir)
+        capture.start()
+        time.sleep(1.5)
+        capture.stop()
+        events = []
+        while not output_queue.empty():
+            events.append(output_queue.get(block=False))
+        self.assertGreater(len(events), 0)
+        self.assertTrue(all(event[0] == 'screenshot_stored' for event in events))
+        timestamp, event_type, filename = events[-1][2]
+        self.assertEqual(event_type, 'screenshot')
+        frame = load_frame(os.path.join(tmpdir, 'screenshots'), filename)
+        self.assertEqual(frame.shape, (32, 32, 3))
+        self.assertEqual(capture.stats()['rows'], len(events))
+
+    def test_ring_grows_with_the_screen(self):
+        # The slots are sized from the first frame; once the screen grows
+        # the ring must move to bigger slots rather than fail every tick.
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = {'screenshot_backend': 'synthetic',
+                  'screenshot_backend_options': {'width': 32, 'height': 32, 'resize_at': 5, 'resize_to': [64, 48]},
+                  'screenshot_change_detection': False, 'shared_memory_slots': 4}
+        output_queue = StreamBuffers()
+        capture = SharedMemoryCapture(output_queue, config, 20, tmpdir)
+        with self.assertLogs(level='WARNING') as logs:
+            capture.start()
+            time.sleep(1.5)
+            capture.stop()
+        self.assertFalse([line for line in logs.output if line.startswith('ERROR')])
+        self.assertTrue(any('resized' in line for line in logs.output))
+        rows = []
+        while not output_queue.empty():
+            rows.append(output_queue.get(block=False)[2])
+        self.assertGreater(len(rows), 10)
+        shapes = [load_frame(os.path.join(tmpdir, 'screenshots'), row[2]).shape for row in rows]
+        self.assertEqual(shapes[:5], [(32, 32, 3)] * 5)
+        self.assertEqual(set(shapes[5:]), {(48, 64, 3)})
+
+    def test_rollover_routes_frames_in_flight_by_timestamp(self):
+        # Slow PNG encoding keeps several frames queued behind the encoder
+        # when the cut is taken; each must land in the session its
+        # timestamp belongs to.
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        first, second = os.path.join(tmpdir, 'first'), os.path.join(tmpdir, 'second')
+        config = {'screenshot_backend': 'synthetic', 'screenshot_backend_options': {'width': 640, 'height': 480},
+                  'screenshot_change_detection': True, 'screenshot_quality': 9, 'shared_memory_slots': 8}
+        output_queue = StreamBuffers()
+        capture = SharedMemoryCapture(output_queue, config, 60, first)
+        capture.start()
+        time.sleep(1.0)
+        cut_time = capture.rollover(second)
+        time.sleep(1.0)
+        capture.stop()
+        rows = []
+        while not output_queue.empty():
+            rows.append(output_queue.get(block=False)[2])
+        before = [row for row in rows if row[0] < cut_time]
+        after = [row for row in rows if row[0] >= cut_time]
+        self.assertTrue(before and after)
+        self.assertEqual(after[0][1], 'screenshot')
+        for session_dir, session_rows in ((first, before), (second, after)):
+            for timestamp, event_type, filename in session_rows:
+                if event_type != 'screenshot_repeat':
+                    self.assertTrue(os.path.exists(os.path.join(session_dir, 'screenshots', filename)), filename)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import os
+import wave
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from src.audio_storage import AudioSegmentWriter, AudioSegmentReader, AUDIO_DIR, SEGMENT_INDEX_FILE, recover_audio
+from src.event_log import (EventLogWriter, CsvEventWriter, EventLog, EVENT_LOG_FILE, STRING_TABLE_FILE, BATCH_FILE, CSV_FILE, RECORD,
+                           recover_event_log, recover_csv)
+from src.session_index import SessionIndex
+from src.storage_sink import GroupSync, StorageSink, recover_session
+
+CONFIG = {'audio_samplerate': 8000, 'audio_channels': 1, 'storage_max_loss': 0.2}
+
+class TestEventLogRecovery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write_batches(self, batches=3, batch_size=4):
+        # A recorder killed after its last flush: nothing is closed.
+        writer = EventLogWriter(self.tmpdir, batch_size=batch_size)
+        for i in range(batches * batch_size):
+            writer.append(float(i), 'key_press', f"'{i % 5}'")
+        writer.flush()
+        return writer
+
+    def test_intact_log_is_kept(self):
+        self.write_batches()
+        self.assertEqual(recover_event_log(self.tmpdir), (12, 0))
+        self.assertEqual(len(EventLog(self.tmpdir)), 12)
+
+    def test_partial_and_corrupt_batches_are_dropped(self):
+        writer = self.write_batches()
+        # Half a record beyond the last batch, and a damaged last batch.
+        writer._file.write(b'\x01' * (RECORD.size // 2))
+        writer._file.flush()
+        path = os.path.join(self.tmpdir, EVENT_LOG_FILE)
+        with open(path, 'r+b') as f:
+            f.seek(-RECORD.size, os.SEEK_END)
+            f.write(b'\xff' * 8)
+        self.assertEqual(recover_event_log(self.tmpdir), (8, 4))
+        log = EventLog(self.tmpdir)
+        self.assertEqual([float(t) for t in log.records['timestamp']], [float(i) for i in range(8)])
+        self.assertEqual(os.path.getsize(os.path.join(self.tmpdir, BATCH_FILE)), 2 * 16 + 8)
+
+    def test_batch_missing_its_strings_is_dropped(self):
+        writer = self.write_batches(batches=1)
+        writer.append(9.0, 'key_press', 'Key.new')
+        writer.flush()
+        strings = os.path.join(self.tmpdir, STRING_TABLE_FILE)
+        with open(strings, 'r+b') as f:
+            f.truncate(os.path.getsize(strings) - 3)
+        self.assertEqual(recover_event_log(self.tmpdir), (4, 1))
+        log = EventLog(self.tmpdir)
+        self.assertEqual([log.event_data(record) for record in log.records], ["'0'", "'1'", "'2'", "'3'"])
+
+    def test_partial_csv_row(self):
+        with open(os.path.join(self.tmpdir, CSV_FILE), 'w') as f:
+            f.write("Timestamp,EventType,Data\n1.0,key_press,key='a'\n1.1,mouse_mo")
+        self.assertTrue(recover_csv(self.tmpdir))
+        self.assertFalse(recover_csv(self.tmpdir))
+        with open(os.path.join(self.tmpdir, CSV_FILE)) as f:
+            self.assertEqual(f.read(), "Timestamp,EventType,Data\n1.0,key_press,key='a'\n")
+
+class _SyncOnFlush:
+    # Runs a sync round in the middle of the writer's flush(), right before
+    # the file's buffer reaches the OS.
+    def __init__(self, f, writer):
+        self.f = f
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def flush(self):
+        self.writer.sync()
+        self.f.flush()
+
+class TestFlushAndSync(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def check(self, writer):
+        # The round inside flush() has nothing new to sync; the next one
+        # syncs the whole flushed batch.
+        with patch('src.event_log.sync_file') as sync_file:
+            writer.flush()
+            self.assertEqual(sync_file.call_count, 0)
+            writer.sync()
+            self.assertGreater(sync_file.call_count, 0)
+        writer.close()
+
+    def test_binary_log(self):
+        writer = EventLogWriter(self.tmpdir, batch_size=8)
+        for i in range(3):
+            writer.append(float(i), 'key_press', f"'{i}'")
+        writer._file = _SyncOnFlush(writer._file, writer)
+        self.check(writer)
+        self.assertEqual(len(EventLog(self.tmpdir)), 3)
+
+    def test_csv(self):
+        writer = CsvEventWriter(self.tmpdir)
+        for i in range(3):
+            writer.append(float(i), 'key_press', f"'{i}'")
+        writer._file = _SyncOnFlush(writer._file, writer)
+        self.check(writer)
+
+class TestAudioRecovery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.audio = (np.arange(12000) % 300 - 150).astype(np.int16)[:, None]
+
+    def test_header_patched_on_sync(self):
+        writer = AudioSegmentWriter(self.tmpdir, 8000, 1, segment_seconds=1)
+        writer.write(self.audio, 100.0)
+        writer.sync()
+        # Readable by the wave module before the writer is closed.
+        for segment, samples in (('segment_00000.wav', 8000), ('segment_00001.wav', 4000)):
+            with wave.open(os.path.join(self.tmpdir, segment)) as wav:
+                self.assertEqual(wav.getnframes(), samples)
+        writer.close()
+
+    def test_recover_killed_segment(self):
+        writer = AudioSegmentWriter(self.tmpdir, 8000, 1, segment_seconds=1)
+        writer.write(self.audio[:9000], 100.0)
+        writer.sync()
+        writer.write(self.audio[9000:], 100.0)
+        writer._segment.file.flush()
+        # Half a sample frame and half an index record after the kill.
+        with open(os.path.join(self.tmpdir, 'segment_00001.wav'), 'ab') as f:
+            f.write(b'\x01')
+        with open(os.path.join(self.tmpdir, SEGMENT_INDEX_FILE), 'ab') as f:
+            f.write(b'\x02' * 5)
+        self.assertEqual(recover_audio(self.tmpdir), 12000)
+        with wave.open(os.path.join(self.tmpdir, 'segment_00001.wav')) as wav:
+            self.assertEqual(wav.getnframes(), 4000)
+        reader = AudioSegmentReader(self.tmpdir, 8000)
+        np.testing.assert_array_equal(reader.read(0, reader.total_samples), self.audio)
+
+    def test_headerless_segment_is_removed(self):
+        writer = AudioSegmentWriter(self.tmpdir, 8000, 1, segment_seconds=1)
+        writer.write(self.audio[:8000], 100.0)
+        writer.close()
+        with open(os.path.join(self.tmpdir, 'segment_00001.wav'), 'wb') as f:
+            f.write(b'RIFF')
+        with open(os.path.join(self.tmpdir, SEGMENT_INDEX_FILE), 'ab') as f:
+            f.write(b'\x00' * 16)
+        self.assertEqual(recover_audio(self.tmpdir), 8000)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['segment_00000.wav', SEGMENT_INDEX_FILE])
+        self.assertEqual(os.path.getsize(os.path.join(self.tmpdir, SEGMENT_INDEX_FILE)), 16)
+
+class TestStorageSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_group_sync_only_syncs_new_data(self):
+        class Target:
+            def __init__(self):
+                self.records_written = self.syncs = self._synced = 0
+
+            def sync(self):
+                if self.records_written != self._synced:
+                    self._synced = self.records_written
+                    self.syncs += 1
+        target = Target()
+        group = GroupSync(max_loss=1.0)
+        group.register(target)
+        group.sync()
+        target.records_written = 3
+        group.sync()
+        group.sync()
+        self.assertEqual((target.syncs, group.stats()['sync_rounds']), (1, 3))
+        self.assertEqual(group.interval, 0.5)
+
+    def test_killed_session_is_recovered(self):
+        sink = StorageSink(self.tmpdir, CONFIG)
+        sink.start()
+        for i in range(10):
+            sink.append(100.0 + i, 'mouse_move', (i, i))
+        sink.audio.write(np.zeros((4000, 1), dtype=np.int16), 100.0)
+        sink.flush()
+        sink.group_sync.sync()
+        sink.group_sync.stop()
+        # Events appended but never flushed are lost with the process.
+        sink.append(111.0, 'mouse_move', (0, 0))
+        report = recover_session(self.tmpdir, CONFIG)
+        self.assertEqual((report['events'], report['dropped_events'], report['audio_samples']), (10, 0, 4000))
+        index = SessionIndex(self.tmpdir)
+        self.assertEqual(index.meta['events'], 10)
+        self.assertTrue(os.path.isdir(os.path.join(self.tmpdir, AUDIO_DIR)))
+
+    def test_csv_format(self):
+        sink = StorageSink(self.tmpdir, dict(CONFIG, event_log_format='csv'))
+        self.assertFalse(sink.binary)
+        sink.append(1.0, 'key_press', "'a'")
+        sink.close()
+        with open(os.path.join(self.tmpdir, CSV_FILE)) as f:
+            self.assertEqual(f.read().splitlines()[1], "1.0,key_press,key='a'")
+        self.assertEqual(recover_session(self.tmpdir, CONFIG)['csv_truncated'], False)
+
+if __name__ == '__main__':
+    unittest.main()
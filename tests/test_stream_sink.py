@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from benchmarks.recorder_benchmark import BenchmarkRecorder, ROOT
+from src.audio_storage import AudioSegmentReader, AUDIO_DIR
+from src.event_log import EventLog
+from src.session_index import SessionIndex
+from src.stream_collector import StreamCollector
+from src.stream_sink import (StreamClient, StreamSink, HELLO, OPEN, EVENTS, FILE, CLOSE, ACK, ACK_OK,
+                             ACK_REJECTED, BATCH_HEADER, BATCH_MAGIC, FILE_HEADER, FLAG_ZLIB, encode_batch,
+                             encode_message, read_batch, recv_exact, parse_address)
+
+CONFIG = {'audio_samplerate': 1000, 'audio_channels': 2, 'storage_max_loss': 0.2, 'stream_batch_interval': 0.05,
+          'stream_source': 'workstation', 'stream_close_timeout': 10}
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+class TestFraming(unittest.TestCase):
+    def test_batch_round_trip(self):
+        messages = [encode_message(EVENTS, 'session_a', b'[1, 2]'), encode_message(EVENTS, '', b'')]
+        left, right = socket.socketpair()
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        for seq, compression in enumerate(('zlib', 'none')):
+            left.sendall(encode_batch(seq, messages, compression))
+            self.assertEqual(read_batch(right), (seq, [(EVENTS, 'session_a', b'[1, 2]'), (EVENTS, '', b'')]))
+
+    def test_addresses(self):
+        self.assertEqual(parse_address('tcp://localhost:7070')[1], ('localhost', 7070))
+        self.assertEqual(parse_address(':7070')[1], ('127.0.0.1', 7070))
+        self.assertEqual(parse_address('unix:///tmp/collector.sock')[1], '/tmp/collector.sock')
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.output_dir = os.path.join(self.tmpdir, 'collected')
+
+    def start_collector(self, address='tcp://127.0.0.1:0'):
+        collector = StreamCollector(self.output_dir, CONFIG, address).start()
+        self.addCleanup(collector.stop)
+        return collector
+
+    def record(self, client, name, events=20, blocks=5):
+        session_dir = os.path.join(self.tmpdir, client.source, name)
+        os.makedirs(os.path.join(session_dir, 'screenshots'))
+        sink = StreamSink(session_dir, CONFIG, client)
+        for i in range(events):
+            if i % 5 == 0:
+                with open(os.path.join(session_dir, 'screenshots', f"screenshot_{i}.png"), 'wb') as f:
+                    f.write(bytes([i]) * 100)
+                sink.append(100.0 + i * 0.1, 'screenshot', f"screenshot_{i}.png")
+            else:
+                sink.append(100.0 + i * 0.1, 'mouse_move', (i, 2 * i))
+            if i % 7 == 0:
+                sink.flush()
+        for block in range(blocks):
+            sink.audio.write(np.full((100, 2), block, dtype=np.int16), 100.0 + block * 0.1)
+        sink.close()
+        return session_dir
+
+    def check_session(self, session_dir, events=20, blocks=5):
+        log = EventLog(session_dir)
+        self.assertEqual(len(log), events)
+        self.assertEqual(log.event_data(log.records[1]), (1, 2))
+        with open(os.path.join(session_dir, 'screenshots', 'screenshot_5.png'), 'rb') as f:
+            self.assertEqual(f.read(), bytes([5]) * 100)
+        reader = AudioSegmentReader(os.path.join(session_dir, AUDIO_DIR), 1000)
+        self.assertEqual(reader.total_samples, blocks * 100)
+        self.assertEqual(reader.start_time, 100.0)
+        self.assertEqual(SessionIndex(session_dir).meta['events'], events)
+
+    def test_many_recorders_one_collector(self):
+        collector = self.start_collector(f"unix://{self.tmpdir}/collector.sock")
+        clients = [StreamClient({**CONFIG, 'stream_address': collector.address, 'stream_source': f"host{i}"})
+                   .start() for i in range(3)]
+        threads = [threading.Thread(target=self.record, args=(client, 'session_1')) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for client in clients:
+            client.close()
+            self.assertEqual(client.stats()['queued_batches'], 0)
+        self.assertTrue(wait_for(lambda: collector.stats()['sessions_closed'] == 3))
+        for i in range(3):
+            self.check_session(os.path.join(self.output_dir, f"host{i}", 'session_1'))
+        # Frames are removed locally once acked.
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'host0', 'session_1', 'screenshots')), [])
+
+    def test_reconnect_resends_unacknowledged_batches(self):
+        # No collector yet: everything waits in memory and the spool.
+        collector = StreamCollector(self.output_dir, CONFIG, 'tcp://127.0.0.1:0').start()
+        address = collector.address
+        collector.stop()
+        client = StreamClient({**CONFIG, 'stream_address': address, 'stream_buffer_bytes': 200,
+                               'stream_spool_dir': os.path.join(self.tmpdir, 'spool')}).start()
+        session_dir = self.record(client, 'session_1')
+        self.assertGreater(client.stats()['batches_spooled'], 0)
+        self.assertFalse(client.stats()['connected'])
+        # Nothing is acked yet, so the local frames are still there.
+        self.assertEqual(len(os.listdir(os.path.join(session_dir, 'screenshots'))), 4)
+        collector = self.start_collector(address)
+        client.close()
+        self.assertTrue(wait_for(lambda: collector.stats()['sessions_closed'] == 1))
+        self.check_session(os.path.join(self.output_dir, 'workstation', 'session_1'))
+        self.assertEqual(os.listdir(os.path.join(session_dir, 'screenshots')), [])
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'spool')), ['client.json'])
+
+    def test_restart_replays_spool(self):
+        # A client gives up on an absent collector with a session still
+        # open, as if the recorder died; the next client on the same spool
+        # sends everything and closes that session.
+        collector = StreamCollector(self.output_dir, CONFIG, 'tcp://127.0.0.1:0').start()
+        address = collector.address
+        collector.stop()
+        spool_dir = os.path.join(self.tmpdir, 'spool')
+        config = {**CONFIG, 'stream_address': address, 'stream_buffer_bytes': 200, 'stream_spool_dir': spool_dir}
+        client = StreamClient(config).start()
+        self.record(client, 'session_1')
+        client.open_session('session_2', {'audio_samplerate': 1000, 'audio_channels': 2})
+        client.send(EVENTS, 'session_2', b'[[200.0, "key_press", "a"]]')
+        client.close(timeout=0.2)
+        spooled = [name for name in os.listdir(spool_dir) if name.endswith('.batch')]
+        self.assertEqual(len(spooled), client.stats()['queued_batches'])
+        collector = self.start_collector(address)
+        restarted = StreamClient(config).start()
+        self.assertEqual(restarted.client_id, client.client_id)
+        self.assertEqual(restarted.pending(), len(spooled) + 1)
+        restarted.close()
+        self.assertEqual(restarted.stats()['queued_batches'], 0)
+        self.assertTrue(wait_for(lambda: collector.stats()['sessions_closed'] == 2))
+        self.check_session(os.path.join(self.output_dir, 'workstation', 'session_1'))
+        self.assertEqual(len(EventLog(os.path.join(self.output_dir, 'workstation', 'session_2'))), 1)
+        self.assertEqual(os.listdir(spool_dir), ['client.json'])
+
+    def test_duplicate_batches_are_skipped(self):
+        # A batch whose ack was lost arrives twice; it is applied once.
+        collector = self.start_collector()
+        connection = socket.create_connection(parse_address(collector.address)[1])
+        self.addCleanup(connection.close)
+        hello = {'client': 'c1', 'source': 'workstation', 'sessions': {}}
+        connection.sendall(encode_batch(0, [encode_message(HELLO, '', json.dumps(hello).encode())]))
+        self.assertEqual(ACK.unpack(recv_exact(connection, ACK.size)), (0, ACK_OK))
+        meta = json.dumps({'audio_samplerate': 1000, 'audio_channels': 2}).encode()
+        batch = encode_batch(1, [encode_message(OPEN, 'session_1', meta),
+                                 encode_message(EVENTS, 'session_1', b'[[100.0, "key_press", "a"]]')])
+        for _ in range(2):
+            connection.sendall(batch)
+            self.assertEqual(ACK.unpack(recv_exact(connection, ACK.size)), (1, ACK_OK))
+        connection.sendall(encode_batch(2, [encode_message(CLOSE, 'session_1', b'')]))
+        self.assertEqual(ACK.unpack(recv_exact(connection, ACK.size)), (2, ACK_OK))
+        self.assertEqual(collector.stats()['duplicate_batches'], 1)
+        self.assertEqual(len(EventLog(os.path.join(self.output_dir, 'workstation', 'session_1'))), 1)
+
+    def test_batches_are_synced_before_the_ack(self):
+        # With the group sync far off, only the collector's own sync can
+        # have made the batch durable by the time its ack arrives.
+        collector = StreamCollector(self.output_dir, {**CONFIG, 'storage_max_loss': 100}, 'tcp://127.0.0.1:0').start()
+        self.addCleanup(collector.stop)
+        connection = socket.create_connection(parse_address(collector.address)[1])
+        self.addCleanup(connection.close)
+        hello = {'client': 'c1', 'source': 'workstation', 'sessions': {}}
+        connection.sendall(encode_batch(0, [encode_message(HELLO, '', json.dumps(hello).encode())]))
+        recv_exact(connection, ACK.size)
+        meta = json.dumps({'audio_samplerate': 1000, 'audio_channels': 2}).encode()
+        name = b'screenshots/screenshot_1.png'
+        frame = encode_message(FILE, 'session_1', FILE_HEADER.pack(0, True, len(name)) + name + b'png')
+        with patch('src.stream_collector.sync_path') as sync_path:
+            row = encode_message(EVENTS, 'session_1', b'[[100.0, "screenshot", "screenshot_1.png"]]')
+            connection.sendall(encode_batch(1, [encode_message(OPEN, 'session_1', meta), frame, row]))
+            self.assertEqual(ACK.unpack(recv_exact(connection, ACK.size)), (1, ACK_OK))
+        session = collector.sessions[('workstation', 'session_1')]
+        self.assertEqual(session.sink.events._synced_records, 1)
+        synced = [call[0][0] for call in sync_path.call_args_list]
+        self.assertIn(os.path.join(session.session_dir, 'screenshots'), synced)
+        self.assertIn(session.session_dir, synced)
+
+    def test_unreadable_batch_is_rejected(self):
+        # A batch that can never be applied is acked as rejected, and the
+        # stream goes on with the next one.
+        collector = self.start_collector()
+        connection = socket.create_connection(parse_address(collector.address)[1])
+        self.addCleanup(connection.close)
+        hello = {'client': 'c1', 'source': 'workstation', 'sessions': {}}
+        connection.sendall(encode_batch(0, [encode_message(HELLO, '', json.dumps(hello).encode())]))
+        recv_exact(connection, ACK.size)
+        connection.sendall(BATCH_HEADER.pack(BATCH_MAGIC, FLAG_ZLIB, 1, 5) + b'\x00' * 5)
+        self.assertEqual(ACK.unpack(recv_exact(connection, ACK.size)), (1, ACK_REJECTED))
+        meta = json.dumps({'audio_samplerate': 1000, 'audio_channels': 2}).encode()
+        connection.sendall(encode_batch(2, [encode_message(OPEN, 'session_1', meta)]))
+        self.assertEqual(ACK.unpack(recv_exact(connection, ACK.size)), (2, ACK_OK))
+        self.assertEqual((collector.stats()['rejected_batches'], collector.stats()['sessions_open']), (1, 1))
+
+    def test_large_files_are_sent_in_chunks(self):
+        collector = self.start_collector()
+        client = StreamClient({**CONFIG, 'stream_address': collector.address, 'stream_batch_bytes': 65536}).start()
+        session_dir = os.path.join(self.tmpdir, 'workstation', 'session_1')
+        os.makedirs(os.path.join(session_dir, 'video'))
+        data = np.random.default_rng(0).integers(0, 256, 300000, dtype=np.uint8).tobytes()
+        with open(os.path.join(session_dir, 'video', 'segment_00000.mkv'), 'wb') as f:
+            f.write(data)
+        sink = StreamSink(session_dir, {**CONFIG, 'stream_file_chunk_bytes': 65536}, client)
+        sink.close()
+        client.close()
+        self.assertGreaterEqual(client.stats()['batches_sent'], 5)
+        self.assertTrue(wait_for(lambda: collector.stats()['sessions_closed'] == 1))
+        with open(os.path.join(self.output_dir, 'workstation', 'session_1', 'video', 'segment_00000.mkv'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(os.path.join(session_dir, 'video')), [])
+        with self.assertRaises(ValueError):
+            client.send(EVENTS, 'session_1', bytes(65 << 20))
+
+class TestRecorderStreaming(unittest.TestCase):
+    def test_recorder_streams_sessions(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        collector = StreamCollector(os.path.join(tmpdir, 'collected'), CONFIG, 'tcp://127.0.0.1:0').start()
+        self.addCleanup(collector.stop)
+        recorder = BenchmarkRecorder(os.path.join(ROOT, 'config.yaml'), 200,
+                                     base_output_dir=os.path.join(tmpdir, 'local'), screenshot_freq=10,
+                                     screenshot_backend='synthetic', screenshot_backend_options={'width': 64, 'height': 48},
+                                     encoder_workers=0, buffer_time=0.2, metrics_port=None,
+                                     stream_address=collector.address, stream_source='desk',
+                                     session_rollover_grace=0.2)
+        recorder.start()
+        time.sleep(0.5)
+        recorder.rollover()
+        time.sleep(0.5)
+        recorder.stop()
+        self.assertTrue(wait_for(lambda: collector.stats()['sessions_closed'] == 2))
+        sessions = sorted(os.listdir(os.path.join(tmpdir, 'collected', 'desk')))
+        self.assertEqual(len(sessions), 2)
+        samples = 0
+        for name in sessions:
+            session_dir = os.path.join(tmpdir, 'collected', 'desk', name)
+            index = SessionIndex(session_dir)
+            frames = index.frames(0, float('inf'))
+            self.assertEqual(frames[0][1], 'screenshot')
+            for _, event_type, reference in frames:
+                if event_type != 'screenshot_repeat':
+                    self.assertTrue(os.path.exists(os.path.join(session_dir, 'screenshots', reference)))
+            samples += AudioSegmentReader(os.path.join(session_dir, AUDIO_DIR),
+                                          recorder.audio_recorder.samplerate).total_samples
+        self.assertEqual(samples, recorder.audio_recorder.frames_written)
+
+if __name__ == '__main__':
+    unittest.main()
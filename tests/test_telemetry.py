@@ -0,0 +1,80 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import urllib.request
+import urllib.error
+
+from src.telemetry import MetricsRegistry, MetricsServer, MetricsFileWriter
+from tests.recorder_helpers import record
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter('test_events_total', 'Events').inc(3, type='key_press')
+        latency = self.registry.histogram('test_latency_seconds', 'Latency', buckets=(0.01, 0.1))
+        for value in (0.005, 0.05, 0.5):
+            latency.observe(value)
+        self.registry.register(lambda: [('test_queue_depth', 'gauge', 'Depth', {'stream': 'input'}, 7),
+                                        ('test_missing', 'gauge', 'Skipped', None, None)])
+
+    def test_prometheus_text(self):
+        text = self.registry.render()
+        self.assertIn('# TYPE test_events_total counter', text)
+        self.assertIn('test_events_total{type="key_press"} 3.0', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.01"} 1.0', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 2.0', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 3.0', text)
+        self.assertIn('test_latency_seconds_count 3.0', text)
+        self.assertIn('test_queue_depth{stream="input"} 7.0', text)
+        self.assertNotIn('test_missing', text)
+
+    def test_failing_collector_does_not_break_render(self):
+        self.registry.register(lambda: 1 / 0)
+        with self.assertLogs(level='ERROR'):
+            self.assertIn('test_queue_depth', self.registry.render())
+
+    def test_http_endpoint(self):
+        server = MetricsServer(self.registry, port=0)
+        server.start()
+        self.addCleanup(server.stop)
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+            self.assertIn('test_queue_depth', response.read().decode())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'http://127.0.0.1:{server.port}/other')
+
+    def test_stats_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'metrics.json')
+        writer = MetricsFileWriter(self.registry, path, interval=60)
+        writer.start()
+        writer.stop()
+        with open(path) as f:
+            metrics = json.load(f)['metrics']
+        self.assertEqual(metrics['test_queue_depth'][0]['value'], 7)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+class TestRecorderMetrics(unittest.TestCase):
+    def test_recorder_stages_are_collected(self):
+        from src.event_log import EventLog
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        recorder = record(tmpdir, [('key_press', 1.0, 'a'), ('mouse_move', 2.0, (1, 2))])
+        text = recorder.metrics.render()
+        self.assertIn('recorder_event_write_latency_seconds_count{type="key_press"} 1.0', text)
+        self.assertIn('recorder_events_written_total 2.0', text)
+        self.assertIn('recorder_queue_depth{stream="screenshot"} 0.0', text)
+        self.assertEqual(len(list(EventLog(tmpdir).rows())), 2)
+
+    def test_no_listener_by_default(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        recorder = record(tmpdir, [])
+        recorder._start_metrics()
+        self.addCleanup(recorder._stop_metrics)
+        self.assertIsNone(recorder.metrics_server)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import math
+import unittest
+from unittest.mock import MagicMock
+
+from src.trajectory import TrajectorySimplifier, synchronized_distance
+from src.mouse_keyboard_recorder import MouseKeyboardRecorder
+
+def feed(simplifier, points):
+    kept = []
+    for point in points:
+        kept.extend(simplifier.add(*point))
+    return kept + simplifier.flush()
+
+class TestTrajectorySimplifier(unittest.TestCase):
+    def test_straight_constant_speed_drag_keeps_endpoints(self):
+        points = [(i * 0.01, i * 5, i * 2) for i in range(9)]
+        kept = feed(TrajectorySimplifier(tolerance=1.0, max_delay=1.0), points)
+        self.assertEqual(kept, [points[0], points[-1]])
+
+    def test_keeps_corner(self):
+        points = [(i * 0.01, i * 10, 0) for i in range(6)] + [(0.05 + i * 0.01, 50, i * 10) for i in range(1, 6)]
+        kept = feed(TrajectorySimplifier(tolerance=1.0, max_delay=1.0), points)
+        self.assertIn((0.05, 50, 0), kept)
+        self.assertEqual(kept[-1], points[-1])
+
+    def test_keeps_pause_on_straight_line(self):
+        # Same path as a straight drag, but the pointer stops halfway.
+        points = [(0.0, 0, 0), (0.01, 10, 0), (0.02, 20, 0), (0.5, 20, 0), (0.51, 30, 0), (0.52, 40, 0)]
+        kept = feed(TrajectorySimplifier(tolerance=1.0, max_delay=1.0), points)
+        self.assertGreater(len(kept), 2)
+        self.assertIn((0.02, 20, 0), kept)
+
+    def test_error_bound(self):
+        points = [(i * 0.01, 100 * math.cos(i / 10), 100 * math.sin(i / 10)) for i in range(200)]
+        kept = feed(TrajectorySimplifier(tolerance=2.0, max_delay=10.0, max_window=1000), points)
+        self.assertLess(len(kept), len(points) / 3)
+        for point in points:
+            later = next(k for k in kept if k[0] >= point[0])
+            earlier = [k for k in kept if k[0] <= point[0]][-1]
+            if later != earlier:
+                self.assertLessEqual(synchronized_distance(point, earlier, later), 2.0 + 1e-9)
+
+    def test_max_delay_releases_held_point(self):
+        simplifier = TrajectorySimplifier(tolerance=5.0, max_delay=0.1)
+        simplifier.add(0.0, 0, 0)
+        self.assertEqual(simplifier.add(0.05, 5, 0), [])
+        self.assertEqual(simplifier.expire(0.1), [])
+        self.assertEqual(simplifier.expire(0.2), [(0.05, 5, 0)])
+        self.assertEqual(simplifier.expire(1.0), [])
+
+class TestMouseKeyboardRecorderMoves(unittest.TestCase):
+    def test_click_flushes_held_move(self):
+        queue = MagicMock()
+        recorder = MouseKeyboardRecorder(queue, {'mask_keys': [], 'mouse_move_max_delay': 10.0,
+                                                 'mouse_move_tolerance': 1000})
+        recorder.running = True
+        for x in range(0, 50, 10):
+            recorder._on_move(x, 0)
+        recorder._on_click(40, 0, 'Button.left', True)
+        events = [call.args[0] for call in queue.put.call_args_list]
+        self.assertEqual([e[0] for e in events], ['mouse_move', 'mouse_move', 'mouse_click'])
+        self.assertEqual(events[1][2], (40, 0))
+
+    def test_throttle_mode(self):
+        queue = MagicMock()
+        recorder = MouseKeyboardRecorder(queue, {'mask_keys': [], 'mouse_move_mode': 'throttle',
+                                                 'mouse_move_throttle': 60})
+        recorder.running = True
+        recorder._on_move(0, 0)
+        recorder._on_move(1, 1)
+        self.assertEqual(queue.put.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
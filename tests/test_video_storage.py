@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from src.change_detection import load_frame
+from src.event_log import EventLog
+from src.frame_sources import SyntheticFrameSource
+from src.video_storage import VideoFrameStore, VideoFrameReader, VideoReaderCache
+from tests.recorder_helpers import record
+
+class TestVideoFrameStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        source = SyntheticFrameSource(width=64, height=48, block_size=8)
+        self.frames = [source.grab() for _ in range(7)]
+
+    def write_frames(self):
+        store = VideoFrameStore(self.tmpdir, fps=10, segment_frames=3)
+        references = []
+        for i, frame in enumerate(self.frames):
+            reference, future = store.submit(100 + i * 0.1, frame)
+            references.append(reference)
+        future.result()
+        store.close()
+        return references
+
+    def test_segments_and_index(self):
+        references = self.write_frames()
+        self.assertEqual(references[0], 'segment_00000.mkv#0')
+        self.assertEqual(references[4], 'segment_00001.mkv#1')
+        self.assertEqual(references[6], 'segment_00002.mkv#0')
+        reader = VideoFrameReader(self.tmpdir)
+        self.assertEqual(len(reader.index), 7)
+        self.assertEqual(reader.index['segment'].tolist(), [0, 0, 0, 1, 1, 1, 2])
+        self.assertAlmostEqual(reader.index['timestamp'][5], 100.5)
+
+    def test_random_access_is_exact(self):
+        references = self.write_frames()
+        reader = VideoFrameReader(self.tmpdir)
+        for i in [5, 1, 2, 6, 0]:
+            np.testing.assert_array_equal(reader.read_reference(references[i]), self.frames[i])
+        np.testing.assert_array_equal(reader.read_at(100.45), self.frames[4])
+        reader.close()
+        np.testing.assert_array_equal(load_frame(self.tmpdir, references[3]), self.frames[3])
+
+    def test_cached_readers_index_each_directory_once(self):
+        references = self.write_frames()
+        readers = VideoReaderCache()
+        self.addCleanup(readers.close)
+        with patch('src.video_storage.VideoFrameReader', wraps=VideoFrameReader) as opened:
+            for i in range(len(self.frames)):
+                np.testing.assert_array_equal(load_frame(self.tmpdir, references[i], readers), self.frames[i])
+        self.assertEqual(opened.call_count, 1)
+
+    def test_new_segment_on_size_change(self):
+        store = VideoFrameStore(self.tmpdir, fps=10)
+        first, _ = store.submit(1.0, self.frames[0])
+        second, future = store.submit(1.1, np.zeros((16, 16, 3), dtype=np.uint8))
+        future.result()
+        store.close()
+        self.assertEqual((first, second), ('segment_00000.mkv#0', 'segment_00001.mkv#0'))
+
+class TestRecorderVideoStorage(unittest.TestCase):
+    def test_rows_reference_video_frames(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        source = SyntheticFrameSource(width=32, height=32, block_size=8)
+        frames = [source.grab() for _ in range(3)]
+        record(tmpdir, [('screenshot', 10 + i * 0.1, frame) for i, frame in enumerate(frames)],
+               screenshot_storage='video')
+        rows = list(EventLog(tmpdir).rows())
+        self.assertEqual(len(rows), 3)
+        screenshots_dir = os.path.join(tmpdir, 'screenshots')
+        np.testing.assert_array_equal(load_frame(screenshots_dir, rows[2][2]), frames[2])
+
+if __name__ == '__main__':
+    unittest.main()